@@ -20,10 +20,11 @@ from sanic import Blueprint, Sanic
 from sanic.websocket import WebSocketProtocol
 
 from omega.config import get_config_dir
+from omega.core import metrics
 from omega.core.events import Events
 from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
 from omega.interfaces import jobs, quotes, sys
-from omega.jobs import syncjobs
+from omega.jobs import backfill, sharding, syncjobs, valuation
 
 cfg = cfg4py.get_instance()
 
@@ -38,6 +39,8 @@ class Omega(object):
         self.gid = kwargs.get("account")
 
         self.fetcher_impl = fetcher_impl
+        # 同一进程中使用的其它账号，与主账号共用其余的参数
+        self.accounts = kwargs.pop("accounts", None) or []
         self.params = kwargs
         self.inherit_cfg = cfg or {}
         self.scheduler = AsyncIOScheduler(timezone="Asia/Shanghai")
@@ -49,6 +52,8 @@ class Omega(object):
         cfg4py.update_config(self.inherit_cfg)
 
         await aq.create_instance(self.fetcher_impl, **self.params)
+        for account in self.accounts:
+            await aq.create_instance(self.fetcher_impl, **{**self.params, **account})
 
         await omicron.init(aq)
 
@@ -57,6 +62,10 @@ class Omega(object):
 
         # listen on omega events
         emit.register(Events.OMEGA_DO_SYNC, syncjobs.sync_bars)
+        emit.register(Events.OMEGA_DO_RECONCILE, syncjobs.reconcile_bars)
+        emit.register(Events.OMEGA_DO_BACKFILL, backfill.backfill_bars)
+        emit.register(Events.OMEGA_DO_VALUATION_SYNC, valuation.sync_valuation)
+        emit.register(Events.SECURITY_LIST_UPDATED, syncjobs.on_security_list_updated)
         await emit.start(emit.Engine.REDIS, dsn=cfg.redis.dsn)
         await self.heart_beat()
         self.scheduler.add_job(self.heart_beat, trigger="interval", seconds=3)
@@ -68,14 +77,20 @@ class Omega(object):
         pid = os.getpid()
         key = f"process.fetchers.{pid}"
         logger.debug("send heartbeat from omega fetcher: %s", pid)
-        await omicron.cache.sys.hmset(
+        await metrics.flush()
+
+        now = time.time()
+        pl = omicron.cache.sys.pipeline()
+        pl.hmset(
             key,
             "impl", self.fetcher_impl,
             "gid", self.gid,
             "port", self.port,
             "pid", pid,
-            "heartbeat", time.time(),
+            "heartbeat", now,
         )
+        pl.zadd(sharding.FETCHERS, now, pid)
+        await pl.execute()
 
 
 def get_fetcher_info(fetchers: List, impl: str):
@@ -61,6 +61,17 @@ class Config(object):
 
         heartbeat: Optional[int] = None
 
+        class upstream:
+            timeout: Optional[float] = None
+
+            timeouts: Optional[dict] = None
+
+            hedge: Optional[bool] = None
+
+            hedge_quantile: Optional[float] = None
+
+            retry_budget: Optional[float] = None
+
         class sync:
             security_list: Optional[str] = None
 
@@ -68,4 +79,20 @@ class Config(object):
 
             bars: Optional[list] = None
 
+            closing: Optional[str] = None
+
+            class backfill:
+                chunk: Optional[int] = None
+
+                quota_share: Optional[float] = None
+
+                pause: Optional[list] = None
+
+            class valuation:
+                time: Optional[str] = None
+
+                chunk: Optional[int] = None
+
+                days: Optional[int] = None
+
     quotes_fetchers: Optional[list] = None
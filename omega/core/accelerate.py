@@ -6,36 +6,91 @@ Author: Aaron-Yang [code@jieyu.ai]
 Contributors:
 
 things need speed
+
+`merge`和`int2frames`在每次`get_bars`时都会被调用，因此都以向量化的方式实现：按有序的键
+二分查找，再按掩码批量赋值，避免逐个元素的Python循环。
 """
+import datetime
 import logging
+from typing import Tuple
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+_EPOCH_MONTH = np.datetime64("1970-01", "M")
+
+
+def _match(lkeys: np.ndarray, rkeys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """在有序的`rkeys`中查找`lkeys`的各元素，返回匹配上的元素在两边的下标"""
+    pos = np.searchsorted(rkeys, lkeys)
+    found = pos < len(rkeys)
+    found[found] = rkeys[pos[found]] == lkeys[found]
+
+    li = np.flatnonzero(found)
+    return li, pos[li]
 
-def merge(left, right, by):
+
+def merge(left: np.ndarray, right: np.ndarray, by: str) -> np.ndarray:
     """merge two numpy structured arrays by `by` key
 
-    njit fail if one of left, right contains object, not plain type, but the loop is
-    very fast, cost 0.0001 seconds
+    `left`和`right`都必须按`by`升序排列，且`by`没有重复值。`left`中与`right`的`by`相等的
+    记录，被`right`中的记录整条替换。`left`被原地修改并返回。
 
     Args:
-        left ([type]): [description]
-        right ([type]): [description]
-        by ([type]): [description]
+        left: 被合并的数组
+        right: 合并进来的数组，dtype须能赋值给`left`
+        by: 排序键的字段名
 
     Returns:
-        [type]: [description]
+        合并后的`left`
     """
-    i, j = 0, 0
-
-    while j < len(right) and i < len(left):
-        if right[j][by] < left[by][i]:
-            j += 1
-        elif right[j][by] == left[by][i]:
-            left[i] = right[j]
-            i += 1
-            j += 1
-        else:
-            i += 1
+    if len(left) == 0 or len(right) == 0:
+        return left
 
+    li, ri = _match(left[by], right[by])
+    left[li] = right[ri]
     return left
+
+
+def int2frames(frames: np.ndarray, tz: datetime.tzinfo = None) -> np.ndarray:
+    """将`20200501`或者`202005011500`格式的整数数组，转换为`datetime.date`或者带时区
+    的`datetime.datetime`对象数组。
+
+    与逐个调用`tf.int2date`/`tf.int2time`的结果相同，但只在C层面循环。
+
+    Args:
+        frames: 整数数组，8位为日期，12位为分钟
+        tz: 分钟数据的时区
+
+    Returns:
+        dtype为object的数组
+    """
+    frames = np.asarray(frames, dtype=np.int64)
+    if len(frames) == 0:
+        return np.array([], dtype=object)
+
+    minute_level = frames[0] > 99999999
+    if minute_level:
+        days, hhmm = np.divmod(frames, 10000)
+    else:
+        days = frames
+
+    y, md = np.divmod(days, 10000)
+    m, d = np.divmod(md, 100)
+    months = _EPOCH_MONTH + ((y - 1970) * 12 + m - 1).astype("timedelta64[M]")
+    dates = months.astype("datetime64[D]") + (d - 1).astype("timedelta64[D]")
+
+    if not minute_level:
+        return np.array(dates.tolist(), dtype=object)
+
+    # 同一天的分钟共用一个带时区的零点，再加上时间差
+    uniq, inverse = np.unique(dates, return_inverse=True)
+    midnights = np.array(
+        [datetime.datetime.combine(x, datetime.time(), tz) for x in uniq.tolist()],
+        dtype=object,
+    )
+    h, mm = np.divmod(hhmm, 100)
+    deltas = (h * 60 + mm).astype("timedelta64[m]").astype(object)
+
+    return midnights[inverse] + deltas
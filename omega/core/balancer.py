@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+上游实例的负载均衡。
+
+每个fetcher进程可以登记多个上游实例（比如多个账号）。对每个实例，记录正在进行中的请求数，以及
+请求耗时的指数加权移动平均（EWMA）。选择实例时，以`(进行中的请求数 + 1) * 平均耗时`估计新
+请求的完成时间，取其最小者，因此较快、较空闲的实例承担更多的请求，增加一个账号就能增加吞吐量。
+
+某个实例连续失败`failures`次后，熔断`cooldown`秒，期间不再分配请求。冷却结束后，只放行一个试探
+请求：成功则恢复，失败则再次熔断。所有实例都处于熔断状态时，选择最早结束冷却的实例，而不是拒绝
+服务。
+"""
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class _Stats:
+    def __init__(self, name: str):
+        self.name = name
+        self.inflight = 0
+        # 没有样本时为0，新加入的实例会被优先尝试
+        self.latency = 0.0
+        self.failures = 0
+        # 熔断结束的时间，0表示未熔断
+        self.open_until = 0.0
+        self.probing = False
+
+    def available(self, now: float) -> bool:
+        if self.open_until == 0:
+            return True
+
+        # 冷却结束后，同一时间只放行一个试探请求
+        return now >= self.open_until and not self.probing
+
+
+class Balancer:
+    def __init__(self, alpha: float = 0.3, failures: int = 3, cooldown: float = 30):
+        """
+        Args:
+            alpha: 平均耗时的平滑系数，越大则越侧重最近的请求
+            failures: 连续失败多少次后熔断
+            cooldown: 熔断的时长（秒）
+        """
+        self.alpha = alpha
+        self.failures = failures
+        self.cooldown = cooldown
+
+        self._instances: List[Any] = []
+        # id(instance) -> 该实例的统计
+        self._stats: Dict[int, _Stats] = {}
+
+    def add(self, instance: Any, name: str = None):
+        self._instances.append(instance)
+        self._stats[id(instance)] = _Stats(name or str(len(self._instances)))
+
+    def __len__(self):
+        return len(self._instances)
+
+    def pick(self, exclude: Any = None) -> Any:
+        """返回预计最快完成新请求的健康实例
+
+        Args:
+            exclude: 不参与选择的实例，比如对冲请求时，已经在处理该请求的实例
+        """
+        instances = [x for x in self._instances if x is not exclude]
+        if len(instances) == 0:
+            raise IndexError("No fetchers available")
+
+        now = time.time()
+        candidates = [
+            (i, x) for i, x in enumerate(instances) if self._stats[id(x)].available(now)
+        ]
+
+        if len(candidates) == 0:
+            return min(instances, key=lambda x: self._stats[id(x)].open_until)
+
+        def score(item):
+            i, instance = item
+            stats = self._stats[id(instance)]
+            return (stats.inflight + 1) * stats.latency, stats.inflight, i
+
+        return min(candidates, key=score)[1]
+
+    @contextmanager
+    def track(self, instance: Any):
+        """记录`with`语句块中对`instance`的一次请求的耗时和结果"""
+        stats = self._stats.get(id(instance))
+        if stats is None:
+            yield
+            return
+
+        t0 = time.time()
+        probe = stats.open_until != 0 and t0 >= stats.open_until
+        if probe:
+            stats.probing = True
+
+        stats.inflight += 1
+        try:
+            yield
+        except Exception:
+            self._on_failure(stats, probe)
+            raise
+        else:
+            self._on_success(stats, time.time() - t0)
+        finally:
+            stats.inflight -= 1
+            if probe:
+                stats.probing = False
+
+    def _on_success(self, stats: _Stats, elapsed: float):
+        if stats.latency == 0:
+            stats.latency = elapsed
+        else:
+            stats.latency = self.alpha * elapsed + (1 - self.alpha) * stats.latency
+
+        if stats.open_until:
+            logger.info("upstream %s recovered", stats.name)
+
+        stats.failures = 0
+        stats.open_until = 0
+
+    def _on_failure(self, stats: _Stats, probe: bool):
+        stats.failures += 1
+        if probe or stats.failures >= self.failures:
+            stats.open_until = time.time() + self.cooldown
+            logger.warning(
+                "upstream %s failed %s times in a row, ejected for %s secs",
+                stats.name,
+                stats.failures,
+                self.cooldown,
+            )
+
+    def status(self) -> List[dict]:
+        """返回各实例的进行中请求数、平均耗时及是否健康"""
+        now = time.time()
+        return [
+            {
+                "name": stats.name,
+                "inflight": stats.inflight,
+                "latency": stats.latency,
+                "healthy": stats.open_until == 0 or now >= stats.open_until,
+            }
+            for stats in (self._stats[id(x)] for x in self._instances)
+        ]
@@ -8,6 +8,10 @@ class Events:
     OMEGA_APP_STOP = "omega/app_stop"
 
     OMEGA_DO_SYNC = "omega/sync_bars_worker"
+    OMEGA_SYNC_DONE = "omega/sync_bars_done"
+    OMEGA_DO_RECONCILE = "omega/reconcile_bars_worker"
+    OMEGA_DO_BACKFILL = "omega/backfill_bars_worker"
+    OMEGA_DO_VALUATION_SYNC = "omega/sync_valuation_worker"
     OMEGA_VALIDATION_PROGRESS = "omega/do_validation"
     OMEGA_DO_CHECKSUM = "omega/do_checksum"
     OMEGA_VALIDATION_ERROR = "omega/validation_error"
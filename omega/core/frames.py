@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+帧的换算：帧与整数表示、日历序号之间的转换，以及由配置推导出的帧类型。
+
+整数表示的帧即`20200506`（日线级别）或者`202005061030`（分钟线）。同一帧类型下，两帧在日历
+中的序号之差即为它们之间的帧数，因此可以用numpy向量化地计算大量证券的帧数。
+"""
+import logging
+from typing import List
+
+import arrow
+import cfg4py
+import numpy as np
+from omicron.core.timeframe import tf
+from omicron.core.types import Frame, FrameType
+
+from omega.core import resample
+
+logger = logging.getLogger(__name__)
+cfg = cfg4py.get_instance()
+
+
+def frames_of(frame_type: FrameType) -> np.ndarray:
+    """`frame_type`的日历（整数表示）。分钟线返回交易日的日历"""
+    if frame_type == FrameType.WEEK:
+        return np.asarray(tf.week_frames)
+    elif frame_type == FrameType.MONTH:
+        return np.asarray(tf.month_frames)
+    else:
+        return np.asarray(tf.day_frames)
+
+
+def frame_index(frames: np.ndarray, frame_type: FrameType) -> np.ndarray:
+    """将整数表示的帧转换为其在日历中的序号。
+
+    同一帧类型下，两帧的序号之差即为它们之间的帧数，因此可以向量化地计算帧数。
+
+    Args:
+        frames: 整数表示的帧，比如20200506或者202005061030
+        frame_type: 帧类型
+
+    Returns:
+        各帧在日历中的序号
+    """
+    frames = np.asarray(frames, dtype=np.int64)
+    if frame_type in tf.minute_level_frames:
+        ticks = np.asarray(tf.ticks[frame_type])
+        days = np.searchsorted(frames_of(FrameType.DAY), frames // 10000)
+        hm = frames % 10000
+        minutes = hm // 100 * 60 + hm % 100
+        return days * len(ticks) + np.searchsorted(ticks, minutes)
+
+    return np.searchsorted(frames_of(frame_type), frames)
+
+
+def index_to_frame(index: np.ndarray, frame_type: FrameType) -> np.ndarray:
+    """[frame_index][omega.core.frames.frame_index]的逆运算"""
+    index = np.asarray(index, dtype=np.int64)
+    if frame_type in tf.minute_level_frames:
+        ticks = np.asarray(tf.ticks[frame_type])
+        days = frames_of(FrameType.DAY)[index // len(ticks)]
+        minutes = ticks[index % len(ticks)]
+        return days * 10000 + minutes // 60 * 100 + minutes % 60
+
+    return frames_of(frame_type)[index]
+
+
+def frame_to_int(frame: Frame, frame_type: FrameType) -> int:
+    if frame_type in tf.minute_level_frames:
+        return tf.time2int(frame)
+    else:
+        return tf.date2int(frame)
+
+
+def int_to_frame(frame: int, frame_type: FrameType) -> Frame:
+    if frame_type in tf.minute_level_frames:
+        return tf.int2time(frame)
+    else:
+        return tf.int2date(frame)
+
+
+def last_closed_frame(stop: Frame, frame_type: FrameType) -> Frame:
+    """如果`stop`所在的日线级别帧尚未收盘，则返回其前一帧，否则返回`stop`本身"""
+    if frame_type in tf.minute_level_frames:
+        return stop
+
+    now = arrow.now(tz=cfg.tz)
+    if now.hour < 15 and tf.floor(now.date(), frame_type) == stop:
+        return tf.shift(stop, -1, frame_type)
+
+    return stop
+
+
+def resample_targets(sync_params: dict) -> List[FrameType]:
+    """解析同步参数中的`resample`，返回需要由本帧k线合成的帧类型"""
+    frame_type = FrameType(sync_params.get("frame"))
+
+    targets = [FrameType(frame) for frame in sync_params.get("resample") or []]
+    for target in targets:
+        resample.check_resample(frame_type, target)
+
+    return targets
+
+
+def derived_frames() -> List[FrameType]:
+    """配置中由其它帧合成、因而无须从上游同步的帧类型"""
+    derived = []
+    for item in cfg.omega.sync.bars:
+        try:
+            derived.extend(resample_targets(item))
+        except Exception as e:
+            logger.exception(e)
+            logger.warning("failed to parse resample in %s", item)
+
+    return derived
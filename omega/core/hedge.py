@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+对冲请求和重试预算。
+
+上游偶尔会有个别请求长时间不返回。登记了多个上游实例时，如果一个请求在该方法耗时的p95之内还没有
+返回，就向另一个实例发出相同的请求，取先返回的结果，见
+[omega.fetcher.abstract_quotes_fetcher.AbstractQuotesFetcher._invoke][]。
+
+对冲和超时后的重试都会增加上游的负载。上游整体变慢时，如果每个请求都对冲或者重试，负载会成倍
+增加，使情况更糟。因此，对冲和重试都要从重试预算中支取：最近`ttl`秒内，重试的次数不超过请求数的
+`ratio`倍（另外每秒允许`min_per_sec`次，以便请求稀少时也能重试）。
+"""
+import logging
+import time
+from collections import deque
+from typing import Deque, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyWindow:
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        """
+        Args:
+            size: 保留最近多少次调用的耗时
+            min_samples: 样本数少于此数时，不估计分位数
+        """
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, elapsed: float):
+        self._samples.append(elapsed)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """返回最近调用耗时的`q`分位数，样本不足时返回None"""
+        if len(self._samples) < self.min_samples:
+            return None
+
+        return float(np.quantile(self._samples, q))
+
+
+class RetryBudget:
+    def __init__(self, ratio: float = 0.1, min_per_sec: float = 1, ttl: float = 10):
+        """
+        Args:
+            ratio: 重试次数与请求数之比的上限
+            min_per_sec: 不论请求数多少，每秒都允许的重试次数
+            ttl: 统计最近多少秒内的请求和重试
+        """
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.ttl = ttl
+
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+
+    def _expire(self, now: float):
+        for records in (self._requests, self._retries):
+            while records and records[0] <= now - self.ttl:
+                records.popleft()
+
+    def deposit(self):
+        """记录一次请求（不包括重试）"""
+        now = time.time()
+        self._expire(now)
+        self._requests.append(now)
+
+    def withdraw(self) -> bool:
+        """申请一次重试。预算不足时返回False，调用者不应该重试"""
+        now = time.time()
+        self._expire(now)
+
+        allowed = self.min_per_sec * self.ttl + self.ratio * len(self._requests)
+        if len(self._retries) >= allowed:
+            logger.debug("retry budget exhausted: %s retries", len(self._retries))
+            return False
+
+        self._retries.append(now)
+        return True
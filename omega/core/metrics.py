@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+同步性能指标。
+
+各进程先在本地累计计数器(counter)和直方图(histogram)，由心跳定期将增量写入redis。由于写入的是
+增量，多个进程的指标在redis中自然地被汇总。任一进程都可以将汇总后的指标以Prometheus文本格式
+输出。
+"""
+import logging
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+import arrow
+import cfg4py
+from omicron import cache
+from omicron.core.timeframe import tf
+from omicron.core.types import Frame, FrameType
+
+logger = logging.getLogger(__name__)
+cfg = cfg4py.get_instance()
+
+# 耗时（秒）的分桶
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 同步延迟（秒）的分桶
+LAG_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600)
+
+_key_samples = "metrics.samples"
+_key_types = "metrics.types"
+
+# 尚未写入redis的增量。sample -> value
+_buffer: Dict[str, float] = defaultdict(float)
+# family -> counter | histogram
+_types: Dict[str, str] = {}
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+
+    pairs = [f'{k}="{v}"' for k, v in sorted(labels.items())]
+    return "{" + ",".join(pairs) + "}"
+
+
+def inc(name: str, value: float = 1, **labels):
+    """计数器`name`增加`value`"""
+    _types[name] = "counter"
+    _buffer[f"{name}{_labels(**labels)}"] += value
+
+
+def observe(name: str, value: float, buckets: Tuple = LATENCY_BUCKETS, **labels):
+    """向直方图`name`中加入一个观测值"""
+    _types[name] = "histogram"
+    for le in buckets:
+        _buffer[f"{name}_bucket{_labels(le=le, **labels)}"] += int(value <= le)
+    _buffer[f"{name}_bucket{_labels(le='+Inf', **labels)}"] += 1
+    _buffer[f"{name}_sum{_labels(**labels)}"] += value
+    _buffer[f"{name}_count{_labels(**labels)}"] += 1
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """记录`with`语句块的耗时到直方图`name`中"""
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - t0, **labels)
+
+
+def _close_time(frame: Frame, frame_type: FrameType) -> arrow.Arrow:
+    if frame_type in tf.minute_level_frames:
+        return arrow.get(frame, tzinfo=cfg.tz)
+
+    # 日线及以上级别的帧，在当天收盘时结束
+    return arrow.get(f"{arrow.get(frame).date()} 15:00:00", tzinfo=cfg.tz)
+
+
+def observe_lag(frame_type: FrameType, frame: Frame):
+    """记录从`frame`结束到其k线存入缓存之间的延迟。
+
+    只有`frame`是已结束的最新一帧时才记录，补齐历史数据时的“延迟”没有意义。
+    """
+    now = arrow.now(tz=cfg.tz)
+    try:
+        if _close_time(tf.shift(frame, 1, frame_type), frame_type) <= now:
+            return
+
+        lag = (now - _close_time(frame, frame_type)).total_seconds()
+    except Exception as e:  # 日历之外的帧
+        logger.debug("failed to compute lag of %s: %s", frame, e)
+        return
+
+    if lag >= 0:
+        observe("omega_sync_lag_seconds", lag, LAG_BUCKETS, frame=frame_type.value)
+
+
+async def flush():
+    """将本进程累计的增量写入redis"""
+    if not _buffer:
+        return
+
+    samples = dict(_buffer)
+    _buffer.clear()
+
+    pl = cache.sys.pipeline()
+    for sample, value in samples.items():
+        pl.hincrbyfloat(_key_samples, sample, value)
+    pl.hmset_dict(_key_types, _types)
+    await pl.execute()
+
+
+def _sort_key(sample: str):
+    # 同一序列的各分桶排在一起，并按le升序排列
+    name, _, labels = sample.partition("{")
+    labels = dict(re.findall(r'(\w+)="([^"]*)"', labels))
+    le = float(labels.pop("le", 0))
+    return name.rsplit("_", 1)[0], sorted(labels.items()), name, le
+
+
+async def render(gauges: List[Tuple[str, dict, float]] = None) -> str:
+    """以Prometheus文本格式输出所有进程汇总后的指标
+
+    Args:
+        gauges: 采集时才计算的指标，如队列长度，格式为(name, labels, value)
+    """
+    await flush()
+
+    pl = cache.sys.pipeline()
+    pl.hgetall(_key_samples)
+    pl.hgetall(_key_types)
+    samples, types = await pl.execute()
+
+    # family -> lines
+    families = defaultdict(list)
+    for sample in sorted(samples or {}, key=_sort_key):
+        name = sample.partition("{")[0]
+        family = name
+        if family not in types:
+            family = re.sub(r"_(bucket|sum|count)$", "", name)
+        families[family].append(f"{sample} {float(samples[sample]):g}")
+
+    lines = []
+    for family, values in families.items():
+        lines.append(f"# TYPE {family} {types.get(family, 'untyped')}")
+        lines.extend(values)
+
+    declared = set()
+    for name, labels, value in gauges or []:
+        if name not in declared:
+            lines.append(f"# TYPE {name} gauge")
+            declared.add(name)
+        lines.append(f"{name}{_labels(**labels)} {value:g}")
+
+    return "\n".join(lines) + "\n"
+
+
+async def queue_gauges() -> List[Tuple[str, dict, float]]:
+    """各帧类型同步队列（所有分片之和）的待处理和已领取任务数"""
+    frame_types = tf.minute_level_frames + tf.day_level_frames
+    keys = [f"jobs.bars_sync.scope.{frame_type.value}" for frame_type in frame_types]
+
+    pl = cache.sys.pipeline()
+    for key in keys:
+        pl.smembers(f"{key}.shards")
+    shards = await pl.execute()
+
+    pl = cache.sys.pipeline()
+    for key, members in zip(keys, shards):
+        for shard in members:
+            pl.llen(f"{key}.{shard}")
+            pl.zcard(f"{key}.{shard}.leases")
+    recs = await pl.execute()
+
+    pending, leased = [], []
+    i = 0
+    for frame_type, members in zip(frame_types, shards):
+        counts = recs[i : i + 2 * len(members)]
+        labels = {"frame": frame_type.value}
+        pending.append(("omega_sync_queue_pending", labels, sum(counts[::2])))
+        leased.append(("omega_sync_queue_leased", labels, sum(counts[1::2])))
+        i += len(counts)
+
+    return pending + leased
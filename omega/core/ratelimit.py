@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+跨进程共享的令牌桶。
+
+同一个上游账号下的所有fetcher进程共享一个存放在redis中的令牌桶。每次调用上游之前，先按本次
+调用的代价（比如请求的k线条数）预约令牌。令牌不足时，预约仍然成功，但桶内余额变为负数，调用者
+需要等待余额回正后才能发出请求。由于后来者总是排在先来者的欠额之后，等待者按预约的先后顺序得到
+服务，不会出现某个进程一直抢不到令牌的情况。
+
+低优先级的调用者（比如补齐历史数据）与其它调用者共用同一个令牌桶，但取用时需要保留一部分余额：
+只有余额高于保留额时才取得令牌，否则不预约、不排队，稍后再试。这样，它们与其它调用者的总消耗
+仍然不超过账号的配额，而保留的余额总是留给其它调用者。
+"""
+import asyncio
+import logging
+import time
+
+from omicron import cache
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1]: 令牌桶
+# ARGV[1]: 当前时间, ARGV[2]: 每秒补充的令牌数, ARGV[3]: 桶容量, ARGV[4]: 本次代价,
+# ARGV[5]: 最长等待时间
+# 返回需要等待的秒数。如果需要等待的时间超过最长等待时间，则不预约，返回负数
+_reserve_script = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local max_wait = tonumber(ARGV[5])
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if tokens < cost then
+    wait = (cost - tokens) / rate
+end
+
+if wait > max_wait then
+    redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    return tostring(-wait)
+end
+
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens - cost), 'ts', tostring(now))
+redis.call('HINCRBYFLOAT', KEYS[1], 'consumed', cost)
+if wait > 0 then
+    redis.call('HINCRBYFLOAT', KEYS[1], 'waited', wait)
+end
+return tostring(wait)
+"""
+
+# KEYS[1]: 令牌桶
+# ARGV[1]: 当前时间, ARGV[2]: 每秒补充的令牌数, ARGV[3]: 桶容量, ARGV[4]: 本次代价,
+# ARGV[5]: 保留的余额
+# 余额在扣除代价后仍不低于保留额时取得令牌，返回0；否则不做任何预约，返回余额恢复到足够时
+# 需要等待的秒数。代价超过桶容量与保留额之差时，桶满即可取得
+_take_script = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local reserve = tonumber(ARGV[5])
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local required = math.min(capacity, cost + reserve)
+if tokens < required then
+    redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    return tostring((required - tokens) / rate)
+end
+
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens - cost), 'ts', tostring(now))
+redis.call('HINCRBYFLOAT', KEYS[1], 'consumed', cost)
+return '0'
+"""
+
+
+class TokenBucket:
+    def __init__(self, name: str, rate: float, capacity: float, max_wait: float = 600):
+        """
+        Args:
+            name: 令牌桶的名字，同名的令牌桶在各进程间共享
+            rate: 每秒补充的令牌数
+            capacity: 桶容量，即允许的最大突发量
+            max_wait: 最长等待时间（秒）。超过此时间仍不能得到令牌的，不再等待
+        """
+        if rate <= 0 or capacity <= 0:
+            raise ValueError(f"rate and capacity must be positive: {rate}, {capacity}")
+
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.max_wait = max_wait
+
+        self.key = f"ratelimit.{name}"
+
+    async def reserve(self, cost: float = 1) -> float:
+        """预约`cost`个令牌，返回需要等待的秒数。
+
+        如果需要等待的时间超过`max_wait`，则不会预约，返回负数。
+        """
+        wait = await cache.sys.eval(
+            _reserve_script,
+            keys=[self.key],
+            args=[time.time(), self.rate, self.capacity, cost, self.max_wait],
+        )
+        return float(wait)
+
+    async def take(self, cost: float = 1, reserve: float = 0) -> float:
+        """在余额扣除`cost`后仍不低于`reserve`时取得`cost`个令牌。
+
+        与`reserve`不同，令牌不足时不会预约，也不会使余额变为负数。
+
+        Returns:
+            取得令牌时返回0，否则返回余额恢复到足够时需要等待的秒数
+        """
+        wait = await cache.sys.eval(
+            _take_script,
+            keys=[self.key],
+            args=[time.time(), self.rate, self.capacity, cost, reserve],
+        )
+        return float(wait)
+
+    async def acquire(self, cost: float = 1, reserve: float = 0) -> bool:
+        """取得`cost`个令牌，必要时等待。
+
+        Args:
+            cost: 本次调用的代价
+            reserve: 为其它调用者保留的余额，见`take`。为0时按预约的先后顺序排队
+
+        Returns:
+            如果在`max_wait`内无法取得令牌，返回False，否则返回True
+        """
+        if reserve > 0:
+            return await self._acquire_above(cost, reserve)
+
+        wait = await self.reserve(cost)
+        if wait < 0:
+            logger.warning(
+                "%s: no budget for %s in %s seconds", self.name, cost, self.max_wait
+            )
+            return False
+
+        if wait > 0:
+            logger.debug("%s: wait %.2f seconds for %s tokens", self.name, wait, cost)
+            await asyncio.sleep(wait)
+
+        return True
+
+    async def _acquire_above(self, cost: float, reserve: float) -> bool:
+        deadline = time.time() + self.max_wait
+        while True:
+            wait = await self.take(cost, reserve)
+            if wait == 0:
+                return True
+
+            if time.time() + wait > deadline:
+                logger.warning(
+                    "%s: no budget above %s for %s in %s seconds",
+                    self.name,
+                    reserve,
+                    cost,
+                    self.max_wait,
+                )
+                return False
+
+            await asyncio.sleep(wait)
+
+    async def remaining(self) -> dict:
+        """返回令牌桶的当前状态
+
+        Returns:
+            ```
+            {
+                remaining: 当前余额，为负数时表示有调用者在等待
+                capacity: 桶容量
+                rate: 每秒补充的令牌数
+                consumed: 累计消耗的令牌数
+                waited: 调用者累计等待的秒数
+            }
+            ```
+        """
+        tokens, ts, consumed, waited = await cache.sys.hmget(
+            self.key, "tokens", "ts", "consumed", "waited"
+        )
+        if tokens is None:
+            remaining = self.capacity
+        else:
+            elapsed = max(0, time.time() - float(ts))
+            remaining = min(self.capacity, float(tokens) + elapsed * self.rate)
+
+        return {
+            "remaining": remaining,
+            "capacity": self.capacity,
+            "rate": self.rate,
+            "consumed": float(consumed or 0),
+            "waited": float(waited or 0),
+        }
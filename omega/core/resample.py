@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+由低级别k线合成高级别k线：由1分钟线合成5、15、30和60分钟线，由日线合成周线和月线。
+"""
+import logging
+
+import numpy as np
+from omicron.core.timeframe import tf
+from omicron.core.types import FrameType
+
+logger = logging.getLogger(__name__)
+
+
+def check_resample(from_frame: FrameType, to_frame: FrameType):
+    """检查能否由`from_frame`的k线合成`to_frame`的k线，如果不能，抛出ValueError"""
+    if from_frame in tf.minute_level_frames and to_frame in tf.minute_level_frames:
+        if set(tf.ticks[to_frame]) <= set(tf.ticks[from_frame]) and (
+            from_frame != to_frame
+        ):
+            return
+    elif from_frame == FrameType.DAY and to_frame in (FrameType.WEEK, FrameType.MONTH):
+        return
+
+    raise ValueError(f"cannot resample {to_frame.value} bars from {from_frame.value}")
+
+
+def _to_int(frames: np.ndarray, frame_type: FrameType) -> np.ndarray:
+    if frame_type in tf.minute_level_frames:
+        convert = tf.time2int
+    else:
+        convert = tf.date2int
+
+    return np.array([convert(frame) for frame in frames], dtype=np.int64)
+
+
+def _target_frames(to_frame: FrameType) -> np.ndarray:
+    if to_frame == FrameType.WEEK:
+        return np.asarray(tf.week_frames)
+    else:
+        return np.asarray(tf.month_frames)
+
+
+def group_keys(
+    frames: np.ndarray, from_frame: FrameType, to_frame: FrameType
+) -> np.ndarray:
+    """计算每一根源k线所属的目标帧
+
+    Args:
+        frames: 整数表示的源k线的帧
+        from_frame: 源k线的帧类型
+        to_frame: 目标k线的帧类型
+
+    Returns:
+        整数表示的目标帧。超出日历范围的，置为0
+    """
+    frames = np.asarray(frames, dtype=np.int64)
+    if to_frame in tf.minute_level_frames:
+        ticks = np.asarray(tf.ticks[to_frame])
+        hm = frames % 10000
+        pos = np.searchsorted(ticks, hm // 100 * 60 + hm % 100)
+        valid = pos < len(ticks)
+        tm = ticks[np.minimum(pos, len(ticks) - 1)]
+        keys = frames // 10000 * 10000 + tm // 60 * 100 + tm % 60
+    else:
+        targets = _target_frames(to_frame)
+        pos = np.searchsorted(targets, frames)
+        valid = pos < len(targets)
+        keys = targets[np.minimum(pos, len(targets) - 1)]
+
+    return np.where(valid, keys, 0)
+
+
+def group_sizes(keys: np.ndarray, from_frame: FrameType, to_frame: FrameType):
+    """计算每个目标帧完整时应该包含的源k线数"""
+    keys = np.asarray(keys, dtype=np.int64)
+    if to_frame in tf.minute_level_frames:
+        src = np.asarray(tf.ticks[from_frame])
+        ticks = np.asarray(tf.ticks[to_frame])
+        # 第一个目标帧从开盘起算，其余从上一目标帧之后起算
+        counts = np.diff(np.searchsorted(src, ticks, side="right"), prepend=0)
+        hm = keys % 10000
+        pos = np.searchsorted(ticks, hm // 100 * 60 + hm % 100)
+        return counts[np.minimum(pos, len(ticks) - 1)]
+    else:
+        targets = _target_frames(to_frame)
+        days = np.asarray(tf.day_frames)
+        counts = np.diff(np.searchsorted(days, targets, side="right"), prepend=0)
+        return counts[np.minimum(np.searchsorted(targets, keys), len(targets) - 1)]
+
+
+def max_group_size(from_frame: FrameType, to_frame: FrameType) -> int:
+    """一个目标帧最多包含的源k线数"""
+    if to_frame in tf.minute_level_frames:
+        keys = np.asarray(tf.ticks[to_frame])
+        keys = 20000101 * 10000 + keys // 60 * 100 + keys % 60
+    else:
+        keys = _target_frames(to_frame)
+
+    return int(np.max(group_sizes(keys, from_frame, to_frame)))
+
+
+def resample(
+    bars: np.ndarray, from_frame: FrameType, to_frame: FrameType
+) -> np.ndarray:
+    """将`from_frame`的k线合成为`to_frame`的k线。
+
+    `bars`须按时间升序排列，且每一帧都有记录（停牌期间以nan填充，即缓存中读出的格式）。只有
+    包含了全部源k线的目标帧才会出现在结果中，首尾不完整的（包括尚未结束的）目标帧将被丢弃。
+
+    合成规则：open取第一根有效k线的open，close取最后一根有效k线的close，high/low取最大/最
+    小值，volume和amount求和。如果目标帧内发生了除权，则先按目标帧内最后一根有效k线的复权因
+    子，对此前各k线的价格进行复权，因此合成后的价格与其factor是一致的。整个目标帧都停牌的，
+    各值均为nan。
+
+    Args:
+        bars: 源k线，dtype同`omicron.core.types.bars_dtype`
+        from_frame: 源k线的帧类型
+        to_frame: 目标k线的帧类型
+
+    Returns:
+        合成的k线，dtype与`bars`相同
+    """
+    check_resample(from_frame, to_frame)
+    if bars is None or len(bars) == 0:
+        return np.empty(0, dtype=bars.dtype if bars is not None else None)
+
+    frames = _to_int(bars["frame"], from_frame)
+    keys = group_keys(frames, from_frame, to_frame)
+
+    starts = np.flatnonzero(np.diff(keys, prepend=keys[0] - 1))
+    ends = np.append(starts[1:], len(keys)) - 1
+    group = np.repeat(np.arange(len(starts)), ends - starts + 1)
+
+    complete = (ends - starts + 1) == group_sizes(keys[starts], from_frame, to_frame)
+    complete &= keys[starts] != 0
+
+    close = bars["close"].astype(np.float64)
+    valid = ~np.isnan(close)
+    idx = np.arange(len(bars))
+
+    first = np.minimum.reduceat(np.where(valid, idx, len(bars)), starts)
+    last = np.maximum.reduceat(np.where(valid, idx, -1), starts)
+    has_data = last >= 0
+    last_ = np.where(has_data, last, ends)
+    first_ = np.where(has_data, first, starts)
+
+    factor = bars["factor"].astype(np.float64)
+    adjust = factor / factor[last_][group]
+
+    result = np.empty(len(starts), dtype=bars.dtype)
+    if to_frame in tf.minute_level_frames:
+        result["frame"] = [tf.int2time(key) for key in keys[starts]]
+    else:
+        result["frame"] = [tf.int2date(key) for key in keys[starts]]
+
+    result["open"] = bars["open"][first_] * adjust[first_]
+    result["close"] = close[last_] * adjust[last_]
+    result["high"] = np.fmax.reduceat(bars["high"] * adjust, starts)
+    result["low"] = np.fmin.reduceat(bars["low"] * adjust, starts)
+    result["volume"] = np.add.reduceat(np.nan_to_num(bars["volume"]), starts)
+    result["amount"] = np.add.reduceat(np.nan_to_num(bars["amount"]), starts)
+    result["factor"] = factor[last_]
+
+    for name in ["volume", "amount"]:
+        result[name][~has_data] = np.nan
+
+    return result[complete]
@@ -16,11 +16,12 @@ import subprocess
 import sys
 import time
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 import aiohttp
 import arrow
 import cfg4py
+import numpy as np
 import omicron
 import psutil
 import xxhash
@@ -29,7 +30,7 @@ from aiohttp import ClientError
 from dateutil import tz
 from omicron import cache
 from omicron.core.timeframe import tf
-from omicron.core.types import FrameType
+from omicron.core.types import Frame, FrameType
 from omicron.models.securities import Securities
 from omicron.models.security import Security
 from pyemit import emit
@@ -90,6 +91,37 @@ async def calc_checksums(day: datetime.date, codes: List) -> dict:
     return checksums
 
 
+def calc_bars_checksum(bars: np.ndarray) -> str:
+    """按k线在缓存中的存储格式计算checksum，结果可以与`calc_cached_checksums`直接比较"""
+    data = "".join(
+        f"{o:.2f} {h:.2f} {l:.2f} {c:.2f} {v} {a:.2f} {fq:.2f}"
+        for _, o, h, l, c, v, a, fq in bars
+    )
+    return xxhash.xxh32_hexdigest(data.encode("utf-8"))
+
+
+async def calc_cached_checksums(
+    codes: List[str], end: Frame, n: int, frame_type: FrameType
+) -> Dict[str, Optional[str]]:
+    """计算缓存中各证券截止到`end`的`n`根k线的checksum，所有证券只需要一次redis调用。
+
+    与`calc_checksums`一样，缓存中不存在的帧被忽略；一根k线也没有的证券，其checksum为None
+    """
+    frames = [int(frame) for frame in tf.get_frames_by_count(end, n, frame_type)]
+
+    pl = cache.security.pipeline()
+    for code in codes:
+        pl.hmget(f"{code}:{frame_type.value}", *frames, encoding=None)
+    recs = await pl.execute()
+
+    checksums = {}
+    for code, values in zip(codes, recs):
+        data = b"".join(filter(None, values))
+        checksums[code] = xxhash.xxh32_hexdigest(data) if data else None
+
+    return checksums
+
+
 @cached(ttl=3600)
 async def get_checksum(day: int) -> Optional[List]:
     save_to = (Path(cfg.omega.home) / "data/chksum").expanduser()
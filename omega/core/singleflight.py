@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+合并进程内并发的相同请求。
+
+web接口和同步任务可能同时向同一个fetcher进程请求完全相同的数据。在第一个请求完成之前，后来的相同
+请求不再调用上游，而是等待第一个请求的结果。请求完成后即不再保留其结果，因此这不是缓存，不会返回
+过期的数据。
+
+被合并的请求得到的是同一个对象，调用者不应该原地修改它。
+
+请求在单独的task中执行，各调用者（包括发起请求的那一个）只是等待它的结果。因此任何一个调用者被
+取消，都不影响其它调用者；只有所有调用者都已离开时，请求才会被取消。
+"""
+import asyncio
+import functools
+import inspect
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from omega.core import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(x) for x in value)
+
+    return value
+
+
+class _Call:
+    """正在进行的请求，及等待其结果的调用者数"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        """
+        Args:
+            name: 名字，用作指标`omega_singleflight_*`的`method`标签
+        """
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def _start(self, key: Hashable, coro: Awaitable) -> _Call:
+        call = _Call(asyncio.ensure_future(coro))
+
+        def done(task: asyncio.Task):
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+            # 没有等待者时，避免asyncio报告异常未被获取
+            if not task.cancelled():
+                task.exception()
+
+        call.task.add_done_callback(done)
+        self._calls[key] = call
+        return call
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable], *args, **kwargs):
+        """如果有键为`key`的请求正在进行，等待其结果；否则调用`func(*args, **kwargs)`"""
+        metrics.inc("omega_singleflight_requests_total", method=self.name)
+
+        call = self._calls.get(key)
+        if call is None:
+            call = self._start(key, func(*args, **kwargs))
+        else:
+            metrics.inc("omega_singleflight_shared_total", method=self.name)
+
+        call.waiters += 1
+        try:
+            # 调用者被取消时，不影响正在进行的请求
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+
+def single_flight(name: str):
+    """以调用参数为键，合并对被装饰的协程函数的并发相同调用。
+
+    参数中的列表被转换为元组；如果仍然有不可哈希的参数，则不合并。
+    """
+
+    def decorator(func):
+        flight = SingleFlight(name)
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = _freeze(tuple(bound.arguments.values()))
+            try:
+                hash(key)
+            except TypeError:
+                return await func(*args, **kwargs)
+
+            return await flight.do(key, func, *args, **kwargs)
+
+        wrapper.flight = flight
+        return wrapper
+
+    return decorator
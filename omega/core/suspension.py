@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+停牌日历。
+
+由日线得知的停牌日以sorted set保存在`{code}:suspended`中，score和成员都是整数表示的日期。
+整个区间都处于停牌日的分钟线任务，无须向上游请求，见[omega.jobs.planner.split_suspended][]。
+"""
+import itertools
+import logging
+from typing import Dict
+
+import numpy as np
+from omicron import cache
+from omicron.core.timeframe import tf
+
+logger = logging.getLogger(__name__)
+
+
+def suspension_key(code: str) -> str:
+    return f"{code}:suspended"
+
+
+async def save_suspensions(bars: Dict[str, np.ndarray]):
+    """根据各证券的日线更新停牌日历。
+
+    没有成交（即以nan填充）的交易日记为停牌日，有成交的交易日从停牌日历中移除（比如收盘核对
+    时修正了数据）。
+
+    Args:
+        bars: 证券代码 -> 该证券的日线
+    """
+    pl = cache.security.pipeline()
+    for code, _bars in bars.items():
+        if _bars is None or len(_bars) == 0:
+            continue
+
+        days = [tf.date2int(frame) for frame in _bars["frame"]]
+        paused = np.isnan(_bars["close"]).tolist()
+        suspended = [day for day, p in zip(days, paused) if p]
+        resumed = [day for day, p in zip(days, paused) if not p]
+
+        key = suspension_key(code)
+        if suspended:
+            pl.zadd(key, *itertools.chain.from_iterable((d, d) for d in suspended))
+        if resumed:
+            pl.zrem(key, *resumed)
+    await pl.execute()
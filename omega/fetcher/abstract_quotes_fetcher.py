@@ -2,31 +2,126 @@
 # -*- coding: utf-8 -*-
 """This is a awesome
         python script!"""
+import asyncio
+import collections
+import contextvars
 import datetime
 import importlib
+import io
+import itertools
 import logging
-from typing import List, Union, Optional
+import os
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
 
 import arrow
 import cfg4py
 import numpy as np
 from numpy.lib import recfunctions as rfn
 from omicron import cache
-from omicron.core.lang import static_vars
+from omicron.core.errors import FetcherQuotaError
 from omicron.core.timeframe import tf
 from omicron.core.types import Frame, FrameType
 from omicron.models.valuation import Valuation
-
-from omega.core.accelerate import merge
+from pyemit import emit
+
+from omega.core import metrics
+from omega.core.accelerate import int2frames, merge
+from omega.core.balancer import Balancer
+from omega.core.events import Events
+from omega.core.frames import frame_index, frame_to_int, index_to_frame, int_to_frame
+from omega.core.hedge import LatencyWindow, RetryBudget
+from omega.core.ratelimit import TokenBucket
+from omega.core.singleflight import single_flight
+from omega.core.suspension import save_suspensions
 from omega.fetcher.quotes_fetcher import QuotesFetcher
 
 logger = logging.getLogger(__file__)
 
 cfg = cfg4py.get_instance()
 
+# 批量保存k线时，每个pipeline中最多写入的k线条数
+_SAVE_CHUNK = 20000
+
+# get_price每次向上游请求的k线条数（证券数 x 每支证券的k线条数），以及同时进行的请求数
+_PRICE_CHUNK = 5000
+_PRICE_CONCURRENCY = 4
+
+# 调用上游的默认超时（秒）、发出对冲请求的耗时分位数，以及重试次数与请求数之比的上限
+_TIMEOUT = 60
+_HEDGE_QUANTILE = 0.95
+_RETRY_RATIO = 0.1
+
+_SECURITIES_KEY = "securities"
+_SECURITIES_SNAPSHOT_KEY = "securities.snapshot"
+_SECURITIES_VERSION_KEY = "securities.version"
+
+# 当前上下文中调用上游时，令牌桶中为其它调用者保留的容量比例，见`reserve_quota`
+_reserved_quota = contextvars.ContextVar("reserved_quota", default=0.0)
+
+
+def _to_frame(index: int, frame_type: FrameType) -> Frame:
+    """将日历中的序号转换为帧，见[omega.core.frames.frame_index][]"""
+    return int_to_frame(int(index_to_frame([index], frame_type)[0]), frame_type)
+
+
+def _diff_security_list(old: List[str], new: List[str]) -> dict:
+    """比较新旧证券列表（每行为逗号分隔的字符串），返回变化的摘要"""
+    before = {row.split(",")[0]: row.split(",") for row in old}
+    after = {row.split(",")[0]: row.split(",") for row in new}
+    today = str(arrow.now(tz=cfg.tz).date())
+
+    common = [code for code in after if code in before]
+    return {
+        "count": len(after),
+        "added": [code for code in after if code not in before],
+        "removed": [code for code in before if code not in after],
+        "delisted": [
+            code
+            for code in common
+            if before[code][4] != after[code][4] and after[code][4] <= today
+        ],
+        "renamed": [code for code in common if before[code][1:3] != after[code][1:3]],
+    }
+
+
+def _encode_security_list(rows: List[str]) -> bytes:
+    """将证券列表编码为定长字段的numpy数组，返回`np.save`的输出"""
+    fields = list(zip(*[row.split(",") for row in rows]))
+    code, display_name, name, ipo, end, _type = fields
+
+    def width(column):
+        return max([1, *[len(x) for x in column]])
+
+    dtype = [
+        ("code", f"U{width(code)}"),
+        ("display_name", f"U{width(display_name)}"),
+        ("name", f"U{width(name)}"),
+        ("ipo", "i4"),
+        ("end", "i4"),
+        ("type", f"U{width(_type)}"),
+    ]
+    secs = np.empty(len(rows), dtype=dtype)
+    secs["code"] = code
+    secs["display_name"] = display_name
+    secs["name"] = name
+    secs["ipo"] = [int(x.replace("-", "")) for x in ipo]
+    secs["end"] = [int(x.replace("-", "")) for x in end]
+    secs["type"] = _type
+
+    buffer = io.BytesIO()
+    np.save(buffer, secs, allow_pickle=False)
+    return buffer.getvalue()
+
 
 class AbstractQuotesFetcher(QuotesFetcher):
-    _instances = []
+    _balancer = Balancer()
+    # id(fetcher) -> 该fetcher所用账号的令牌桶
+    _limiters: Dict[int, TokenBucket] = {}
+    # 方法名 -> 最近调用的耗时，用于决定何时发出对冲请求
+    _latencies: Dict[str, LatencyWindow] = {}
+    _retry_budget: Optional[RetryBudget] = None
 
     @classmethod
     async def create_instance(cls, module_name, **kwargs):
@@ -38,19 +133,205 @@ class AbstractQuotesFetcher(QuotesFetcher):
         if not callable(factory_method):
             raise TypeError(f"Bad omega adaptor implementation {module_name}")
 
+        quota = kwargs.pop("quota", None) or cls._load_quota(
+            module_name, kwargs.get("account")
+        )
+
         impl: QuotesFetcher = await factory_method(**kwargs)
-        cls._instances.append(impl)
+        name = f"{module_name}.{kwargs.get('account')}"
+        cls._balancer.add(impl, name)
+        if quota:
+            cls._limiters[id(impl)] = TokenBucket(name, **quota)
+            logger.info("upstream quota of %s: %s", name, quota)
+
         logger.info("add one quotes fetcher implementor: %s", module_name)
 
     @classmethod
-    @static_vars(i=0)
+    def _load_quota(cls, module_name: str, account: str) -> Optional[dict]:
+        """从配置文件中查找`module_name`下`account`账号的配额设置"""
+        for fetcher in cfg.quotes_fetchers or []:
+            if fetcher.get("impl") != module_name:
+                continue
+
+            for group in fetcher.get("workers") or []:
+                if group.get("account") == account:
+                    return group.get("quota")
+
+        return None
+
+    @classmethod
+    async def _acquire(cls, fetcher: QuotesFetcher, cost: int = 1):
+        """调用上游之前，从`fetcher`所用账号的令牌桶中取得`cost`个令牌。
+
+        同一账号下的所有进程共享令牌桶，令牌不足时等待，而不是让上游拒绝服务。如果长时间都无法
+        取得令牌，抛出`FetcherQuotaError`。
+        """
+        limiter = cls._limiters.get(id(fetcher))
+        if limiter is None:
+            return
+
+        reserve = _reserved_quota.get() * limiter.capacity
+        if not await limiter.acquire(max(1, cost), reserve):
+            raise FetcherQuotaError(f"{limiter.name}: upstream quota exhausted")
+
+    @classmethod
+    @contextmanager
+    def reserve_quota(cls, ratio: float):
+        """在此上下文中调用上游时，只使用令牌桶中超出`ratio * capacity`的余额。
+
+        用于补齐历史数据等低优先级的调用：它们与其它调用者共用同一账号的令牌桶，总消耗不会
+        超过账号的配额，而保留的部分总是留给盘中同步等其它调用者，见`TokenBucket.take`。
+        """
+        token = _reserved_quota.set(ratio)
+        try:
+            yield
+        finally:
+            _reserved_quota.reset(token)
+
+    @classmethod
+    async def get_quota(cls) -> List[dict]:
+        """返回本进程所用各账号的剩余配额，见`TokenBucket.remaining`"""
+        result = []
+        for limiter in cls._limiters.values():
+            remaining = await limiter.remaining()
+            result.append({"name": limiter.name, **remaining})
+
+        return result
+
+    @classmethod
+    def get_upstream_status(cls) -> List[dict]:
+        """返回本进程各上游实例的负载及健康状态，见`Balancer.status`"""
+        return cls._balancer.status()
+
+    @classmethod
     def get_instance(cls):
-        if len(cls._instances) == 0:
-            raise IndexError("No fetchers available")
+        """返回负载最轻的健康实例，见[omega.core.balancer.Balancer][]"""
+        return cls._balancer.pick()
 
-        i = (cls.get_instance.i + 1) % len(cls._instances)
+    @classmethod
+    def _load_upstream_params(cls, method: str) -> dict:
+        """读取配置文件中的`omega.upstream`，缺失的项使用默认值
+
+        Returns:
+            其中的`timeout`为`method`的超时，未在`timeouts`中单独设置的使用`timeout`
+        """
+        params = getattr(cfg.omega, "upstream", None)
+
+        timeouts = getattr(params, "timeouts", None) or {}
+        if isinstance(timeouts, dict):
+            timeout = timeouts.get(method)
+        else:
+            timeout = getattr(timeouts, method, None)
+
+        hedge = getattr(params, "hedge", None)
+        quantile = getattr(params, "hedge_quantile", None) or _HEDGE_QUANTILE
+        ratio = getattr(params, "retry_budget", None) or _RETRY_RATIO
+        return {
+            "timeout": float(timeout or getattr(params, "timeout", None) or _TIMEOUT),
+            "hedge": True if hedge is None else bool(hedge),
+            "hedge_quantile": float(quantile),
+            "retry_budget": float(ratio),
+        }
+
+    @classmethod
+    async def _invoke(cls, method: str, cost: int, *args, **kwargs):
+        """选择一个上游实例，取得`cost`个令牌后调用其`method`方法。
 
-        return cls._instances[i]
+        从取令牌到调用结束，都计入该实例的负载；调用的耗时和成败用于负载均衡和熔断。每次调用
+        都有超时限制（`omega.upstream.timeout`，可以按方法在`timeouts`中单独设置）。
+
+        登记了多个实例时：如果第一个实例在该方法最近调用耗时的p95之内还没有返回，就向另一个
+        实例发出相同的请求，取先返回的结果；如果没有对冲而调用超时，则换一个实例重试一次。对冲
+        和重试都要从重试预算中支取，预算不足时直接等待（或者抛出）第一个请求的结果，见
+        [omega.core.hedge][]。
+        """
+        params = cls._load_upstream_params(method)
+        timeout = params["timeout"]
+        if cls._retry_budget is None:
+            cls._retry_budget = RetryBudget(params["retry_budget"])
+        budget = cls._retry_budget
+        budget.deposit()
+
+        fetcher = cls.get_instance()
+        tasks = [
+            asyncio.ensure_future(
+                cls._call(fetcher, method, cost, timeout, *args, **kwargs)
+            )
+        ]
+        try:
+            hedge_after = None
+            if params["hedge"] and len(cls._balancer) > 1:
+                latencies = cls._latencies.get(method)
+                if latencies is not None:
+                    hedge_after = latencies.quantile(params["hedge_quantile"])
+
+            if hedge_after is not None:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done and budget.withdraw():
+                    metrics.inc("omega_upstream_hedged_total", method=method)
+                    other = cls._balancer.pick(exclude=fetcher)
+                    tasks.append(
+                        asyncio.ensure_future(
+                            cls._call(other, method, cost, timeout, *args, **kwargs)
+                        )
+                    )
+
+            if len(tasks) > 1:
+                return await cls._first_completed(tasks)
+
+            try:
+                return await tasks[0]
+            except asyncio.TimeoutError:
+                if len(cls._balancer) < 2 or not budget.withdraw():
+                    raise
+
+            metrics.inc("omega_upstream_retries_total", method=method)
+            logger.warning("%s timed out after %s secs, retry once", method, timeout)
+            other = cls._balancer.pick(exclude=fetcher)
+            return await cls._call(other, method, cost, timeout, *args, **kwargs)
+        finally:
+            # 对冲中落后的请求不再需要
+            for task in tasks:
+                task.cancel()
+
+    @classmethod
+    async def _call(
+        cls,
+        fetcher: QuotesFetcher,
+        method: str,
+        cost: int,
+        timeout: float,
+        *args,
+        **kwargs,
+    ):
+        """调用`fetcher`的`method`方法，超过`timeout`秒未返回时抛出`asyncio.TimeoutError`"""
+        with cls._balancer.track(fetcher):
+            await cls._acquire(fetcher, cost)
+
+            t0 = time.time()
+            with metrics.timer("omega_upstream_latency_seconds", method=method):
+                result = await asyncio.wait_for(
+                    getattr(fetcher, method)(*args, **kwargs), timeout
+                )
+
+            cls._latencies.setdefault(method, LatencyWindow()).add(time.time() - t0)
+            return result
+
+    @classmethod
+    async def _first_completed(cls, tasks: List[asyncio.Future]):
+        """返回最先成功的请求的结果。都失败时，抛出最后一个失败的请求的异常"""
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+
+                error = task.exception()
+
+        raise error
 
     @classmethod
     async def get_security_list(cls) -> Union[None, np.ndarray]:
@@ -62,22 +343,106 @@ class AbstractQuotesFetcher(QuotesFetcher):
         Returns:
             Union[None, np.ndarray]: [description]
         """
-        securities = await cls.get_instance().get_security_list()
+        securities = await cls._invoke("get_security_list", 1)
         if securities is None or len(securities) == 0:
             logger.warning("failed to update securities. %s is returned.", securities)
             return securities
 
-        key = "securities"
-        pipeline = cache.security.pipeline()
-        pipeline.delete(key)
-        for code, display_name, name, start, end, _type in securities:
-            pipeline.rpush(
-                key, f"{code},{display_name},{name},{start}," f"{end},{_type}"
-            )
-        await pipeline.execute()
+        await cls.update_security_list(securities)
         return securities
 
     @classmethod
+    async def update_security_list(
+        cls, securities: Optional[np.ndarray] = None
+    ) -> Optional[dict]:
+        """将证券列表存入缓存，返回变化的摘要。
+
+        证券列表的所有写入都经过这里：列表有变化时，发出`SECURITY_LIST_UPDATED`事件，通知各
+        进程重新加载。
+
+        Args:
+            securities: 证券列表，格式见`get_security_list`。为None时从上游取得
+
+        Returns:
+            见`_save_security_list`。如果上游没有返回数据，返回None
+        """
+        if securities is None:
+            securities = await cls._invoke("get_security_list", 1)
+            if securities is None or len(securities) == 0:
+                logger.warning(
+                    "failed to update securities. %s is returned.", securities
+                )
+                return None
+
+        changes = await cls._save_security_list(securities)
+        if changes["changed"]:
+            await emit.emit(Events.SECURITY_LIST_UPDATED, changes)
+
+        return changes
+
+    @classmethod
+    async def _save_security_list(cls, securities: np.ndarray) -> dict:
+        """比较新旧证券列表，只在有变化时更新缓存。
+
+        新的列表先写入临时键，再通过RENAME原子地替换`securities`，读者不会看到空的或者不完整
+        的列表。同时，在同一个事务中更新紧凑的二进制快照`securities.snapshot`（`np.save`的
+        输出，ipo和end为`20200501`格式的整数），并将版本号`securities.version`加一。读者通过
+        一次GET即可加载快照，见`load_security_snapshot`。
+
+        Returns:
+            变化的摘要：
+            ```
+            {
+                count (int): 证券总数
+                version (int): 更新后的版本号
+                changed (bool): 是否有变化
+                added (List[str]): 新增的证券
+                removed (List[str]): 从列表中消失的证券
+                delisted (List[str]): 新近退市（end改变且已到期）的证券
+                renamed (List[str]): 更名（display_name或者name改变）的证券
+            }
+            ```
+        """
+        rows = [
+            f"{code},{display_name},{name},{start},{end},{_type}"
+            for code, display_name, name, start, end, _type in securities
+        ]
+
+        old = await cache.security.lrange(_SECURITIES_KEY, 0, -1, encoding="utf-8")
+        changes = _diff_security_list(old, rows)
+
+        version, has_snapshot = await cache.security.mget(
+            _SECURITIES_VERSION_KEY, _SECURITIES_SNAPSHOT_KEY, encoding=None
+        )
+        if old == rows and has_snapshot:
+            return {**changes, "version": int(version or 0), "changed": False}
+
+        tmp = f"{_SECURITIES_KEY}.{os.getpid()}"
+        pl = cache.security.pipeline()
+        pl.delete(tmp)
+        for i in range(0, len(rows), 1000):
+            pl.rpush(tmp, *rows[i : i + 1000])
+        await pl.execute()
+
+        tr = cache.security.multi_exec()
+        tr.rename(tmp, _SECURITIES_KEY)
+        tr.set(_SECURITIES_SNAPSHOT_KEY, _encode_security_list(rows))
+        tr.incr(_SECURITIES_VERSION_KEY)
+        *_, version = await tr.execute()
+
+        return {**changes, "version": version, "changed": True}
+
+    @classmethod
+    async def load_security_snapshot(cls) -> Optional[np.ndarray]:
+        """通过一次GET加载证券列表的二进制快照，没有快照时返回None"""
+        data = await cache.security.get(_SECURITIES_SNAPSHOT_KEY, encoding=None)
+        if data is None:
+            return None
+
+        return np.load(io.BytesIO(data), allow_pickle=False)
+
+    @classmethod
+    @single_flight("get_bars_batch")
     async def get_bars_batch(
         cls,
         secs: List[str],
@@ -85,12 +450,199 @@ class AbstractQuotesFetcher(QuotesFetcher):
         n_bars: int,
         frame_type: FrameType,
         include_unclosed=True,
-    ) -> np.ndarray:
-        return await cls.get_instance().get_bars_batch(
-            secs, end, n_bars, frame_type.value, include_unclosed
+        persist=True,
+    ) -> Dict[str, np.ndarray]:
+        """批量获取多支证券的行情数据，并将已结束的周期数据存入缓存。
+
+        与[omega.fetcher.abstract_quotes_fetcher.AbstractQuotesFetcher.get_bars][]一样，
+        已结束的k线中停牌的部分以nan填充，只有已结束的k线会存入缓存。所有证券的k线通过分块的
+        pipeline写入，见`_save_bars_batch`。
+
+        Args:
+            secs: 证券代码
+            end: 数据截止日
+            n_bars: 每支证券待获取的数据条数
+            frame_type: 数据所属的周期
+            include_unclosed: 如果为真，则会包含当end所处的那个Frame的数据，即使当前它还未结束
+            persist: 是否存入缓存。自行决定如何写入缓存的调用者（比如同步任务）应该传入False
+
+        Returns:
+            证券代码 -> 该证券的k线。上游没有返回数据的证券不在其中
+        """
+        now = arrow.now(tz=cfg.tz)
+        end = end or now.datetime
+
+        result, closed = await cls._get_bars_batch(
+            secs, end, n_bars, frame_type, include_unclosed, now
         )
+        if persist and len(closed):
+            ranges = await cls._get_bars_ranges(list(closed), frame_type)
+            await cls._save_bars_batch(closed, ranges, frame_type)
+
+        return result
 
     @classmethod
+    async def _get_bars_batch(
+        cls,
+        secs: List[str],
+        end: Frame,
+        n_bars: int,
+        frame_type: FrameType,
+        include_unclosed: bool,
+        now: arrow.Arrow,
+    ) -> Tuple[Dict[str, np.ndarray], Dict[str, List[np.ndarray]]]:
+        """从上游批量获取k线
+
+        Returns:
+            (证券代码 -> 该证券的k线, 证券代码 -> 该证券已结束并以nan填充的k线)
+        """
+        bars = await cls._invoke(
+            "get_bars_batch",
+            n_bars * len(secs),
+            secs,
+            end,
+            n_bars,
+            frame_type.value,
+            include_unclosed,
+        )
+
+        fetched = sum(len(x) for x in (bars or {}).values() if x is not None)
+        metrics.inc("omega_sync_bars_total", fetched, frame=frame_type.value)
+
+        result, closed = {}, {}
+        for code, _bars in (bars or {}).items():
+            if _bars is None or len(_bars) == 0:
+                continue
+
+            closed_bars, remainder = cls._split_closed(
+                _bars, end, n_bars, frame_type, now
+            )
+            closed[code] = [closed_bars]
+            if remainder is None:
+                result[code] = closed_bars
+            else:
+                result[code] = np.concatenate([closed_bars, remainder])
+
+        return result, closed
+
+    @classmethod
+    async def _get_bars_ranges(
+        cls, codes: List[str], frame_type: FrameType
+    ) -> Dict[str, Tuple[Optional[Frame], Optional[Frame]]]:
+        """通过一个pipeline取得各证券在缓存中的(head, tail)"""
+        if frame_type in tf.minute_level_frames:
+            convert = tf.int2time
+        else:
+            convert = tf.int2date
+
+        pl = cache.security.pipeline()
+        for code in codes:
+            pl.hget(f"{code}:{frame_type.value}", "head")
+            pl.hget(f"{code}:{frame_type.value}", "tail")
+        recs = await pl.execute()
+
+        ranges = {}
+        for code, head, tail in zip(codes, recs[::2], recs[1::2]):
+            if all([head, tail]):
+                ranges[code] = (convert(head), convert(tail))
+            else:
+                ranges[code] = (None, None)
+
+        return ranges
+
+    @classmethod
+    async def _save_bars_batch(
+        cls,
+        fetched: Dict[str, List[np.ndarray]],
+        ranges: Dict[str, Tuple[Optional[Frame], Optional[Frame]]],
+        frame_type: FrameType,
+        overwrite: bool = False,
+    ) -> int:
+        """将多支证券的k线数据通过分块的pipeline存入缓存。
+
+        存储格式与`omicron.cache.save_bars`一致。与之相同，只有与缓存中已有数据连续的k线才会
+        被保存，以保证[head, tail]区间内没有空洞。每积累`_SAVE_CHUNK`条k线执行一次pipeline，
+        同一支证券的k线及其head/tail总在同一次执行中写入。保存日线时，同时更新停牌日历，见
+        [omega.core.suspension.save_suspensions][]。
+
+        Args:
+            fetched: 证券代码 -> 该证券取得的若干段k线
+            ranges: 证券代码 -> 写入前缓存中该证券的(head, tail)
+            frame_type: k线的帧类型
+            overwrite: 是否覆盖[head, tail]区间内已有的k线。默认只保存区间之外的k线
+
+        Returns:
+            存入缓存的k线条数
+        """
+        if frame_type in tf.minute_level_frames:
+            convert = tf.time2int
+        else:
+            convert = tf.date2int
+
+        saved = 0
+        lasts = []
+        suspensions = {}
+        pl, pending = cache.security.pipeline(), 0
+        for code, segments in fetched.items():
+            bars = np.concatenate(segments)
+            bars = bars[np.argsort(bars["frame"], kind="stable")]
+            head, tail = ranges.get(code, (None, None))
+
+            if head and tail:
+                if (
+                    tf.shift(bars["frame"][-1], 1, frame_type) < head
+                    or tf.shift(bars["frame"][0], -1, frame_type) > tail
+                ):
+                    logger.warning(
+                        "discrete bars found, code: %s, db(%s, %s), bars(%s,%s)",
+                        code,
+                        head,
+                        tail,
+                        bars["frame"][0],
+                        bars["frame"][-1],
+                    )
+                    continue
+
+                if not overwrite:
+                    bars = bars[(bars["frame"] < head) | (bars["frame"] > tail)]
+                if len(bars) == 0:
+                    continue
+                head = min(head, bars["frame"][0])
+                tail = max(tail, bars["frame"][-1])
+            else:
+                head, tail = bars["frame"][0], bars["frame"][-1]
+
+            key = f"{code}:{frame_type.value}"
+            values = {
+                convert(frame): f"{o:.2f} {h:.2f} {l:.2f} {c:.2f} {v} {a:.2f} {fq:.2f}"
+                for frame, o, h, l, c, v, a, fq in bars
+            }
+            pl.hmset_dict(key, values)
+            pl.hset(key, "head", convert(head))
+            pl.hset(key, "tail", convert(tail))
+            saved += len(bars)
+            pending += len(bars)
+            lasts.append(bars["frame"][-1])
+            suspensions[code] = bars
+
+            if pending >= _SAVE_CHUNK:
+                with metrics.timer("omega_cache_save_seconds", frame=frame_type.value):
+                    await pl.execute()
+                pl, pending = cache.security.pipeline(), 0
+
+        if pending > 0:
+            with metrics.timer("omega_cache_save_seconds", frame=frame_type.value):
+                await pl.execute()
+
+        if frame_type == FrameType.DAY:
+            await save_suspensions(suspensions)
+
+        for frame in lasts:
+            metrics.observe_lag(frame_type, frame)
+        return saved
+
+    @classmethod
+    @single_flight("get_bars")
     async def get_bars(
         cls,
         sec: str,
@@ -98,6 +650,7 @@ class AbstractQuotesFetcher(QuotesFetcher):
         n_bars: int,
         frame_type: FrameType,
         include_unclosed=True,
+        read_through=False,
     ) -> np.ndarray:
         """获取行情数据，并将已结束的周期数据存入缓存。
 
@@ -168,6 +721,8 @@ class AbstractQuotesFetcher(QuotesFetcher):
             n_bars: 待获取的数据条数
             frame_type: 数据所属的周期
             include_unclosed: 如果为真，则会包含当end所处的那个Frame的数据，即使当前它还未结束
+            read_through: 如果为真，缓存中已有的k线直接从缓存中读取，只向上游请求缓存之外的
+                部分，见`_read_through`
         """
         now = arrow.now(tz=cfg.tz)
         end = end or now.datetime
@@ -180,13 +735,48 @@ class AbstractQuotesFetcher(QuotesFetcher):
             if end > now:
                 return None
 
-        bars = await cls.get_instance().get_bars(
-            sec, end, n_bars, frame_type.value, include_unclosed
+        if read_through:
+            bars = await cls._read_through(
+                sec, end, n_bars, frame_type, include_unclosed
+            )
+            if bars is not None:
+                return bars
+
+        bars = await cls._invoke(
+            "get_bars", n_bars, sec, end, n_bars, frame_type.value, include_unclosed
         )
 
         if len(bars) == 0:
             return
 
+        metrics.inc("omega_sync_bars_total", len(bars), frame=frame_type.value)
+
+        closed_bars, remainder = cls._split_closed(bars, end, n_bars, frame_type, now)
+
+        # 只保存已结束的bar
+        with metrics.timer("omega_cache_save_seconds", frame=frame_type.value):
+            await cache.save_bars(sec, closed_bars, frame_type)
+        if len(closed_bars):
+            metrics.observe_lag(frame_type, closed_bars[-1]["frame"])
+        if remainder is None:
+            return closed_bars
+        else:
+            return np.concatenate([closed_bars, remainder])
+
+    @classmethod
+    def _split_closed(
+        cls,
+        bars: np.ndarray,
+        end: Frame,
+        n_bars: int,
+        frame_type: FrameType,
+        now: arrow.Arrow,
+    ) -> Tuple[np.ndarray, Optional[list]]:
+        """将上游返回的k线分为已结束和未结束的两部分，已结束的部分以nan填充停牌期间
+
+        Returns:
+            (已结束的k线, 未结束的k线)。如果没有未结束的k线，后者为None
+        """
         # 根据指定的end，计算结束时的frame
         last_closed_frame = tf.floor(end, frame_type)
 
@@ -202,28 +792,84 @@ class AbstractQuotesFetcher(QuotesFetcher):
                 n_closed = n_bars
         else:
             # 如果last_frame <= end的上限，则返回的也一定是全部都closed的数据
-            if last_frame <= tf.floor(end, frame_type):
+            if last_frame <= last_closed_frame:
                 n_closed = n_bars
 
         remainder = [bars[-1]] if n_closed < n_bars else None
 
         closed_bars = cls._fill_na(bars, n_closed, last_closed_frame, frame_type)
+        return closed_bars, remainder
 
-        # 只保存已结束的bar
-        await cache.save_bars(sec, closed_bars, frame_type)
-        if remainder is None:
-            return closed_bars
-        else:
-            return np.concatenate([closed_bars, remainder])
+    @classmethod
+    async def _read_through(
+        cls,
+        sec: str,
+        end: Frame,
+        n_bars: int,
+        frame_type: FrameType,
+        include_unclosed: bool,
+    ) -> Optional[np.ndarray]:
+        """先读缓存，只向上游请求缓存之外的k线。
+
+        请求的k线分为三段：缓存的tail之后的部分（包括未结束的k线），以及缓存的head之前的部分，
+        都向上游请求并存入缓存；两者之间的部分从缓存中读取。缓存的数据是连续的，因此三段拼接
+        起来即是完整的结果。
+
+        Returns:
+            拼接后的k线。如果缓存为空，或者缓存中没有可用的数据，返回None，由调用者直接向上游
+            请求全部的k线
+        """
+        key = f"{sec}:{frame_type.value}"
+        head, tail = await cache.security.hmget(key, "head", "tail")
+        head, tail = int(head or 0), int(tail or 0)
+        if head == 0 or tail == 0:
+            return None
+
+        last = frame_to_int(tf.floor(end, frame_type), frame_type)
+        i_head, i_tail, i_last = frame_index([head, tail, last], frame_type).tolist()
+
+        # tail之后已结束的k线，外加一根可能未结束的k线
+        n_suffix = max(0, i_last - i_tail) + 1
+        if n_suffix >= n_bars or i_last < i_head:
+            return None
+
+        suffix = await cls.get_bars(sec, end, n_suffix, frame_type, include_unclosed)
+        if suffix is None or len(suffix) == 0:
+            return None
+
+        need = n_bars - len(suffix)
+        if need <= 0:
+            return suffix[-n_bars:]
+
+        first = frame_to_int(suffix[0]["frame"], frame_type)
+        i_before = int(frame_index([first], frame_type)[0]) - 1
+        if i_before > i_tail:
+            return None
+
+        parts = [suffix]
+        n_cached = max(0, min(need, i_before - i_head + 1))
+        if n_cached > 0:
+            cached = await cache.get_bars(
+                sec, _to_frame(i_before, frame_type), n_cached, frame_type
+            )
+            parts.insert(0, cached)
+            metrics.inc(
+                "omega_read_through_bars_total", n_cached, frame=frame_type.value
+            )
+
+        i_prefix = i_before - n_cached
+        if need > n_cached and i_prefix >= 0:
+            prefix = await cls.get_bars(
+                sec, _to_frame(i_prefix, frame_type), need - n_cached, frame_type, False
+            )
+            if prefix is not None and len(prefix):
+                parts.insert(0, prefix)
+
+        return np.concatenate(parts)
 
     @classmethod
     def _fill_na(cls, bars: np.array, n: int, end: Frame, frame_type) -> np.ndarray:
-        if frame_type in tf.minute_level_frames:
-            convert = tf.int2time
-        else:
-            convert = tf.int2date
-
-        frames = [convert(x) for x in tf.get_frames_by_count(end, n, frame_type)]
+        frames = int2frames(tf.get_frames_by_count(end, n, frame_type), tf._tz)
         filled = np.empty(n, dtype=bars.dtype)
         filled[:] = np.nan
         filled["frame"] = frames
@@ -232,11 +878,12 @@ class AbstractQuotesFetcher(QuotesFetcher):
 
     @classmethod
     async def get_all_trade_days(cls):
-        days = await cls.get_instance().get_all_trade_days()
+        days = await cls._invoke("get_all_trade_days", 1)
         await cache.save_calendar("day_frames", map(tf.date2int, days))
         return days
 
     @classmethod
+    @single_flight("get_valuation")
     async def get_valuation(
         cls,
         code: Union[str, List[str]],
@@ -244,8 +891,10 @@ class AbstractQuotesFetcher(QuotesFetcher):
         fields: List[str] = None,
         n: int = 1,
     ) -> np.ndarray:
-
-        valuation = await cls.get_instance().get_valuation(code, day, n)
+        codes = [code] if isinstance(code, str) else code
+        valuation = await cls._invoke(
+            "get_valuation", len(codes or []) * n, code, day, n
+        )
 
         await Valuation.save(valuation)
 
@@ -262,28 +911,105 @@ class AbstractQuotesFetcher(QuotesFetcher):
     @classmethod
     async def get_price(
         cls,
-        sec: Union[List, str],
-        end_date: Union[str, datetime.datetime],
-        n_bars: Optional[int],
-        start_date: Optional[Union[str, datetime.datetime]] = None,
-    ) -> np.ndarray:
-        fields = ['open', 'close', 'high', 'low', 'volume', 'money', 'high_limit', 'low_limit', 'avg', 'factor']
-        params = {
-            "security": sec,
-            "end_date": end_date,
-            "fields": fields,
-            "fq": None,
-            "fill_paused": False,
-            "frequency": FrameType.MIN1.value,
-        }
-        if start_date:
-            params.update({"start_date": start_date})
-        if n_bars is not None:
-            params.update({"count": start_date})
-        if "start_date" in params and "count" in params:
-            raise ValueError("start_date and count cannot appear at the same time")
+        secs: Union[List[str], str],
+        end: Frame = None,
+        n_bars: Optional[int] = None,
+        frame_type: FrameType = FrameType.MIN1,
+        start: Optional[Frame] = None,
+        include_unclosed: bool = True,
+        persist: bool = True,
+        chunk: int = _PRICE_CHUNK,
+        concurrency: int = _PRICE_CONCURRENCY,
+    ) -> AsyncIterator[Tuple[str, np.ndarray]]:
+        """获取多支证券在一段时间内的k线，以异步生成器的方式逐段返回。
+
+        请求被拆分为若干窗口，每个窗口向上游请求不超过`chunk`条k线。至多`concurrency`个窗口
+        同时向上游请求（仍受各账号的配额限制），窗口按顺序返回，因此内存占用与区间的长短无关。
+        同一组证券的窗口按时间从近到远返回，这样已结束的k线总能与缓存中的数据衔接，被存入缓存。
+
+        ```
+        async for code, bars in aq.get_price(secs, end, 10000, FrameType.MIN1):
+            ...
+        ```
 
-        bars = await cls.get_instance().get_price(**params)
+        Args:
+            secs: 证券代码
+            end: 截止时间，默认为当前时间
+            n_bars: 每支证券已结束的k线条数，与`start`只能指定其一
+            frame_type: k线的帧类型
+            start: 起始时间，与`n_bars`只能指定其一
+            include_unclosed: 为真时，在最前面另外返回`end`所在的未结束的k线（如果有）
+            persist: 是否将已结束的k线存入缓存
+            chunk: 每次向上游请求的k线条数
+            concurrency: 同时进行的请求数
 
-        if len(bars) == 0:
-            return
+        Returns:
+            逐个产生(证券代码, 一个窗口内该证券的k线)。k线按时间升序排列，已结束的k线中停牌的
+            部分以nan填充，与`get_bars_batch`一致
+        """
+        if (start is None) == (n_bars is None):
+            raise ValueError("one and only one of start and n_bars should be given")
+
+        codes = [secs] if isinstance(secs, str) else list(secs)
+        now = arrow.now(tz=cfg.tz)
+        end = end or now.datetime
+
+        # 最后一个已结束的帧。盘中时当天的日线（以及周五的周线等）尚未结束
+        last = tf.floor(end, frame_type)
+        if frame_type in tf.day_level_frames and now.hour < 15 and last == now.date():
+            last = tf.shift(last, -1, frame_type)
+
+        i_last = int(frame_index([frame_to_int(last, frame_type)], frame_type)[0])
+        if start is not None:
+            i_first = int(frame_index([frame_to_int(start, frame_type)], frame_type)[0])
+        else:
+            i_first = i_last - n_bars + 1
+        i_first = max(0, i_first)
+
+        # (证券, 截止帧, k线条数, 是否为未结束的k线)
+        windows = []
+        size = max(1, min(len(codes), chunk))
+        for i in range(0, len(codes), size):
+            group = codes[i : i + size]
+            if include_unclosed:
+                windows.append((group, end, 1, True))
+
+            step = max(1, chunk // len(group))
+            for stop in range(i_last, i_first - 1, -step):
+                n = min(step, stop - i_first + 1)
+                windows.append((group, _to_frame(stop, frame_type), n, False))
+
+        def fetch(window) -> asyncio.Task:
+            group, w_end, n, unclosed = window
+            return asyncio.create_task(
+                cls._get_bars_batch(group, w_end, n, frame_type, unclosed, now)
+            )
+
+        windows = iter(windows)
+        pending = collections.deque(
+            (window, fetch(window)) for window in itertools.islice(windows, concurrency)
+        )
+        try:
+            while pending:
+                window, task = pending.popleft()
+                result, closed = await task
+                pending.extend(
+                    (window, fetch(window)) for window in itertools.islice(windows, 1)
+                )
+
+                if window[3]:
+                    for code, bars in result.items():
+                        bars = bars[bars["frame"] > last]
+                        if len(bars):
+                            yield code, bars
+                    continue
+
+                if persist and len(closed):
+                    ranges = await cls._get_bars_ranges(list(closed), frame_type)
+                    await cls._save_bars_batch(closed, ranges, frame_type)
+
+                for code, bars in result.items():
+                    yield code, bars
+        finally:
+            for _, task in pending:
+                task.cancel()
@@ -5,6 +5,7 @@ import arrow
 import cfg4py
 from omicron.core.timeframe import tf
 from omicron.core.types import FrameType
+from omicron.models.valuation import Valuation
 from sanic import Blueprint, response
 
 from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
@@ -27,7 +28,8 @@ async def get_valuation(request):
         logger.error("problem params:%s", request.json)
         return response.empty(status=400)
     try:
-        valuation = await aq.get_valuation(secs, date, fields, n)
+        # 先从数据库中读取，数据库中没有（或者未启用数据库）时，才通过aq请求上游
+        valuation = await Valuation.get(secs, date, fields, n)
         body = pickle.dumps(valuation, protocol=cfg.pickle.ver)
         return response.raw(body)
     except Exception as e:
@@ -74,8 +76,11 @@ async def get_bars_handler(request):
         end = end.date() if frame_type in tf.day_level_frames else end.datetime
         n_bars = request.json.get("n_bars")
         include_unclosed = request.json.get("include_unclosed", False)
+        read_through = request.json.get("read_through", False)
 
-        bars = await aq.get_bars(sec, end, n_bars, frame_type, include_unclosed)
+        bars = await aq.get_bars(
+            sec, end, n_bars, frame_type, include_unclosed, read_through
+        )
 
         body = pickle.dumps(bars, protocol=cfg.pickle.ver)
         return response.raw(body)
@@ -1,6 +1,8 @@
 from sanic import Blueprint, response
 
 from omega import __version__
+from omega.core import metrics
+from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
 
 bp = Blueprint("sys", url_prefix="/sys/")
 
@@ -8,3 +10,32 @@ bp = Blueprint("sys", url_prefix="/sys/")
 @bp.route("version")
 async def get_version(request):
     return response.text(__version__)
+
+
+@bp.route("quota")
+async def get_quota(request):
+    """本进程所用各上游账号的剩余配额"""
+    return response.json(await aq.get_quota())
+
+
+@bp.route("upstreams")
+async def get_upstreams(request):
+    """本进程各上游实例的负载及健康状态"""
+    return response.json(aq.get_upstream_status())
+
+
+@bp.route("metrics")
+async def get_metrics(request):
+    """以Prometheus文本格式输出同步指标，包括本进程所用各账号的剩余配额及各上游实例的状态"""
+    gauges = await metrics.queue_gauges()
+    for quota in await aq.get_quota():
+        labels = {"name": quota["name"]}
+        gauges.append(("omega_upstream_quota_remaining", labels, quota["remaining"]))
+
+    upstreams = aq.get_upstream_status()
+    for field in ("inflight", "healthy"):
+        for status in upstreams:
+            labels = {"name": status["name"]}
+            gauges.append((f"omega_upstream_{field}", labels, int(status[field])))
+
+    return response.text(await metrics.render(gauges))
@@ -14,13 +14,17 @@ import cfg4py
 import fire
 import omicron
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from omicron import cache
 from omicron.core.timeframe import tf
+from omicron.core.types import FrameType
 from pyemit import emit
 from sanic import Sanic, response
 
+import omega.jobs.backfill as backfill
 import omega.jobs.syncjobs as syncjobs
+import omega.jobs.valuation as valuation
 from omega.config import get_config_dir
+from omega.core import metrics
+from omega.core.events import Events
 from omega.logreceivers.redis import RedisLogReceiver
 
 app = Sanic("Omega-jobs")
@@ -53,6 +57,7 @@ async def heartbeat():
     pid = os.getpid()
     key = "process.jobs"
     await omicron.cache.sys.hmset(key, "pid", pid, "heartbeat", time.time())
+    await metrics.flush()
 
 
 async def init(app, loop):  # noqa
@@ -65,6 +70,10 @@ async def init(app, loop):  # noqa
     logger.info("init omega-jobs process with config at %s", config_dir)
 
     await omicron.init()
+
+    # 同步批次完成后，执行其后续步骤
+    emit.register(Events.OMEGA_SYNC_DONE, syncjobs.on_bars_sync_done)
+    emit.register(Events.SECURITY_LIST_UPDATED, syncjobs.on_security_list_updated)
     await emit.start(emit.Engine.REDIS, dsn=cfg.redis.dsn)
 
     scheduler = AsyncIOScheduler(timezone=cfg.tz)
@@ -92,31 +101,36 @@ async def init(app, loop):  # noqa
 
     syncjobs.load_bars_sync_jobs(scheduler)
 
-    # sync bars at startup
-    last_sync = await cache.sys.get("jobs.bars_sync.stop")
-
-    if last_sync:
-        try:
-            last_sync = arrow.get(last_sync, tzinfo=cfg.tz).timestamp
-        except ValueError:
-            logger.warning("failed to parse last_sync: %s", last_sync)
-            last_sync = None
-
-    if not last_sync or time.time() - last_sync >= 24 * 3600:
-        next_run_time = arrow.now(cfg.tz).shift(minutes=5).datetime
-        logger.info("start catch-up quotes sync at %s", next_run_time)
-
-        for frame_type in itertools.chain(tf.day_level_frames, tf.minute_level_frames):
-            params = syncjobs.load_sync_params(frame_type)
-            if params:
-                scheduler.add_job(
-                    syncjobs.trigger_bars_sync,
-                    args=(params, True),
-                    name=f"catch-up sync for {frame_type}",
-                    next_run_time=next_run_time,
-                )
-    else:
-        logger.info("%s: less than 24 hours since last sync", last_sync)
+    # 启动时，继续上次未完成的同步批次；或者按各证券的同步进度，补齐实际缺失的数据。等待
+    # 5分钟，以便fetcher进程完成启动
+    next_run_time = arrow.now(cfg.tz).shift(minutes=5).datetime
+    logger.info("resume quotes sync at %s", next_run_time)
+
+    for frame_type in itertools.chain(tf.day_level_frames, tf.minute_level_frames):
+        params = syncjobs.load_sync_params(frame_type)
+        if params:
+            scheduler.add_job(
+                syncjobs.resume_bars_sync,
+                args=(params,),
+                name=f"resume sync for {frame_type}",
+                next_run_time=next_run_time,
+            )
+
+    # 收盘后同步当天的市值数据；启动时补齐停机期间缺失的日期
+    if getattr(cfg.omega.sync, "valuation", None):
+        h, m = map(int, cfg.omega.sync.valuation.time.split(":"))
+        scheduler.add_job(
+            valuation.trigger_valuation_sync,
+            "cron",
+            hour=h,
+            minute=m,
+            name="sync_valuation",
+        )
+        scheduler.add_job(
+            valuation.trigger_valuation_sync,
+            name="resume valuation sync",
+            next_run_time=next_run_time,
+        )
 
     scheduler.start()
     logger.info("omega jobs finished initialization")
@@ -131,11 +145,50 @@ async def start_sync(request):  # pragma: no cover :they're in another process
     return response.text("sync task scheduled")
 
 
+@app.route("/jobs/backfill")
+async def start_backfill(request):  # pragma: no cover :they're in another process
+    logger.info("received http command backfill")
+    sync_params = request.json
+
+    app.add_task(backfill.trigger_backfill(sync_params))
+    return response.text("backfill task scheduled")
+
+
+@app.route("/jobs/sync_valuation")
+async def start_valuation_sync(request):  # pragma: no cover
+    logger.info("received http command sync_valuation")
+    params = request.json
+
+    app.add_task(valuation.trigger_valuation_sync(params))
+    return response.text("valuation sync task scheduled")
+
+
+@app.route("/jobs/backfill/progress")
+async def get_backfill_progress(request):  # pragma: no cover
+    frame_type = FrameType(request.args.get("frame"))
+    progress = await backfill.get_progress(frame_type)
+    done = len([n for n in progress.values() if n == 0])
+    return response.json(
+        {
+            "total": len(progress),
+            "done": done,
+            "remaining": sum(progress.values()),
+            "failed": await backfill.get_failed(frame_type),
+        }
+    )
+
+
 @app.route("/jobs/status")  # pragma: no cover
 async def get_status(request):
     return response.empty(status=200)
 
 
+@app.route("/jobs/metrics")
+async def get_metrics(request):
+    """以Prometheus文本格式输出同步指标"""
+    return response.text(await metrics.render(await metrics.queue_gauges()))
+
+
 @app.listener("after_server_stop")
 async def on_shutdown(app, loop):  # pragma: no cover
     global receiver
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+历史数据补齐。
+
+补齐多年的历史数据（特别是分钟线）需要大量的上游调用。如果与盘中同步走同一条通道，会挤占
+实时数据的同步。因此补齐历史数据有自己的队列和worker：
+
+1. 每支证券一个任务，记录其待补齐的[start, stop]。worker每次领取任务后，只补齐与缓存中已有
+   数据相邻的一段（不超过`chunk`帧），然后将任务放回队尾，与其它证券轮流进行。由于每次都按
+   缓存中的实际数据重新计算缺口，任务可以安全地重复执行，进程重启后也能接着补齐。
+2. 补齐与盘中同步共用同一账号的令牌桶，但只使用桶中超出`(1 - quota_share) * capacity`的余额，
+   其余部分总是留给盘中同步，两者的总消耗不超过账号的配额。
+3. 在分钟线同步触发的前后，以及有worker正在进行盘中同步时，暂停补齐。
+4. 每支证券剩余待补齐的帧数记录在`jobs.backfill.progress.{frame}`中，为0表示已完成。
+5. 补齐出错时，任务被放回队尾稍后重试，出错次数记录在`jobs.backfill.failures.{frame}`中。同一
+   证券出错`_RETRIES`次后放弃，其剩余帧数保留在进度中，重新触发补齐时再次尝试。
+"""
+import asyncio
+import datetime
+import logging
+import os
+from typing import Dict, List, Tuple
+
+import arrow
+import cfg4py
+import numpy as np
+from omicron import cache
+from omicron.core.errors import FetcherQuotaError
+from omicron.core.timeframe import tf
+from omicron.core.types import FrameType
+from pyemit import emit
+
+from omega.core.events import Events
+from omega.core.frames import (
+    derived_frames,
+    frame_index,
+    frame_to_int,
+    index_to_frame,
+    int_to_frame,
+)
+from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
+from omega.jobs import syncjobs
+from omega.jobs.planner import compute_windows, decode_job, encode_job, plan_bars_sync
+from omega.jobs.sharding import ShardedWorkQueue, live_fetchers
+
+logger = logging.getLogger(__name__)
+cfg = cfg4py.get_instance()
+
+# 每次向上游请求的k线条数
+_CHUNK = 1000
+# 补齐数据可以使用的上游配额比例
+_QUOTA_SHARE = 0.2
+# 分钟线同步触发前、后暂停补齐的秒数
+_PAUSE = (10, 60)
+# 每支证券出错多少次后放弃补齐
+_RETRIES = 3
+
+
+def _scope_key(frame_type: FrameType) -> str:
+    return f"jobs.backfill.scope.{frame_type.value}"
+
+
+def _progress_key(frame_type: FrameType) -> str:
+    return f"jobs.backfill.progress.{frame_type.value}"
+
+
+def _failures_key(frame_type: FrameType) -> str:
+    return f"jobs.backfill.failures.{frame_type.value}"
+
+
+def load_backfill_params() -> dict:
+    """读取配置文件中的`omega.sync.backfill`，缺失的项使用默认值"""
+    params = getattr(cfg.omega.sync, "backfill", None)
+    return {
+        "chunk": int(getattr(params, "chunk", None) or _CHUNK),
+        "quota_share": float(getattr(params, "quota_share", None) or _QUOTA_SHARE),
+        "pause": tuple(getattr(params, "pause", None) or _PAUSE),
+    }
+
+
+async def trigger_backfill(sync_params: dict) -> int:
+    """将待补齐的证券放入补齐队列，发信号给各quotes_fetcher进程开始补齐。
+
+    与[omega.jobs.syncjobs.trigger_bars_sync][]不同，新的任务追加到队列中，不会影响尚未
+    完成的补齐任务。
+
+    Args:
+        sync_params: 同步参数，见[omega.jobs.syncjobs.parse_sync_params][]
+
+    Returns:
+        需要补齐的证券数
+    """
+    codes, frame_type, start, stop, _ = syncjobs.parse_sync_params(**sync_params)
+
+    # 每支证券的区间已被限制在其上市期间之内
+    windows = await plan_bars_sync(codes, frame_type, start, stop)
+    remaining, bounds = {}, {}
+    for window in windows:
+        code, s, e, n = window.split(",")
+        remaining[code] = remaining.get(code, 0) + int(n)
+        lo, hi = bounds.get(code, (int(s), int(e)))
+        bounds[code] = (min(lo, int(s)), max(hi, int(e)))
+
+    if len(remaining) == 0:
+        logger.info("nothing to backfill for %s secs(%s)", len(codes), frame_type)
+        return 0
+
+    jobs = [encode_job(code, *bounds[code], n) for code, n in remaining.items()]
+
+    queue = ShardedWorkQueue(_scope_key(frame_type))
+    await queue.put(jobs, await live_fetchers())
+    await cache.sys.hmset_dict(_progress_key(frame_type), remaining)
+    await cache.sys.hdel(_failures_key(frame_type), *remaining.keys())
+
+    params = {"frame_type": frame_type, **load_backfill_params()}
+    await emit.emit(Events.OMEGA_DO_BACKFILL, params)
+
+    fmt_str = "backfill %s secs(%s) from %s to %s, %s frames in total"
+    logger.info(fmt_str, len(jobs), frame_type, start, stop, sum(remaining.values()))
+    return len(jobs)
+
+
+async def get_progress(frame_type: FrameType) -> Dict[str, int]:
+    """返回各证券剩余待补齐的帧数，0表示已完成"""
+    progress = await cache.sys.hgetall(_progress_key(frame_type))
+    return {code: int(n) for code, n in (progress or {}).items()}
+
+
+async def get_failed(frame_type: FrameType) -> List[str]:
+    """返回因多次出错而放弃补齐的证券"""
+    failures = await cache.sys.hgetall(_failures_key(frame_type))
+    return sorted(code for code, n in (failures or {}).items() if int(n) >= _RETRIES)
+
+
+def _live_frames() -> List[Tuple[FrameType, int]]:
+    """需要盘中同步的分钟线帧类型，及其同步延迟（秒）"""
+    derived = derived_frames()
+
+    frames = []
+    for params in cfg.omega.sync.bars or []:
+        frame_type = FrameType(params.get("frame"))
+        if frame_type in tf.minute_level_frames and frame_type not in derived:
+            frames.append((frame_type, int(params.get("delay") or 0)))
+
+    return frames
+
+
+def pause_seconds(now: datetime.datetime, pause: Tuple[int, int]) -> float:
+    """如果`now`处于某个分钟线同步触发前`pause[0]`秒至触发后`pause[1]`秒之间，返回距离
+    暂停结束的秒数，否则返回0
+    """
+    if not tf.is_trade_day(now):
+        return 0
+
+    before, after = pause
+    secs = now.hour * 3600 + now.minute * 60 + now.second
+    wait = 0
+    for frame_type, delay in _live_frames():
+        for tick in tf.ticks[frame_type]:
+            trigger = tick * 60 + delay
+            if trigger - before <= secs < trigger + after:
+                wait = max(wait, trigger + after - secs)
+
+    return wait
+
+
+async def _live_sync_busy() -> bool:
+    """是否有worker正在进行盘中同步（即同步队列中有未过期的租约）"""
+    for frame_type, _ in _live_frames():
+        queue = ShardedWorkQueue(f"jobs.bars_sync.scope.{frame_type.value}")
+        if len(await queue.leased()) > 0:
+            return True
+
+    return False
+
+
+async def _wait_for_live_sync(pause: Tuple[int, int]):
+    while True:
+        wait = pause_seconds(arrow.now(tz=cfg.tz).datetime, pause)
+        if wait <= 0 and not await _live_sync_busy():
+            return
+
+        logger.debug("backfill paused for live sync, check again in %s secs", wait)
+        await asyncio.sleep(max(wait, 1))
+
+
+async def backfill_chunk(job: str, frame_type: FrameType, chunk: int) -> int:
+    """补齐`job`中与缓存中已有数据相邻的一段，不超过`chunk`帧。
+
+    缓存为空，或者缺口在head之前时，从缺口的末尾向前补齐；缺口在tail之后时，从缺口的起点向后
+    补齐。这样每一段都与缓存中的数据连续，能够被保存。
+
+    Returns:
+        该证券剩余待补齐的帧数
+    """
+    code, start, stop, _ = decode_job(job, frame_type)
+    key = f"{code}:{frame_type.value}"
+    head, tail = [int(x or 0) for x in await cache.security.hmget(key, "head", "tail")]
+
+    pos, starts, stops, counts = compute_windows(
+        np.array([head]),
+        np.array([tail]),
+        frame_to_int(start, frame_type),
+        frame_to_int(stop, frame_type),
+        frame_type,
+    )
+    total = int(counts.sum())
+    if total == 0:
+        await cache.sys.hset(_progress_key(frame_type), code, 0)
+        return 0
+
+    s, e = frame_index([starts[0], stops[0]], frame_type)
+    n = min(chunk, int(counts[0]))
+    if head == 0 or stops[0] < head:
+        s = e - n + 1
+    else:
+        e = s + n - 1
+
+    w_start, w_stop = [
+        int_to_frame(frame, frame_type)
+        for frame in index_to_frame([s, e], frame_type).tolist()
+    ]
+    await syncjobs.sync_bars_for_window(code, frame_type, w_start, w_stop, n)
+
+    remaining = total - n
+    await cache.sys.hset(_progress_key(frame_type), code, remaining)
+    return remaining
+
+
+async def backfill_bars(params: dict):
+    """backfill bars on signal OMEGA_DO_BACKFILL received
+
+    Args:
+        params (dict): composed of the following:
+            ```
+            {
+                frame_type (FrameType): k线的帧类型
+                chunk (int): 每次向上游请求的k线条数
+                quota_share (float): 可以使用的令牌桶容量的比例，其余部分留给盘中同步
+                pause (Tuple[int, int]): 分钟线同步触发前、后暂停补齐的秒数
+            }
+            ```
+    """
+    frame_type = params["frame_type"]
+    chunk = params.get("chunk") or _CHUNK
+    share = params.get("quota_share") or _QUOTA_SHARE
+    pause = params.get("pause") or _PAUSE
+
+    queue = ShardedWorkQueue(_scope_key(frame_type))
+    while True:
+        await _wait_for_live_sync(pause)
+
+        claimed = await queue.claim(1)
+        if not claimed:
+            break
+
+        job = claimed[0]
+        try:
+            # 上游调用在取得令牌时为盘中同步保留余额
+            with aq.reserve_quota(1 - share):
+                remaining = await backfill_chunk(job, frame_type, chunk)
+        except FetcherQuotaError as e:
+            logger.warning("Quota exceeded when backfilling %s. Paused.", job)
+            logger.exception(e)
+            await queue.release(job)
+            return
+        except Exception as e:
+            logger.warning("Failed to backfill %s", job)
+            logger.exception(e)
+
+            # 进度中的剩余帧数保持不变，重试次数用完后放弃
+            code = job.split(",")[0]
+            failures = await cache.sys.hincrby(_failures_key(frame_type), code)
+            if failures < _RETRIES:
+                await queue.requeue(job)
+            else:
+                logger.error("gave up backfilling %s after %s failures", code, failures)
+                await queue.ack(job)
+            continue
+
+        if remaining > 0:
+            await queue.requeue(job)
+        else:
+            await queue.ack(job)
+
+    logger.info("%s finished backfill of %s", os.getpid(), frame_type)
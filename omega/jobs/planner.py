@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+k线同步计划。
+
+在发出同步信号之前，一次性读出所有待同步证券在缓存中的[head, tail]，计算出每支证券缺失的
+区间(window)。只有存在缺失区间的证券才会进入同步队列。
+
+每支证券的区间被限制在其上市期间（按证券列表中的上市日和退市日）之内。此外，由日线得知的停牌日
+记录在停牌日历中，整个区间都处于停牌日的分钟线任务，无须向上游请求，可以在本地直接合成。
+"""
+import logging
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from omicron import cache
+from omicron.core.timeframe import tf
+from omicron.core.types import Frame, FrameType
+
+from omega.core.frames import (
+    frame_index,
+    frame_to_int,
+    frames_of,
+    index_to_frame,
+    int_to_frame,
+)
+from omega.core.suspension import suspension_key
+from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
+
+logger = logging.getLogger(__name__)
+
+
+def encode_job(code: str, start: int, stop: int, n: int) -> str:
+    return f"{code},{start},{stop},{n}"
+
+
+def decode_job(job: str, frame_type: FrameType) -> Tuple[str, Frame, Frame, int]:
+    """将同步队列中的任务解码为(code, start, stop, n)"""
+    code, start, stop, n = job.split(",")
+    return (
+        code,
+        int_to_frame(int(start), frame_type),
+        int_to_frame(int(stop), frame_type),
+        int(n),
+    )
+
+
+def clip_jobs(jobs: List[str], inflight: List[str], frame_type: FrameType) -> List[str]:
+    """从`jobs`中剔除正在同步的区间。
+
+    如果某证券有正在同步的区间，则该证券在`jobs`中的区间，只保留在正在同步的区间之后的部分。
+
+    Args:
+        jobs: 新的同步任务
+        inflight: 已被领取、正在同步的任务
+        frame_type: 帧类型
+
+    Returns:
+        剔除后的同步任务
+    """
+    # code -> 正在同步的区间的最大截止帧
+    busy = {}
+    for job in inflight:
+        code, _, stop, _ = job.split(",")
+        busy[code] = max(busy.get(code, 0), int(stop))
+
+    clipped = []
+    for job in jobs:
+        code, start, stop, _ = job.split(",")
+        start, stop = int(start), int(stop)
+        if code not in busy or busy[code] < start:
+            clipped.append(job)
+            continue
+
+        if stop <= busy[code]:
+            continue
+
+        _, e, b = frame_index([start, stop, busy[code]], frame_type)
+        start = int(index_to_frame(b + 1, frame_type))
+        clipped.append(encode_job(code, start, stop, int(e - b)))
+
+    return clipped
+
+
+def compute_windows(
+    heads: np.ndarray,
+    tails: np.ndarray,
+    start: Union[int, np.ndarray],
+    stop: Union[int, np.ndarray],
+    frame_type: FrameType,
+) -> Tuple[np.ndarray, ...]:
+    """根据缓存中各证券的[head, tail]，计算同步[start, stop]时需要获取的区间。
+
+    规则如下：
+    1. 缓存中没有head或者tail的，需要获取[start, stop]全部数据
+    2. start早于head的，需要获取[start, head - 1]
+    3. stop晚于tail的，需要获取[tail + 1, stop]
+
+    Args:
+        heads: 各证券的head，0表示缓存中没有
+        tails: 各证券的tail，0表示缓存中没有
+        start: 同步起始帧，可以为各证券分别指定
+        stop: 同步截止帧，可以为各证券分别指定
+        frame_type: 帧类型
+
+    Returns:
+        (pos, start, stop, n)，pos为该区间所属证券在`heads`中的位置。同一证券的各区间按
+        起始帧升序排列。
+    """
+    heads = np.asarray(heads, dtype=np.int64)
+    tails = np.asarray(tails, dtype=np.int64)
+    start = np.broadcast_to(np.asarray(start, dtype=np.int64), heads.shape)
+    stop = np.broadcast_to(np.asarray(stop, dtype=np.int64), heads.shape)
+
+    pos = np.arange(len(heads))
+    missing = (heads == 0) | (tails == 0)
+
+    s, e = frame_index(start, frame_type), frame_index(stop, frame_type)
+    h = frame_index(np.where(missing, start, heads), frame_type)
+    t = frame_index(np.where(missing, stop, tails), frame_type)
+
+    head_win = ~missing & (h > s)
+    tail_win = ~missing & (e > t)
+
+    win_pos = np.concatenate([pos[missing], pos[head_win], pos[tail_win]])
+    win_start = np.concatenate([s[missing], s[head_win], t[tail_win] + 1])
+    win_stop = np.concatenate([e[missing], h[head_win] - 1, e[tail_win]])
+
+    order = np.lexsort((win_start, win_pos))
+    order = order[win_stop[order] >= win_start[order]]
+    win_pos, win_start, win_stop = win_pos[order], win_start[order], win_stop[order]
+
+    return (
+        win_pos,
+        index_to_frame(win_start, frame_type),
+        index_to_frame(win_stop, frame_type),
+        win_stop - win_start + 1,
+    )
+
+
+# (code -> 序号, 上市日, 退市日)，证券列表更新后由`reset_listing`清除，下次使用时重建
+_listing: Optional[Tuple[Dict[str, int], np.ndarray, np.ndarray]] = None
+
+
+def reset_listing():
+    """证券列表更新后调用，下次计算上市期间时重新读取证券列表"""
+    global _listing
+    _listing = None
+
+
+async def _listing_days(codes: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """各证券的上市日和退市日（整数表示），不在证券列表中的为0"""
+    global _listing
+
+    if _listing is None:
+        # 证券列表的二进制快照，ipo和end已是整数表示，一次GET即可取得
+        snapshot = await aq.load_security_snapshot()
+        if snapshot is not None and len(snapshot) > 0:
+            index = {code: i for i, code in enumerate(snapshot["code"].tolist())}
+            ipo = snapshot["ipo"].astype(np.int64)
+            end = snapshot["end"].astype(np.int64)
+        else:
+            # 没有快照时，逐行解析证券列表。每行为code,display_name,name,ipo,end,type，
+            # 日期为2020-05-06格式
+            rows = [row.split(",") for row in await cache.get_securities() or []]
+            if len(rows) == 0:
+                zeros = np.zeros(len(codes), dtype=np.int64)
+                return zeros, zeros
+
+            index = {row[0]: i for i, row in enumerate(rows)}
+            ipo = np.array([int(row[3].replace("-", "")) for row in rows], np.int64)
+            end = np.array([int(row[4].replace("-", "")) for row in rows], np.int64)
+
+        _listing = (index, ipo, end)
+
+    index, ipo, end = _listing
+    pos = np.array([index.get(code, -1) for code in codes], dtype=np.int64)
+    known = pos >= 0
+    return np.where(known, ipo[pos], 0), np.where(known, end[pos], 0)
+
+
+async def listing_bounds(
+    codes: List[str], frame_type: FrameType
+) -> Tuple[np.ndarray, np.ndarray]:
+    """各证券上市期间的第一帧和最后一帧（整数表示）。
+
+    不在证券列表中的证券（比如通过`include`指定的）不受限制，其第一帧为0，最后一帧为int64
+    的最大值。
+    """
+    ipo, end = await _listing_days(codes)
+    known = ipo > 0
+
+    days = frames_of(FrameType.DAY)
+    last = len(days) - 1
+    first_day = days[np.clip(np.searchsorted(days, ipo), 0, last)]
+    last_day = days[np.clip(np.searchsorted(days, end, side="right") - 1, 0, last)]
+
+    if frame_type in tf.minute_level_frames:
+        ticks = tf.ticks[frame_type]
+        lo = first_day * 10000 + ticks[0] // 60 * 100 + ticks[0] % 60
+        hi = last_day * 10000 + ticks[-1] // 60 * 100 + ticks[-1] % 60
+    elif frame_type == FrameType.DAY:
+        lo, hi = first_day, last_day
+    else:
+        # 包含上市日和退市日的周（月）
+        frames = frames_of(frame_type)
+        last = len(frames) - 1
+        lo = frames[np.clip(np.searchsorted(frames, first_day), 0, last)]
+        hi = frames[np.clip(np.searchsorted(frames, last_day), 0, last)]
+
+    return (
+        np.where(known, lo, 0).astype(np.int64),
+        np.where(known, hi, np.iinfo(np.int64).max).astype(np.int64),
+    )
+
+
+async def split_suspended(
+    jobs: List[str], frame_type: FrameType
+) -> Tuple[List[str], List[str]]:
+    """将分钟线同步任务分为需要向上游请求的，和整个区间都处于已知停牌日的两部分。
+
+    后者不会有任何成交，可以在本地以nan填充，无须调用上游。日线及以上级别的任务，其停牌与否
+    只有在取得数据后才能知道，因此总是需要向上游请求。
+
+    Returns:
+        (需要向上游请求的任务, 整个区间都处于停牌日的任务)
+    """
+    if frame_type not in tf.minute_level_frames or len(jobs) == 0:
+        return jobs, []
+
+    days = frames_of(FrameType.DAY)
+    spans = []
+    pl = cache.security.pipeline()
+    for job in jobs:
+        code, start, stop, _ = job.split(",")
+        start, stop = int(start) // 10000, int(stop) // 10000
+        pl.zcount(suspension_key(code), start, stop)
+        spans.append(
+            np.searchsorted(days, stop, side="right") - np.searchsorted(days, start)
+        )
+    counts = await pl.execute()
+
+    fetch, suspended = [], []
+    for job, count, span in zip(jobs, counts, spans):
+        if count >= span:
+            suspended.append(job)
+        else:
+            fetch.append(job)
+
+    return fetch, suspended
+
+
+async def plan_bars_sync(
+    codes: List[str], frame_type: FrameType, start: Frame, stop: Frame
+) -> List[str]:
+    """计算`codes`在[start, stop]间需要同步的区间，返回编码后的同步任务。
+
+    所有证券的head/tail通过一个pipeline读出。缓存中只有head或者只有tail的证券，其范围会被
+    清除，随后将全量同步。各证券的区间被限制在其上市期间之内，尚未上市或者已经退市的证券
+    不会产生任务。
+
+    Args:
+        codes: 待同步的证券
+        frame_type: 帧类型
+        start: 同步起始帧
+        stop: 同步截止帧
+
+    Returns:
+        同步任务列表，见[encode_job][omega.jobs.planner.encode_job]。已同步完成的证券不会
+        出现在列表中。
+    """
+    if len(codes) == 0:
+        return []
+
+    pl = cache.security.pipeline()
+    for code in codes:
+        pl.hget(f"{code}:{frame_type.value}", "head")
+        pl.hget(f"{code}:{frame_type.value}", "tail")
+    recs = await pl.execute()
+
+    heads = np.array([int(x or 0) for x in recs[::2]], dtype=np.int64)
+    tails = np.array([int(x or 0) for x in recs[1::2]], dtype=np.int64)
+
+    # 范围不完整的，清除后全量同步
+    broken = np.flatnonzero((heads == 0) ^ (tails == 0))
+    if len(broken):
+        pl = cache.security.pipeline()
+        for i in broken:
+            pl.hdel(f"{codes[i]}:{frame_type.value}", "head", "tail")
+        await pl.execute()
+
+    # 只同步上市期间的数据
+    lo, hi = await listing_bounds(codes, frame_type)
+    pos, starts, stops, counts = compute_windows(
+        heads,
+        tails,
+        np.maximum(frame_to_int(start, frame_type), lo),
+        np.minimum(frame_to_int(stop, frame_type), hi),
+        frame_type,
+    )
+
+    jobs = [
+        encode_job(codes[i], s, e, n)
+        for i, s, e, n in zip(
+            pos.tolist(), starts.tolist(), stops.tolist(), counts.tolist()
+        )
+    ]
+    logger.info(
+        "%s of %s secs need sync in %s, %s windows",
+        len(set(pos.tolist())),
+        len(codes),
+        frame_type.value,
+        len(jobs),
+    )
+    return jobs
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+按证券分片的工作队列。
+
+同步任务按证券代码，通过一致性哈希分配到各个存活的fetcher进程（心跳时登记在`process.fetchers`
+中）名下，每个进程有自己的队列。这样，同一支证券在每次同步时总是落在同一个进程上，进程内的缓存
+得以发挥作用。进程加入或者退出时，下一次触发同步时按新的进程列表重新分片，只有约`1/N`的证券会
+换到别的进程上。
+
+进程处理完自己的分片后，会从积压最多的其它分片的队尾窃取任务，因此某个进程较慢，或者已经退出时，
+其分片上的任务仍然能及时完成。
+"""
+import bisect
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from omicron import cache
+
+from omega.jobs.workqueue import WorkQueue
+
+logger = logging.getLogger(__name__)
+
+# 没有存活的fetcher时，任务放在这个分片中，由各进程窃取
+UNASSIGNED = "unassigned"
+
+# fetcher进程的登记表（sorted set），成员为pid，score为最近一次心跳的时间
+FETCHERS = "process.fetchers"
+
+# 登记表中超过这个时长（秒）没有心跳的进程会被清除
+FETCHERS_EXPIRE = 3600
+
+
+def _hash(key: str) -> int:
+    # 不能使用内置的hash，它在各进程间不一致
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:8], 16)
+
+
+class HashRing:
+    def __init__(self, nodes: List[str], replicas: int = 64):
+        """
+        Args:
+            nodes: 节点（分片）名
+            replicas: 每个节点在环上的虚拟节点数。越多则分布越均匀
+        """
+        if len(nodes) == 0:
+            raise ValueError("at least one node is required")
+
+        self.nodes = sorted(set(nodes))
+        ring = sorted(
+            (_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._keys = [h for h, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    def get(self, key: str) -> str:
+        """返回`key`所属的节点"""
+        i = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._nodes[i]
+
+    def assign(self, items: List[str]) -> Dict[str, List[str]]:
+        """按各任务的键（第一个逗号之前的部分）将任务分配到节点，保持任务的原有顺序"""
+        groups = {node: [] for node in self.nodes}
+        for item in items:
+            groups[self.get(item.split(",")[0])].append(item)
+
+        return groups
+
+
+async def live_fetchers(timeout: int = 10) -> List[str]:
+    """返回心跳在`timeout`秒内的fetcher进程的pid"""
+    now = time.time()
+
+    pl = cache.sys.pipeline()
+    pl.zremrangebyscore(FETCHERS, max=now - max(timeout, FETCHERS_EXPIRE))
+    pl.zrangebyscore(FETCHERS, min=now - timeout)
+    _, pids = await pl.execute()
+
+    return sorted(pids)
+
+
+class ShardedWorkQueue:
+    def __init__(self, name: str, lease: int = 60, shard: str = None):
+        """
+        Args:
+            name: 队列名。各分片的队列为`{name}.{shard}`
+            lease: 租约时长（秒），见[omega.jobs.workqueue.WorkQueue][]
+            shard: 本进程的分片名，默认为本进程的pid
+        """
+        self.name = name
+        self.lease = lease
+        self.shard = shard or str(os.getpid())
+
+        self.key_shards = f"{name}.shards"
+
+        # 领取的任务 -> 所在的分片，确认或者放回任务时使用
+        self._owners: Dict[str, str] = {}
+
+    def _queue(self, shard: str) -> WorkQueue:
+        return WorkQueue(f"{self.name}.{shard}", self.lease)
+
+    async def shards(self) -> List[str]:
+        """返回当前所有的分片名"""
+        return sorted(await cache.sys.smembers(self.key_shards))
+
+    async def reset(self, items: List[str], nodes: List[str]):
+        """清空所有分片，将`items`按一致性哈希重新分配到`nodes`上"""
+        groups = HashRing(nodes or [UNASSIGNED]).assign(items)
+
+        pl = cache.sys.pipeline()
+        for shard in await self.shards():
+            queue = self._queue(shard)
+            pl.delete(queue.name, queue.key_leases)
+        pl.delete(self.key_shards)
+        pl.sadd(self.key_shards, *groups.keys())
+        for shard, jobs in groups.items():
+            if len(jobs):
+                pl.rpush(self._queue(shard).name, *jobs)
+        await pl.execute()
+
+    async def merge(self, items: List[str], nodes: List[str]) -> Optional[int]:
+        """如果仍有worker在工作，将`items`按一致性哈希合并到`nodes`的分片上。
+
+        各分片上的合并规则见[omega.jobs.workqueue.WorkQueue.merge][]。分配到新加入的进程上
+        的任务，由该进程，或者窃取任务的其它进程完成。
+
+        Returns:
+            被替代的待处理任务数。如果没有worker在工作，不做任何修改并返回None
+        """
+        if len(await self.leased()) == 0:
+            return None
+
+        groups = HashRing(nodes or [UNASSIGNED]).assign(items)
+        await cache.sys.sadd(self.key_shards, *groups.keys())
+
+        replaced = 0
+        for shard, jobs in groups.items():
+            if len(jobs):
+                replaced += await self._queue(shard).merge(jobs, force=True)
+
+        return replaced
+
+    async def put(self, items: List[str], nodes: List[str]):
+        """将`items`按一致性哈希追加到`nodes`的分片上，不影响已有的任务"""
+        groups = HashRing(nodes or [UNASSIGNED]).assign(items)
+
+        pl = cache.sys.pipeline()
+        pl.sadd(self.key_shards, *groups.keys())
+        for shard, jobs in groups.items():
+            if len(jobs):
+                pl.rpush(self._queue(shard).name, *jobs)
+        await pl.execute()
+
+    async def requeue(self, *items: str):
+        """将已领取的任务放回其所在分片的队尾，并确认原任务。
+
+        用于需要分多次完成的任务：每次完成一部分后放回队列，与其它任务轮流执行。先放回、后确
+        认，因此进程在两者之间崩溃时，任务可能重复，但不会丢失。
+        """
+        groups = self._group(items)
+        for shard, claimed in groups.items():
+            queue = self._queue(shard)
+            await queue.put(*claimed)
+            await queue.ack(*claimed)
+
+    async def leased(self) -> List[str]:
+        """返回各分片中已领取、尚未确认且租约未过期的任务"""
+        leased = []
+        for shard in await self.shards():
+            leased.extend(await self._queue(shard).leased())
+
+        return leased
+
+    async def items(self) -> List[str]:
+        """返回各分片中所有尚未完成的任务，包括待处理的，和已领取的（不论租约是否过期）"""
+        shards = await self.shards()
+        if len(shards) == 0:
+            return []
+
+        pl = cache.sys.pipeline()
+        for shard in shards:
+            queue = self._queue(shard)
+            pl.lrange(queue.name, 0, -1)
+            pl.zrange(queue.key_leases, 0, -1)
+        recs = await pl.execute()
+
+        return [item for rec in recs for item in rec]
+
+    async def claim(self, n: int = 1) -> List[str]:
+        """领取至多`n`个任务。
+
+        先从本进程的分片中领取；本分片为空时，从积压（包括租约已过期的任务）最多的其它分片的
+        队尾窃取。
+        """
+        claimed = await self._queue(self.shard).claim(n)
+        if claimed:
+            return self._own(self.shard, claimed)
+
+        others = [shard for shard in await self.shards() if shard != self.shard]
+        if len(others) == 0:
+            return []
+
+        now = time.time()
+        pl = cache.sys.pipeline()
+        for shard in others:
+            queue = self._queue(shard)
+            pl.llen(queue.name)
+            pl.zcount(queue.key_leases, float("-inf"), now)
+        recs = await pl.execute()
+
+        backlogs = [p + expired for p, expired in zip(recs[::2], recs[1::2])]
+        backlog, victim = max(zip(backlogs, others))
+        if backlog == 0:
+            return []
+
+        claimed = await self._queue(victim).claim(n, from_tail=True)
+        if claimed:
+            logger.debug("%s stole %s jobs from %s", self.shard, len(claimed), victim)
+
+        return self._own(victim, claimed)
+
+    def _own(self, shard: str, items: List[str]) -> List[str]:
+        for item in items:
+            self._owners[item] = shard
+
+        return items
+
+    def _group(self, items: Tuple[str]) -> Dict[str, List[str]]:
+        groups = {}
+        for item in items:
+            shard = self._owners.pop(item, self.shard)
+            groups.setdefault(shard, []).append(item)
+
+        return groups
+
+    async def ack(self, *items: str) -> int:
+        """确认任务已完成，返回实际被确认的任务数"""
+        acked = 0
+        for shard, claimed in self._group(items).items():
+            acked += await self._queue(shard).ack(*claimed)
+
+        return acked
+
+    async def release(self, *items: str):
+        """放弃已领取的任务，将其放回原分片的队首"""
+        for shard, claimed in self._group(items).items():
+            await self._queue(shard).release(*claimed)
+
+    async def size(self) -> Tuple[int, int]:
+        """返回所有分片中待处理和已领取（未确认）的任务数"""
+        shards = await self.shards()
+        if len(shards) == 0:
+            return 0, 0
+
+        tr = cache.sys.multi_exec()
+        for shard in shards:
+            queue = self._queue(shard)
+            tr.llen(queue.name)
+            tr.zcard(queue.key_leases)
+        recs = await tr.execute()
+
+        return sum(recs[::2]), sum(recs[1::2])
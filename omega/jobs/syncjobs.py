@@ -5,52 +5,125 @@ import asyncio
 import datetime
 import logging
 import os
-from typing import List, Optional, Tuple, Union
+import time
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import aiohttp
 import arrow
 import cfg4py
+import numpy as np
 from dateutil import tz
 from omicron import cache
 from omicron.core.errors import FetcherQuotaError
 from omicron.core.timeframe import tf
-from omicron.core.types import Frame, FrameType
+from omicron.core.types import Frame, FrameType, bars_dtype
 from omicron.models.securities import Securities
 from pyemit import emit
 
+from omega.core import metrics, resample, sanity
 from omega.core.events import Events
+from omega.core.frames import (
+    derived_frames,
+    frame_to_int,
+    int_to_frame,
+    last_closed_frame,
+    resample_targets,
+)
+from omega.core.suspension import save_suspensions
 from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
+from omega.jobs.planner import (
+    clip_jobs,
+    decode_job,
+    encode_job,
+    plan_bars_sync,
+    reset_listing,
+    split_suspended,
+)
+from omega.jobs.sharding import ShardedWorkQueue, live_fetchers
 
 logger = logging.getLogger(__name__)
 cfg = cfg4py.get_instance()
 
-
-
-async def _start_job_timer(job_name: str):
-    key_start = f"jobs.bars_{job_name}.start"
-
-    pl = cache.sys.pipeline()
-    pl.delete(f"jobs.bars_{job_name}.*")
-
-    pl.set(key_start, arrow.now(tz=cfg.tz).format("YYYY-MM-DD HH:mm:ss"))
-    await pl.execute()
-
-
-async def _stop_job_timer(job_name: str) -> int:
-    key_start = f"jobs.bars_{job_name}.start"
-    key_stop = f"jobs.bars_{job_name}.stop"
-    key_elapsed = f"jobs.bars_{job_name}.elapsed"
-
-    start = arrow.get(await cache.sys.get(key_start), tzinfo=cfg.tz)
-    stop = arrow.now(tz=cfg.tz)
-    elapsed = (stop - start).seconds
-
-    pl = cache.sys.pipeline()
-    pl.set(key_stop, stop.format("YYYY-MM-DD HH:mm:ss"))
-    pl.set(key_elapsed, elapsed)
-    await pl.execute()
-
-    return elapsed
+# 逐支同步时，每次从队列中领取的任务数
+_CLAIM_SIZE = 10
+
+# 重置tail时，每次redis调用处理的证券数
+_RESET_TAIL_CHUNK = 1000
+
+# 收盘核对时，每次向上游请求的证券个数
+_RECONCILE_BATCH = 100
+
+# 同步完成后合成k线时，并发处理的证券数
+_RESAMPLE_CONCURRENCY = 50
+
+
+# KEYS[1]: 同步批次
+# ARGV[1]: 新的截止帧, ARGV[2]: 并入的任务数
+# 批次已结束时不做任何修改，返回nil；否则返回批次id
+_merge_run_script = """
+if redis.call('HEXISTS', KEYS[1], 'id') == 0 then
+    return false
+end
+if redis.call('HEXISTS', KEYS[1], 'finished') == 1 then
+    return false
+end
+redis.call('HSET', KEYS[1], 'stop', ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'triggers', 1)
+redis.call('HINCRBY', KEYS[1], 'enqueued', ARGV[2])
+return redis.call('HGET', KEYS[1], 'id')
+"""
+
+# KEYS[1]: 同步批次
+# ARGV[1]: 新入队的任务数, ARGV[2]: 新完成的任务数, ARGV[3]: 当前时间
+# 完成的任务数追上入队的任务数时结束批次，返回耗时（秒）。只有一个调用者能结束批次，其它调用
+# 者，以及批次尚未完成时，得到-1
+_advance_run_script = """
+if redis.call('HEXISTS', KEYS[1], 'id') == 0 then
+    return '-1'
+end
+if redis.call('HEXISTS', KEYS[1], 'finished') == 1 then
+    return '-1'
+end
+local enqueued = redis.call('HINCRBY', KEYS[1], 'enqueued', ARGV[1])
+local done = redis.call('HINCRBY', KEYS[1], 'done', ARGV[2])
+if done < enqueued then
+    return '-1'
+end
+redis.call('HSET', KEYS[1], 'finished', ARGV[3])
+local elapsed = tonumber(ARGV[3]) - tonumber(redis.call('HGET', KEYS[1], 'started'))
+redis.call('HSET', KEYS[1], 'elapsed', tostring(elapsed))
+return tostring(elapsed)
+"""
+
+# KEYS[1]: 同步进度
+# ARGV: code1, frame1, code2, frame2, ...
+# 各证券的同步进度只前进，不后退
+_checkpoint_script = """
+for i = 1, #ARGV, 2 do
+    local cur = redis.call('HGET', KEYS[1], ARGV[i])
+    if not cur or tonumber(cur) < tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+return #ARGV / 2
+"""
+
+# KEYS: 各证券某一帧类型的k线缓存
+# ARGV[1]: 新的tail
+# 只有缓存中的tail晚于新的tail时才重置，返回实际被重置的证券数
+_reset_tail_script = """
+local moved = 0
+for _, key in ipairs(KEYS) do
+    local tail = redis.call('HGET', key, 'tail')
+    if tail and tonumber(tail) > tonumber(ARGV[1]) then
+        redis.call('HSET', key, 'tail', ARGV[1])
+        moved = moved + 1
+    end
+end
+return moved
+"""
 
 
 def load_sync_params(frame_type: FrameType) -> dict:
@@ -89,6 +162,9 @@ async def trigger_bars_sync(sync_params: dict = None, force=False):
                 delay: 延迟启动时间，以秒为单位
                 cat: 证券分类，如stock, index等
                 delay: seconds for sync to wait.
+                batch: 批量同步模式下，每次向上游请求的证券个数。0表示逐支同步
+                concurrency: 每个fetcher进程中并发执行的同步任务数，默认为1
+                resample: 同步完成后，由本帧k线在本地合成的其它帧类型，比如['5m', '30m']
             }
             ```
             see more @[omega.jobs.syncjobs.parse_sync_params][]
@@ -109,21 +185,377 @@ async def trigger_bars_sync(sync_params: dict = None, force=False):
     fmt_str = "sync from %s to %s in frame_type(%s) for %s secs"
     logger.info(fmt_str, start, stop, frame_type, len(codes))
 
-    # secs are stored into cache, so each fetcher can polling it
+    # 只有存在缺失区间的证券才需要同步
+    jobs = await _plan_jobs(codes, frame_type, start, stop)
+    if len(jobs) == 0:
+        logger.info("all %s secs are up to date in %s", len(codes), frame_type)
+        return
+
+    # 按证券分片到存活的fetcher进程上。每次触发都按当前的进程列表重新分片
+    queue = ShardedWorkQueue(key_scope)
+    fetchers = await live_fetchers()
+
+    # 上一批次仍在同步中，则并入该批次，由正在工作的worker一并完成
+    inflight = await queue.leased()
+    if len(inflight):
+        jobs = clip_jobs(jobs, inflight, frame_type)
+        # 先在批次中为并入的任务记账，以免worker在任务并入之前就认为批次已经完成
+        run = await _merge_run(frame_type, stop, len(jobs))
+        if run is not None:
+            await _save_windows(frame_type, jobs, merge=True)
+            replaced = await queue.merge(jobs, fetchers) if len(jobs) else 0
+            if replaced is not None:
+                # 被替代的待处理任务不会再被确认
+                await _advance_run(frame_type, enqueued=-replaced)
+                metrics.inc(
+                    "omega_sync_runs_total", frame=frame_type.value, action="merge"
+                )
+                fmt_str = "merge %s jobs into running sync %s(%s)"
+                logger.info(fmt_str, len(jobs), run, frame_type)
+                return
+
+        if len(jobs) == 0:
+            return
+
+    await asyncio.sleep(delay)
+
+    # jobs are stored into cache, so each fetcher can polling it
+    await _save_windows(frame_type, jobs)
+    await queue.reset(jobs, fetchers)
+    run = await _start_run(frame_type, start, stop, len(jobs))
+    metrics.inc("omega_sync_runs_total", frame=frame_type.value, action="start")
+
+    batch = int(sync_params.get("batch") or 0)
+    concurrency = int(sync_params.get("concurrency") or 1)
+    await emit.emit(
+        Events.OMEGA_DO_SYNC,
+        {
+            "frame_type": frame_type,
+            "start": start,
+            "stop": stop,
+            "batch": batch,
+            "concurrency": concurrency,
+            "resample": _job_resample_targets(sync_params),
+            "run": run,
+        },
+    )
+
+    fmt_str = "send trigger sync event to fetchers: from %s to %s in frame_type(%s) for %s jobs"
+    logger.info(fmt_str, start, stop, frame_type, len(jobs))
+
+
+async def _plan_jobs(
+    codes: List[str], frame_type: FrameType, start: Frame, stop: Frame
+) -> List[str]:
+    """计算同步任务，见[omega.jobs.planner.plan_bars_sync][]。
+
+    整个区间都处于已知停牌日的分钟线任务，直接在本地以nan填充，不再进入同步队列。没有需要
+    向上游请求的区间的证券（已经同步完成、不在上市期间，或者只有停牌区间），其同步进度直接
+    前进到`stop`，见[omega.jobs.syncjobs.advance_checkpoints][]。
+    """
+    jobs = await plan_bars_sync(codes, frame_type, start, stop)
+    jobs, suspended = await split_suspended(jobs, frame_type)
+    if len(suspended):
+        saved = await save_suspended_bars(suspended, frame_type)
+        fmt_str = "%s jobs(%s) are in suspension, %s bars are synthesized locally"
+        logger.info(fmt_str, len(suspended), frame_type, saved)
+
+    pending = {job.split(",")[0] for job in jobs}
+    await advance_checkpoints(
+        [code for code in codes if code not in pending], frame_type, stop
+    )
+
+    return jobs
+
+
+async def save_suspended_bars(jobs: List[str], frame_type: FrameType) -> int:
+    """以nan填充`jobs`的整个区间并存入缓存，不调用上游
+
+    Returns:
+        存入缓存的k线条数
+    """
+    fetched = {}
+    for job in jobs:
+        code, _, stop, n = decode_job(job, frame_type)
+        empty = np.array([], dtype=bars_dtype)
+        fetched.setdefault(code, []).append(aq._fill_na(empty, n, stop, frame_type))
+
+    ranges = await aq._get_bars_ranges(list(fetched), frame_type)
+    saved = await aq._save_bars_batch(fetched, ranges, frame_type)
+    metrics.inc("omega_sync_synthesized_total", saved, frame=frame_type.value)
+    return saved
+
+
+def _run_key(frame_type: FrameType) -> str:
+    return f"jobs.bars_sync.run.{frame_type.value}"
+
+
+async def _start_run(
+    frame_type: FrameType, start: Frame, stop: Frame, enqueued: int
+) -> str:
+    """开始`frame_type`的一个新的同步批次，返回批次id
+
+    批次中记录了入队的任务数(enqueued)和已完成的任务数(done)。各fetcher进程确认任务时累加
+    done，done追上enqueued时批次即完成，见[omega.jobs.syncjobs._advance_run][]。
+
+    最近一次同步的开始时间同时记录在`jobs.bars_sync.start`中，批次结束时记录结束时间
+    `jobs.bars_sync.stop`和耗时`jobs.bars_sync.elapsed`。
+    """
+    run = uuid.uuid4().hex[:12]
+
+    key = _run_key(frame_type)
     pl = cache.sys.pipeline()
-    pl.delete(key_scope)
-    pl.lpush(key_scope, *codes)
+    pl.delete(key, "jobs.bars_sync.stop", "jobs.bars_sync.elapsed")
+    pl.set("jobs.bars_sync.start", arrow.now(tz=cfg.tz).format("YYYY-MM-DD HH:mm:ss"))
+    pl.hmset_dict(
+        key,
+        {
+            "id": run,
+            "start": str(start),
+            "stop": str(stop),
+            "triggers": 1,
+            "enqueued": enqueued,
+            "done": 0,
+            "started": time.time(),
+        },
+    )
     await pl.execute()
 
-    await asyncio.sleep(delay)
-    await _start_job_timer("sync")
+    return run
+
+
+def _windows_key(frame_type: FrameType) -> str:
+    return f"jobs.bars_sync.windows.{frame_type.value}"
+
+
+async def _save_windows(frame_type: FrameType, jobs: List[str], merge: bool = False):
+    """记录批次中各证券同步区间的起始帧，供批次完成后的步骤只处理实际同步过的k线。
+
+    新批次开始时重新记录；并入批次的任务只会将证券的起始帧提前，不会推后。
+    """
+    starts = {}
+    for job in jobs:
+        code, start, *_ = job.split(",")
+        starts[code] = min(int(start), starts.get(code, int(start)))
+
+    key = _windows_key(frame_type)
+    if merge and len(starts):
+        recorded = await cache.sys.hmget(key, *starts.keys())
+        starts = {
+            code: start
+            for (code, start), old in zip(starts.items(), recorded)
+            if old is None or start < int(old)
+        }
+
+    pl = cache.sys.pipeline()
+    if not merge:
+        pl.delete(key)
+    if len(starts):
+        pl.hmset_dict(key, starts)
+    await pl.execute()
+
+
+async def get_run_windows(frame_type: FrameType) -> Dict[str, int]:
+    """返回最近一个批次中各证券同步区间的起始帧"""
+    windows = await cache.sys.hgetall(_windows_key(frame_type))
+    return {code: int(start) for code, start in (windows or {}).items()}
+
+
+async def _merge_run(
+    frame_type: FrameType, stop: Frame, enqueued: int
+) -> Optional[str]:
+    """新的触发并入正在进行的同步批次，将批次的截止帧延长到`stop`，并累加入队的任务数
+
+    Returns:
+        批次id。如果批次已经结束，不做任何修改并返回None
+    """
+    return await cache.sys.eval(
+        _merge_run_script, keys=[_run_key(frame_type)], args=[str(stop), enqueued]
+    )
+
+
+async def _advance_run(
+    frame_type: FrameType, enqueued: int = 0, done: int = 0
+) -> Optional[float]:
+    """累加同步批次中入队和已完成的任务数，如果批次因此完成，则结束批次。
+
+    这是各fetcher进程共享的完成屏障：任务只有在被确认时才计入done，且每个任务只会被确认一次
+    （见[omega.jobs.workqueue.WorkQueue.ack][]），因此无论有多少个进程参与同步，批次都只会在
+    最后一个任务完成时结束一次。批次的耗时从它开始时算起，到最后一个任务完成时为止，期间并入
+    的触发不会重新计时。
+
+    批次结束时，发出`Events.OMEGA_SYNC_DONE`事件，由omega.jobs执行后续步骤，见
+    [omega.jobs.syncjobs.on_bars_sync_done][]。
+
+    Returns:
+        批次耗时（秒）。如果批次尚未完成，或者已被其它进程结束，返回None
+    """
+    key = _run_key(frame_type)
+    elapsed = float(
+        await cache.sys.eval(
+            _advance_run_script, keys=[key], args=[enqueued, done, time.time()]
+        )
+    )
+    if elapsed < 0:
+        return None
 
+    metrics.observe(
+        "omega_sync_run_seconds",
+        elapsed,
+        metrics.LAG_BUCKETS,
+        frame=frame_type.value,
+    )
+    pl = cache.sys.pipeline()
+    pl.set("jobs.bars_sync.stop", arrow.now(tz=cfg.tz).format("YYYY-MM-DD HH:mm:ss"))
+    pl.set("jobs.bars_sync.elapsed", int(elapsed))
+    await pl.execute()
+
+    run = await cache.sys.hgetall(key)
     await emit.emit(
-        Events.OMEGA_DO_SYNC, {"frame_type": frame_type, "start": start, "stop": stop}
+        Events.OMEGA_SYNC_DONE,
+        {
+            "frame_type": frame_type,
+            "run": run["id"],
+            "start": _parse_frame(run["start"], frame_type),
+            "stop": _parse_frame(run["stop"], frame_type),
+            "enqueued": int(run["enqueued"]),
+            "elapsed": elapsed,
+        },
     )
 
-    fmt_str = "send trigger sync event to fetchers: from %s to %s in frame_type(%s) for %s secs"
-    logger.info(fmt_str, start, stop, frame_type, len(codes))
+    fmt_str = "sync %s(%s) finished: %s jobs in %s seconds"
+    logger.info(fmt_str, run["id"], frame_type, run["enqueued"], elapsed)
+    return elapsed
+
+
+def _parse_frame(frame: str, frame_type: FrameType) -> Frame:
+    if frame_type in tf.minute_level_frames:
+        return arrow.get(frame, tzinfo=cfg.tz).datetime
+    else:
+        return arrow.get(frame).date()
+
+
+def _checkpoint_key(frame_type: FrameType) -> str:
+    return f"jobs.bars_sync.checkpoint.{frame_type.value}"
+
+
+async def save_checkpoints(frame_type: FrameType, jobs: List[str]):
+    """记录`jobs`所属证券的同步进度，即已同步完成的最后一个已结束的帧。
+
+    进度保存在redis中，只会前进，不会后退（比如向前补齐历史数据的任务完成时）。
+    """
+    if len(jobs) == 0:
+        return
+
+    if frame_type in tf.minute_level_frames:
+        convert = tf.time2int
+    else:
+        convert = tf.date2int
+
+    args = []
+    for job in jobs:
+        code, _, stop, _ = decode_job(job, frame_type)
+        args.extend([code, convert(last_closed_frame(stop, frame_type))])
+
+    key = _checkpoint_key(frame_type)
+    await cache.sys.eval(_checkpoint_script, keys=[key], args=args)
+
+
+async def advance_checkpoints(codes: List[str], frame_type: FrameType, stop: Frame):
+    """将`codes`的同步进度前进到`stop`所在的最后一个已结束的帧。
+
+    用于在`stop`之前已经没有需要同步的区间的证券，否则它们的进度永远不会被记录，
+    `resume_bars_sync`每次都会为它们触发补齐。
+    """
+    if len(codes) == 0:
+        return
+
+    frame = frame_to_int(last_closed_frame(stop, frame_type), frame_type)
+    args = []
+    for code in codes:
+        args.extend([code, frame])
+
+    key = _checkpoint_key(frame_type)
+    await cache.sys.eval(_checkpoint_script, keys=[key], args=args)
+
+
+async def get_checkpoints(
+    codes: List[str], frame_type: FrameType
+) -> Dict[str, Optional[int]]:
+    """返回各证券的同步进度（与缓存中的head/tail一样，以整数表示的帧），从未同步完成过的
+    为None
+    """
+    if len(codes) == 0:
+        return {}
+
+    recs = await cache.sys.hmget(_checkpoint_key(frame_type), *codes)
+    return {code: None if rec is None else int(rec) for code, rec in zip(codes, recs)}
+
+
+async def resume_bars_sync(sync_params: dict) -> Optional[str]:
+    """omega.jobs启动时，恢复或者补齐`sync_params`所指定帧类型的同步。
+
+    1. 上一批次还有未完成的任务：这些任务保存在redis中，不会因进程重启而丢失，只需通知各
+       fetcher进程继续领取。租约过期的任务会被重新领取，已完成的任务不会重复执行。
+    2. 否则，如果有证券的同步进度落后于最近一个已结束的帧，则触发一次同步。同步的区间由
+       planner按缓存中的实际缺口计算，而不是固定地补齐最近24小时。
+
+    Returns:
+        "resume"或者"catch-up"。无需同步时返回None
+    """
+    codes, frame_type, start, stop, _ = parse_sync_params(**sync_params)
+    if frame_type in derived_frames():
+        return None
+
+    queue = ShardedWorkQueue(f"jobs.bars_sync.scope.{frame_type.value}")
+    pending, leased = await queue.size()
+    run = await cache.sys.hgetall(_run_key(frame_type))
+    if (pending or leased) and run.get("id") and not run.get("finished"):
+        await emit.emit(
+            Events.OMEGA_DO_SYNC,
+            {
+                "frame_type": frame_type,
+                "start": start,
+                "stop": stop,
+                "batch": int(sync_params.get("batch") or 0),
+                "concurrency": int(sync_params.get("concurrency") or 1),
+                "resample": _job_resample_targets(sync_params),
+                "run": run["id"],
+            },
+        )
+        fmt_str = "resume sync %s(%s): %s pending, %s leased"
+        logger.info(fmt_str, run["id"], frame_type, pending, leased)
+        return "resume"
+
+    last_closed = last_closed_frame(stop, frame_type)
+    if frame_type in tf.minute_level_frames:
+        last_closed = tf.time2int(last_closed)
+    else:
+        last_closed = tf.date2int(last_closed)
+
+    checkpoints = await get_checkpoints(codes, frame_type)
+    behind = [code for code, cp in checkpoints.items() if (cp or 0) < last_closed]
+    if len(behind) == 0:
+        fmt_str = "all %s secs(%s) are synced to %s"
+        logger.info(fmt_str, len(codes), frame_type, last_closed)
+        return None
+
+    fmt_str = "%s of %s secs(%s) are behind %s, start catch-up sync"
+    logger.info(fmt_str, len(behind), len(codes), frame_type, last_closed)
+    await trigger_bars_sync(sync_params, force=True)
+    return "catch-up"
+
+
+def _job_resample_targets(sync_params: dict) -> List[FrameType]:
+    """由worker在每个同步任务完成后立即合成的帧类型。
+
+    如果同步参数的`then`中包含了`resample`，合成将在整个批次完成后统一进行，worker无须再
+    逐个任务合成。
+    """
+    if "resample" in (sync_params.get("then") or []):
+        return []
+
+    return resample_targets(sync_params)
 
 
 def parse_sync_params(
@@ -134,6 +566,7 @@ def parse_sync_params(
     delay: int = 0,
     include: str = "",
     exclude: str = "",
+    **kwargs,
 ) -> Tuple:
     """按照[使用手册](usage.md#22-如何同步K线数据)中的规则，解析和补全同步参数。
 
@@ -151,6 +584,7 @@ def parse_sync_params(
             space, for example, "000001.XSHE 000004.XSHE". Defaults to empty string.
         exclude (str, optional):  which securities should be excluded, seperated by
             a space. Defaults to empty string.
+        kwargs: 其它同步选项（比如`batch`），不影响同步范围的解析，由调用者自行处理
 
     Returns:
         - codes (List[str]): 待同步证券列表
@@ -192,16 +626,54 @@ def parse_sync_params(
             stop, -1000, frame_type
         )
 
-    secs = Securities()
-    codes = secs.choose(cat or [])
+    codes = choose_codes(cat, include, exclude)
 
-    exclude = map(lambda x: x, exclude.split(" "))
-    codes = list(set(codes) - set(exclude))
+    return codes, frame_type, start, stop, int(delay)
 
-    include = list(filter(lambda x: x, include.split(" ")))
-    codes.extend(include)
 
-    return codes, frame_type, start, stop, int(delay)
+# (cat, include, exclude) -> 待同步的证券列表，仅在当日有效
+_chosen: Dict[Tuple, Tuple[str, ...]] = {}
+_chosen_date: Optional[datetime.date] = None
+
+
+def choose_codes(
+    cat: List[str] = None, include: str = "", exclude: str = ""
+) -> List[str]:
+    """按同步参数中的`cat`、`include`和`exclude`，返回待同步的证券列表。
+
+    每分钟的同步触发都会解析同步参数，而在证券列表更新之前，同一组参数的结果总是相同的，因此
+    结果按参数缓存在本进程中。同步参数改变时，自然会使用新的缓存项；证券列表更新时（见
+    [omega.jobs.syncjobs.on_security_list_updated][]），缓存被清空。由于已退市的证券不在结
+    果之中，缓存也在日期改变时清空。
+    """
+    global _chosen_date
+
+    today = arrow.now(tz=cfg.tz).date()
+    if today != _chosen_date:
+        _chosen.clear()
+        _chosen_date = today
+
+    key = (tuple(cat or []), include, exclude)
+    codes = _chosen.get(key)
+    if codes is None:
+        codes = Securities().choose(list(cat or []))
+
+        codes = list(set(codes) - set(exclude.split(" ")))
+        codes.extend(filter(lambda x: x, include.split(" ")))
+
+        codes = _chosen[key] = tuple(codes)
+
+    return list(codes)
+
+
+async def on_security_list_updated(msg=None):
+    """handle Events.SECURITY_LIST_UPDATED，重新加载证券列表，并清空待同步证券列表和各证券
+    上市期间的缓存
+    """
+    await Securities().load()
+    _chosen.clear()
+    reset_listing()
+    logger.info("security list reloaded: %s", Securities())
 
 
 async def sync_bars(params: dict):
@@ -215,6 +687,10 @@ async def sync_bars(params: dict):
                 frame_type (FrameType):k线的帧类型
                 start (Frame): k线起始时间
                 stop (Frame): k线结束时间
+                batch (int): 大于0时，每次取出batch支证券，通过`get_bars_batch`批量同步
+                concurrency (int): 本进程内并发执行的同步任务数，默认为1
+                resample (List[FrameType]): 每个同步任务完成后，由本帧k线合成的帧类型
+                run (str): 同步批次id，仅用于轮询模式下的日志
             }
             ```
     Returns:
@@ -226,6 +702,16 @@ async def sync_bars(params: dict):
         params.get("start"),
         params.get("stop"),
     )
+    batch = params.get("batch") or 0
+    concurrency = params.get("concurrency") or 1
+    targets = params.get("resample") or []
+    run = params.get("run")
+
+    if start is None or frame_type is None:
+        raise ValueError("you must specify a start date/frame_type for sync")
+
+    if stop is None:
+        stop = tf.floor(arrow.now(tz=cfg.tz), frame_type)
 
     if secs is not None:
         logger.info(
@@ -235,118 +721,411 @@ async def sync_bars(params: dict):
             stop,
             len(secs),
         )
+        jobs = await _plan_jobs(secs, frame_type, start, stop)
+
+        async def get_jobs(n: int):
+            claimed = jobs[:n]
+            del jobs[:n]
+            return claimed
+
+        async def ack(*claimed):
+            return len(claimed)
 
-        async def get_sec():
-            return secs.pop() if len(secs) else None
+        async def release(*claimed):
+            jobs[:0] = claimed
 
     else:
         logger.info(
             "sync bars with %s(%s ~ %s) in polling mode", frame_type, start, stop
         )
+        queue = ShardedWorkQueue(f"jobs.bars_sync.scope.{frame_type.value}")
+
+        async def get_jobs(n: int):
+            while True:
+                claimed = await queue.claim(n)
+                if claimed:
+                    return claimed
+
+                # 所有分片都已空，但其它worker领取的任务仍未完成。如果该worker崩溃，其租约到期
+                # 后，这些任务会被重新领取；新的触发也可能在此期间并入了新的任务
+                pending, leased = await queue.size()
+                if pending == 0 and leased == 0:
+                    return []
+                if pending == 0:
+                    await asyncio.sleep(1)
+                else:
+                    # 仍有待领取的任务，但本次没有领到（比如与其它worker争抢同一分片），稍后再试，
+                    # 以免空转
+                    await asyncio.sleep(0.1)
+
+        async def ack(*claimed):
+            # 每个任务只会被确认一次，据此推进批次的完成屏障
+            acked = await queue.ack(*claimed)
+            if acked:
+                await _advance_run(frame_type, done=acked)
+            return acked
+
+        release = queue.release
+
+    # 任一任务遇到配额错误时置位，其它任务完成手头的证券后即退出
+    quota_exceeded = asyncio.Event()
+
+    async def worker():
+        while not quota_exceeded.is_set():
+            claimed = await get_jobs(batch if batch > 0 else _CLAIM_SIZE)
+            if not claimed:
+                return
+
+            done, synced = await _sync_claimed(
+                claimed, frame_type, batch, targets, quota_exceeded
+            )
+            await save_checkpoints(frame_type, synced)
+            await ack(*done)
+            # 因配额不足而未能完成的任务放回队列，不会丢失
+            await release(*[job for job in claimed if job not in done])
 
-        async def get_sec():
-            return await cache.sys.lpop(key_scope)
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    if quota_exceeded.is_set():
+        return  # stop the sync
 
-    key_scope = f"jobs.bars_sync.scope.{frame_type.value}"
+    # 批次是否已经完成由最后一个确认的任务决定，与本进程何时退出无关
+    logger.info("%s finished quotes sync %s", os.getpid(), run or "")
 
-    if start is None or frame_type is None:
-        raise ValueError("you must specify a start date/frame_type for sync")
 
-    if stop is None:
-        stop = tf.floor(arrow.now(tz=cfg.tz), frame_type)
+async def _sync_claimed(
+    claimed: List[str],
+    frame_type: FrameType,
+    batch: int,
+    targets: List[FrameType],
+    quota_exceeded: asyncio.Event,
+) -> Tuple[List[str], List[str]]:
+    """完成领取的一组任务，并由成功同步的任务合成`targets`中的帧类型。
 
-    while code := await get_sec():
-        try:
-            await sync_bars_for_security(code, frame_type, start, stop)
-        except FetcherQuotaError as e:
-            logger.warning("Quota exceeded when syncing %s. Sync aborted.", code)
-            logger.exception(e)
-            return  # stop the sync
-        except Exception as e:
-            logger.warning("Failed to sync %s", code)
-            logger.exception(e)
+    遇到配额错误时置位`quota_exceeded`，尚未处理的任务不在返回的done中，由调用者放回队列。
+
+    Returns:
+        (done, synced)。done: 已处理（包括出错）的任务；synced: 成功同步、可以推进
+        checkpoint的任务
+    """
+    done, synced = [], []
+    try:
+        if batch > 0:
+            await sync_bars_batch(claimed, frame_type)
+            done = synced = claimed
+            for job in claimed:
+                await _resample_job(job, frame_type, targets)
+        else:
+            for job in claimed:
+                if quota_exceeded.is_set():
+                    break
+                if await _sync_job(job, frame_type):
+                    synced.append(job)
+                    await _resample_job(job, frame_type, targets)
+                done.append(job)
+    except FetcherQuotaError as e:
+        logger.warning("Quota exceeded when syncing %s. Sync aborted.", claimed)
+        logger.exception(e)
+        quota_exceeded.set()
+    except Exception as e:
+        logger.warning("Failed to sync %s", claimed)
+        logger.exception(e)
+        done = claimed
+
+    return done, synced
+
+
+async def _sync_job(job: str, frame_type: FrameType) -> bool:
+    """逐支同步一个任务，返回是否成功。配额错误会被抛出，以便中止同步"""
+    code, w_start, w_stop, n = decode_job(job, frame_type)
+    try:
+        await sync_bars_for_window(code, frame_type, w_start, w_stop, n)
+        return True
+    except FetcherQuotaError:
+        raise
+    except Exception as e:
+        logger.warning("Failed to sync %s", job)
+        logger.exception(e)
+        return False
+
+
+async def sync_bars_batch(jobs: List[str], frame_type: FrameType) -> int:
+    """批量完成同步任务。
+
+    缺失区间相同（即截止帧和帧数都相同）的任务归为一组，每组只需要调用一次
+    `get_bars_batch`。盘中同步时，各证券缺失的通常都是最近的同一段数据，因此绝大多数情况下，
+    一批任务只需要一次上游调用。最后，所有取得的数据通过分块的pipeline存入缓存。
+
+    Args:
+        jobs: 同步任务，见[omega.jobs.planner.encode_job][]
+        frame_type: k线的帧类型
+
+    Returns:
+        本次同步取得的k线条数
+    """
+    # (end, n) -> codes，缺失区间相同的任务归入同一组
+    groups = defaultdict(list)
+    for job in jobs:
+        code, _, stop, n = decode_job(job, frame_type)
+        groups[(stop, n)].append(code)
+
+    codes = list({code for secs in groups.values() for code in secs})
+    ranges = await aq._get_bars_ranges(codes, frame_type)
+
+    fetched = defaultdict(list)
+    for (end, n), secs in groups.items():
+        closed_end = last_closed_frame(end, frame_type)
+        if closed_end != end:
+            n -= 1
+        if n <= 0:
+            continue
+
+        # 由本函数统一写入缓存，已结束的k线已经以nan填充
+        bars = await aq.get_bars_batch(
+            secs, closed_end, n, frame_type, False, persist=False
+        )
+        for code, _bars in bars.items():
+            fetched[code].append(_bars)
+
+        logger.debug(
+            "sync %s secs(%s), %s bars end at %s, actual got %s secs",
+            len(secs),
+            frame_type,
+            n,
+            closed_end,
+            len(bars or {}),
+        )
+
+    return await aq._save_bars_batch(fetched, ranges, frame_type)
+
+
+async def sync_bars_for_window(
+    code: str,
+    frame_type: FrameType,
+    start: Union[datetime.date, datetime.datetime],
+    stop: Union[datetime.date, datetime.datetime],
+    n: int,
+) -> int:
+    """获取`code`在[start, stop]间的`n`根k线，并存入缓存
+
+    Returns:
+        取得的k线条数
+    """
+    bars = await aq.get_bars(code, stop, n, frame_type)
+    if bars is None or len(bars) == 0:
+        return 0
+
+    if frame_type == FrameType.DAY:
+        await save_suspensions({code: bars})
+
+    logger.debug(
+        "sync %s(%s), from %s to %s: actual got %s ~ %s (%s)",
+        code,
+        frame_type,
+        start,
+        stop,
+        bars[0]["frame"],
+        bars[-1]["frame"],
+        len(bars),
+    )
+    if bars["frame"][0] != start:
+        logger.warning(
+            "discrete frames found: %s, start(%s), bars[0](%s)",
+            code,
+            start,
+            bars["frame"][0],
+        )
 
-    elapsed = await _stop_job_timer("sync")
-    logger.info("%s finished quotes sync in %s seconds", os.getpid(), elapsed)
+    return len(bars)
 
 
-async def sync_bars_for_security(
+async def _resample_job(job: str, frame_type: FrameType, targets: List[FrameType]):
+    if not targets:
+        return
+
+    code, start, stop, n = decode_job(job, frame_type)
+    try:
+        await resample_bars_for_window(code, frame_type, targets, start, stop, n)
+    except Exception as e:
+        logger.warning("Failed to resample %s to %s", job, targets)
+        logger.exception(e)
+
+
+async def resample_bars_for_window(
     code: str,
     frame_type: FrameType,
+    targets: List[FrameType],
     start: Union[datetime.date, datetime.datetime],
-    stop: Union[None, datetime.date, datetime.datetime],
-):
-    counters = 0
+    stop: Union[datetime.date, datetime.datetime],
+    n: int,
+) -> int:
+    """由缓存中`code`的`frame_type`k线，合成`targets`中各帧类型的k线并存入缓存。
+
+    [start, stop]是刚刚同步过的区间。包含`start`的目标帧可能起始于`start`之前，因此需要多读
+    出一个目标帧的源k线；不完整的目标帧不会被合成，待其结束后随下一个区间一起合成。
 
-    # 取数据库中该frame_type下该code的k线起始点
+    Returns:
+        合成并存入缓存的k线条数
+    """
     head, tail = await cache.get_bars_range(code, frame_type)
-    if not all([head, tail]):
-        await cache.clear_bars_range(code, frame_type)
-        n_bars = tf.count_frames(start, stop, frame_type)
-
-        bars = await aq.get_bars(code, stop, n_bars, frame_type)
-        if bars is not None and len(bars):
-            logger.debug(
-                "sync %s(%s), from %s to %s: actual got %s ~ %s (%s)",
-                code,
-                frame_type,
-                start,
-                head,
-                bars[0]["frame"],
-                bars[-1]["frame"],
-                len(bars),
-            )
-            counters = len(bars)
+    if head is None or tail is None:
+        return 0
+
+    stop = min(stop, tail)
+    n += max(resample.max_group_size(frame_type, to) for to in targets) - 1
+    bars = await cache.get_bars(code, stop, n, frame_type)
+    # 缓存范围之外的帧不是停牌，而是尚未同步
+    bars = bars[bars["frame"] >= head]
+
+    saved = 0
+    for to_frame in targets:
+        derived = resample.resample(bars, frame_type, to_frame)
+        if len(derived) == 0:
+            continue
+
+        with metrics.timer("omega_cache_save_seconds", frame=to_frame.value):
+            await cache.save_bars(code, derived, to_frame)
+        metrics.observe_lag(to_frame, derived["frame"][-1])
+        saved += len(derived)
+
+    logger.debug(
+        "resample %s(%s ~ %s) from %s to %s: %s bars",
+        code,
+        start,
+        stop,
+        frame_type,
+        targets,
+        saved,
+    )
+    return saved
+
+
+# 同步批次完成后可以依次执行的后续步骤，键为同步参数中`then`所使用的名字
+_stages: Dict[str, Callable] = {}
+
+
+def register_stage(name: str):
+    """注册同步批次完成后的后续步骤。
+
+    后续步骤的签名为`async def stage(frame_type, start, stop, sync_params)`，其中[start, stop]
+    为批次的同步区间（包括并入的触发）。在同步参数的`then`中列出步骤的名字，即可在批次完成后
+    依次执行这些步骤，比如：
+    ```
+    - frame: '1m'
+      then:
+        - resample
+        - validate
+    ```
+    """
+
+    def decorator(func):
+        _stages[name] = func
+        return func
+
+    return decorator
+
+
+async def on_bars_sync_done(params: dict):
+    """handle Events.OMEGA_SYNC_DONE，依次执行同步参数中`then`所指定的后续步骤
+
+    某一步骤出错时，其后的步骤不再执行，因为它们可能依赖于该步骤的结果。
+
+    Args:
+        params: 见[omega.jobs.syncjobs._advance_run][]发出的事件
+    """
+    frame_type, start, stop = params["frame_type"], params["start"], params["stop"]
+    sync_params = load_sync_params(frame_type)
+    if sync_params is None:
         return
 
-    if start < head:
-        n = tf.count_frames(start, head, frame_type) - 1
-        if n > 0:
-            _end_at = tf.shift(head, -1, frame_type)
-            bars = await aq.get_bars(code, _end_at, n, frame_type)
-            if bars is not None and len(bars):
-                counters += len(bars)
-                logger.debug(
-                    "sync %s(%s), from %s to %s: actual got %s ~ %s (%s)",
-                    code,
-                    frame_type,
-                    start,
-                    head,
-                    bars[0]["frame"],
-                    bars[-1]["frame"],
-                    len(bars),
-                )
-                if bars["frame"][-1] != _end_at:
-                    logger.warning(
-                        "discrete frames found:%s, bars[-1](%s), " "head(%s)",
-                        code,
-                        bars["frame"][-1],
-                        head,
-                    )
-
-    if stop > tail:
-        n = tf.count_frames(tail, stop, frame_type) - 1
-        if n > 0:
-            bars = await aq.get_bars(code, stop, n, frame_type)
-            if bars is not None and len(bars):
-                logger.debug(
-                    "sync %s(%s), from %s to %s: actual got %s ~ %s (%s)",
-                    code,
-                    frame_type,
-                    tail,
-                    stop,
-                    bars[0]["frame"],
-                    bars[-1]["frame"],
-                    len(bars),
-                )
-                counters += len(bars)
-                if bars["frame"][0] != tf.shift(tail, 1, frame_type):
-                    logger.warning(
-                        "discrete frames found: %s, tail(%s), bars[0](" "%s)",
-                        code,
-                        tail,
-                        bars["frame"][0],
-                    )
+    for name in sync_params.get("then") or []:
+        stage = _stages.get(name)
+        if stage is None:
+            logger.warning("unknown stage %s after sync of %s", name, frame_type)
+            continue
+
+        try:
+            with metrics.timer(
+                "omega_sync_stage_seconds", frame=frame_type.value, stage=name
+            ):
+                await stage(frame_type, start, stop, sync_params)
+        except Exception as e:
+            fmt_str = "stage %s failed after sync %s(%s), the rest are skipped"
+            logger.warning(fmt_str, name, params["run"], frame_type)
+            logger.exception(e)
+            return
+
+        logger.info("stage %s done after sync %s(%s)", name, params["run"], frame_type)
+
+
+@register_stage("resample")
+async def resample_stage(
+    frame_type: FrameType, start: Frame, stop: Frame, sync_params: dict
+) -> int:
+    """由批次同步的k线，合成`resample`中的各帧类型
+
+    [start, stop]是批次的名义区间。每支证券只合成其实际同步过的区间，即从该证券在批次中的起始
+    帧（见[omega.jobs.syncjobs.get_run_windows][]）到`stop`；批次没有记录起始帧时，只合成
+    `stop`所在的帧。
+
+    Returns:
+        合成并存入缓存的k线条数
+    """
+    targets = resample_targets(sync_params)
+    if not targets:
+        return 0
+
+    windows = await get_run_windows(frame_type)
+    if len(windows) == 0:
+        codes, *_ = parse_sync_params(**sync_params)
+        windows = {code: frame_to_int(stop, frame_type) for code in codes}
+
+    async def resample_code(code: str, w_start: int) -> int:
+        w_start = int_to_frame(w_start, frame_type)
+        n = tf.count_frames(w_start, stop, frame_type)
+        try:
+            return await resample_bars_for_window(
+                code, frame_type, targets, w_start, stop, n
+            )
+        except Exception as e:
+            logger.warning("Failed to resample %s(%s) to %s", code, frame_type, targets)
+            logger.exception(e)
+            return 0
+
+    saved = 0
+    items = list(windows.items())
+    for i in range(0, len(items), _RESAMPLE_CONCURRENCY):
+        chunk = items[i : i + _RESAMPLE_CONCURRENCY]
+        saved += sum(await asyncio.gather(*[resample_code(*item) for item in chunk]))
+
+    return saved
+
+
+@register_stage("validate")
+async def validate_stage(
+    frame_type: FrameType, start: Frame, stop: Frame, sync_params: dict
+) -> List[str]:
+    """检查缓存中各证券的数据是否都已到达批次中最后一个已结束的帧
+
+    Returns:
+        数据仍然落后的证券
+    """
+    codes, *_ = parse_sync_params(**sync_params)
+    last_closed = frame_to_int(last_closed_frame(stop, frame_type), frame_type)
+
+    pl = cache.security.pipeline()
+    for code in codes:
+        pl.hget(f"{code}:{frame_type.value}", "tail")
+    tails = await pl.execute()
+
+    behind = [code for code, tail in zip(codes, tails) if int(tail or 0) < last_closed]
+    metrics.inc("omega_sync_behind_total", len(behind), frame=frame_type.value)
+    if len(behind):
+        fmt_str = "%s of %s secs(%s) are behind %s after sync, e.g. %s"
+        logger.warning(
+            fmt_str, len(behind), len(codes), frame_type, last_closed, behind[:5]
+        )
+
+    return behind
 
 
 async def trigger_single_worker_sync(_type: str, params: dict = None):
@@ -417,20 +1196,38 @@ async def sync_calendar():
 async def sync_security_list():
     """更新证券列表
 
-    注意证券列表在AbstractQuotesServer取得时就已保存，此处只是触发
+    注意证券列表在AbstractQuotesServer取得时就已保存，此处只是触发。只有证券列表发生变化时，
+    `update_security_list`才会通知各进程重新加载。
     """
-    secs = await aq.get_security_list()
-    logger.info("%s secs are fetched and saved.", len(secs))
+    changes = await aq.update_security_list()
+    if changes is None:
+        return
+
+    logger.info(
+        "%s secs are fetched, version %s: %s added, %s removed, %s delisted, "
+        "%s renamed",
+        changes["count"],
+        changes["version"],
+        len(changes["added"]),
+        len(changes["removed"]),
+        len(changes["delisted"]),
+        len(changes["renamed"]),
+    )
 
 
-async def reset_tail(codes: [], frame_type: FrameType, days=-1):
+async def reset_tail(
+    codes: List[str], frame_type: FrameType, days=-1
+) -> Tuple[str, int]:
     """
     重置tail的值，来同步数据
+
+    所有证券的tail在服务器端一次性重置，每`_RESET_TAIL_CHUNK`支证券只需要一次redis调用。
     Args:
         days: 需要重置到多少天之前
         codes:
         frame_type:
     Returns:
+        重置到的日期，以及tail实际被重置的证券数
     """
 
     now = arrow.now()
@@ -457,24 +1254,155 @@ async def reset_tail(codes: [], frame_type: FrameType, days=-1):
         tail = tf.date2int(date)
     else:
         raise Exception("不支持的frame_type")
-    # print(f"reset tail to[m:{m}, day:{day}, week:{week}, month:{month}] ")
 
-    for code in codes:
-        key = f"{code}:{frame_type.value}"
-        resp = await cache.security.hget(key, "tail")
-        if resp is None:
-            continue
-        _tail = int(resp)
-        print(_tail)
-        if _tail > tail:  # 只有数据库里的时间大于tail 才可以
-            await cache.security.hset(key, 'tail', tail)
+    moved = 0
+    keys = [f"{code}:{frame_type.value}" for code in codes]
+    for i in range(0, len(keys), _RESET_TAIL_CHUNK):
+        chunk = keys[i : i + _RESET_TAIL_CHUNK]
+        moved += await cache.security.eval(_reset_tail_script, keys=chunk, args=[tail])
+
+    fmt_str = "reset tail of %s/%s secs to %s in %s"
+    logger.info(fmt_str, moved, len(codes), tail, frame_type)
+    return date.strftime('%Y-%m-%d'), moved
+
+
+def _day_window(day: datetime.date, frame_type: FrameType) -> Tuple[Frame, int]:
+    """返回`day`当天`frame_type`k线的截止帧和帧数"""
+    if frame_type in tf.minute_level_frames:
+        end = datetime.datetime(day.year, day.month, day.day, 15)
+        return end, len(tf.ticks[frame_type])
 
-    return date.strftime('%Y-%m-%d')
+    return day, 1
+
+
+async def trigger_bars_reconcile(sync_params: dict):
+    """将待核对的证券放入队列，发信号给各quotes_fetcher进程，核对当天的k线。
+
+    Args:
+        sync_params: 同步参数，见[omega.jobs.syncjobs.trigger_bars_sync][]。`batch`为每次
+            向上游请求的证券个数，未指定时为`_RECONCILE_BATCH`
+    """
+    codes, frame_type, *_ = parse_sync_params(**sync_params)
+    if len(codes) == 0:
+        logger.warning("no securities are specified for reconcile %s", frame_type)
+        return
+
+    queue = ShardedWorkQueue(f"jobs.bars_reconcile.scope.{frame_type.value}")
+    await queue.reset(codes, await live_fetchers())
+
+    day = arrow.now(tz=cfg.tz).date()
+    await emit.emit(
+        Events.OMEGA_DO_RECONCILE,
+        {
+            "frame_type": frame_type,
+            "day": day,
+            "batch": int(sync_params.get("batch") or _RECONCILE_BATCH),
+            "resample": resample_targets(sync_params),
+        },
+    )
+    fmt_str = "send reconcile event for %s secs(%s) on %s"
+    logger.info(fmt_str, len(codes), frame_type, day)
+
+
+async def reconcile_bars(params: dict):
+    """reconcile bars on signal OMEGA_DO_RECONCILE received
+
+    Args:
+        params (dict): composed of the following:
+            ```
+            {
+                frame_type (FrameType): k线的帧类型
+                day (datetime.date): 要核对的交易日
+                batch (int): 每次向上游请求的证券个数
+                resample (List[FrameType]): 由本帧k线合成的帧类型，重写的证券须一并重新合成
+            }
+            ```
+    """
+    frame_type, day = params["frame_type"], params["day"]
+    batch = params.get("batch") or _RECONCILE_BATCH
+    targets = params.get("resample") or []
+
+    queue = ShardedWorkQueue(f"jobs.bars_reconcile.scope.{frame_type.value}")
+    checked, rewritten = 0, 0
+    while True:
+        codes = await queue.claim(batch)
+        if not codes:
+            break
+
+        try:
+            mismatched = await reconcile_bars_batch(codes, frame_type, day, targets)
+            rewritten += len(mismatched)
+        except FetcherQuotaError as e:
+            logger.warning("Quota exceeded when reconciling %s. Aborted.", frame_type)
+            logger.exception(e)
+            await queue.release(*codes)
+            return
+        except Exception as e:
+            logger.warning("Failed to reconcile %s", codes)
+            logger.exception(e)
+
+        checked += len(codes)
+        await queue.ack(*codes)
+
+    fmt_str = "%s reconciled %s secs(%s) on %s, %s rewritten"
+    logger.info(fmt_str, os.getpid(), checked, frame_type, day, rewritten)
+
+
+async def reconcile_bars_batch(
+    codes: List[str],
+    frame_type: FrameType,
+    day: datetime.date,
+    targets: List[FrameType] = None,
+) -> List[str]:
+    """核对`codes`在`day`当天的k线，只重写与上游不一致的证券。
+
+    通过一次`get_bars_batch`取得上游的收盘数据，按缓存的存储格式计算各证券的checksum，与
+    缓存中的数据比较。只有不一致（包括缓存中缺失）的证券才会被覆盖写入，并重新合成`targets`中
+    的k线。
+
+    Returns:
+        被重写的证券
+    """
+    end, n = _day_window(day, frame_type)
+    expected = await aq.get_bars_batch(codes, end, n, frame_type, False, persist=False)
+
+    actual = await sanity.calc_cached_checksums(list(expected), end, n, frame_type)
+    mismatched = [
+        code
+        for code, _bars in expected.items()
+        if sanity.calc_bars_checksum(_bars) != actual[code]
+    ]
+    labels = {"frame": frame_type.value}
+    metrics.inc("omega_reconcile_checked_total", len(expected), **labels)
+    metrics.inc("omega_reconcile_rewritten_total", len(mismatched), **labels)
+    if len(mismatched) == 0:
+        return []
+
+    ranges = await aq._get_bars_ranges(mismatched, frame_type)
+    fetched = {code: [expected[code]] for code in mismatched}
+    await aq._save_bars_batch(fetched, ranges, frame_type, overwrite=True)
+
+    if targets:
+        # 已合成的k线可能基于错误的数据，须重新合成
+        for target in targets:
+            await reset_tail(mismatched, target)
+
+        frames = tf.get_frames_by_count(end, n, frame_type)
+        for code in mismatched:
+            job = encode_job(code, int(frames[0]), int(frames[-1]), n)
+            await _resample_job(job, frame_type, targets)
+
+    fmt_str = "rewrite %s secs(%s) on %s: %s"
+    logger.debug(fmt_str, len(mismatched), frame_type, day, mismatched)
+    return mismatched
 
 
 async def closing_quotation_sync_bars(all_params):
     """
     收盘之后从新同步今天的分钟线数据和日周月
+
+    如果配置了`omega.sync.closing: reconcile`，分钟线和日线不再重新同步，而是核对当天的
+    数据，只重写与上游不一致的证券，见[omega.jobs.syncjobs.reconcile_bars_batch][]
     Returns:
         {
                     "frame": "1m",
@@ -488,9 +1416,19 @@ async def closing_quotation_sync_bars(all_params):
     """
 
     logger.info("正在同步今天的分钟线数据和日周月")
+    reconcile = getattr(cfg.omega.sync, "closing", None) == "reconcile"
     for params in all_params:
         codes, frame_type, start, stop, delay = parse_sync_params(**params)
-        start_date = await reset_tail(codes, frame_type)
+        # 分钟线和日线可以逐支核对，只重写与上游不一致的证券
+        if reconcile and frame_type in tf.minute_level_frames + [FrameType.DAY]:
+            if tf.is_trade_day(arrow.now()):
+                await trigger_bars_reconcile(params)
+            continue
+
+        start_date, _ = await reset_tail(codes, frame_type)
+        # 合成的k线依赖于本帧k线，须一并重新合成
+        for target in resample_targets(params):
+            await reset_tail(codes, target)
         params["start"] = start_date
         logger.info(params)
         await trigger_bars_sync(params)
@@ -498,9 +1436,11 @@ async def closing_quotation_sync_bars(all_params):
 
 def load_bars_sync_jobs(scheduler):
     all_params = []
+    # 由其它帧合成的k线，无须从上游同步
+    derived = derived_frames()
     frame_type = FrameType.MIN1
     params = load_sync_params(frame_type)
-    if params:
+    if params and frame_type not in derived:
         all_params.append(params)
         params["delay"] = params.get("delay") or 5
         scheduler.add_job(
@@ -545,7 +1485,7 @@ def load_bars_sync_jobs(scheduler):
 
     frame_type = FrameType.MIN5
     params = load_sync_params(frame_type)
-    if params:
+    if params and frame_type not in derived:
         all_params.append(params)
         params["delay"] = params.get("delay") or 60
         scheduler.add_job(
@@ -590,7 +1530,7 @@ def load_bars_sync_jobs(scheduler):
 
     frame_type = FrameType.MIN15
     params = load_sync_params(frame_type)
-    if params:
+    if params and frame_type not in derived:
         all_params.append(params)
         params["delay"] = params.get("delay") or 60
         scheduler.add_job(
@@ -635,7 +1575,7 @@ def load_bars_sync_jobs(scheduler):
 
     frame_type = FrameType.MIN30
     params = load_sync_params(frame_type)
-    if params:
+    if params and frame_type not in derived:
         all_params.append(params)
         params["delay"] = params.get("delay") or 60
         scheduler.add_job(
@@ -665,7 +1605,7 @@ def load_bars_sync_jobs(scheduler):
 
     frame_type = FrameType.MIN60
     params = load_sync_params(frame_type)
-    if params:
+    if params and frame_type not in derived:
         all_params.append(params)
         params["delay"] = params.get("delay") or 60
         scheduler.add_job(
@@ -695,7 +1635,7 @@ def load_bars_sync_jobs(scheduler):
 
     for frame_type in tf.day_level_frames:
         params = load_sync_params(frame_type)
-        if params:
+        if params and frame_type not in derived:
             all_params.append(params)
             params["delay"] = params.get("delay") or 60
             scheduler.add_job(
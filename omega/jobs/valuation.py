@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+按交易日批量同步全部股票的市值数据。
+
+1. 每天收盘后，检查最近`days`个已收盘的交易日中尚未同步的日期（包括此前失败或者中断的日期），
+   将当天上市交易的股票按`chunk`支一组，每组作为一个任务放入分片的工作队列，由各fetcher进程
+   共同完成。
+2. 各组待同步的证券保存在`jobs.valuation.pending.{day}`中，任务完成后即删除，因此任务可以
+   安全地重复执行。某日的各组都完成后，该日被记入`jobs.valuation.days`。
+3. 市值数据通过`Valuation.save`批量写入数据库。已同步的日期，`/quotes/valuation`直接从数据库
+   中读取，不再请求上游。
+"""
+import logging
+import os
+from typing import List
+
+import arrow
+import cfg4py
+import numpy as np
+import omicron
+from omicron import cache
+from omicron.core.errors import FetcherQuotaError
+from omicron.core.timeframe import tf
+from omicron.core.types import FrameType
+from omicron.models.securities import Securities
+from pyemit import emit
+
+from omega.core.events import Events
+from omega.core.frames import last_closed_frame
+from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
+from omega.jobs.planner import listing_bounds
+from omega.jobs.sharding import ShardedWorkQueue, live_fetchers
+
+logger = logging.getLogger(__name__)
+cfg = cfg4py.get_instance()
+
+# 每次向上游请求的证券数
+_CHUNK = 1000
+# 检查最近多少个交易日的数据
+_DAYS = 20
+
+_SCOPE_KEY = "jobs.valuation.scope"
+# 已同步的日期（有序集合，以日期为分值）
+_DAYS_KEY = "jobs.valuation.days"
+
+
+def _pending_key(day: int) -> str:
+    return f"jobs.valuation.pending.{day}"
+
+
+def load_valuation_params() -> dict:
+    """读取配置文件中的`omega.sync.valuation`，缺失的项使用默认值"""
+    params = getattr(cfg.omega.sync, "valuation", None)
+    return {
+        "chunk": int(getattr(params, "chunk", None) or _CHUNK),
+        "days": int(getattr(params, "days", None) or _DAYS),
+    }
+
+
+async def get_synced_days(start: int, end: int) -> List[int]:
+    """返回[start, end]之间已同步的日期"""
+    days = await cache.sys.zrangebyscore(_DAYS_KEY, min=start, max=end)
+    return [int(day) for day in days]
+
+
+async def trigger_valuation_sync(params: dict = None) -> int:
+    """将最近`days`个交易日中尚未同步的日期放入队列，发信号给各quotes_fetcher进程开始同步。
+
+    重复触发时，尚未完成的组中，不在队列里的会重新入队；已完成的组不会重复获取，也不影响正在进行
+    的同步。
+
+    Args:
+        params: 见`load_valuation_params`
+
+    Returns:
+        新入队的任务数
+    """
+    if not omicron.has_db():
+        logger.warning("valuation sync requires postgres, which is disabled")
+        return 0
+
+    params = {**load_valuation_params(), **(params or {})}
+    chunk, n = params["chunk"], params["days"]
+
+    now = arrow.now(tz=cfg.tz).date()
+    end = last_closed_frame(tf.floor(now, FrameType.DAY), FrameType.DAY)
+    days = tf.get_frames_by_count(end, n, FrameType.DAY)
+    synced = set(await get_synced_days(days[0], days[-1]))
+    missing = [int(day) for day in days if day not in synced]
+    if len(missing) == 0:
+        logger.info("valuation of the last %s trade days are all synced", n)
+        return 0
+
+    codes = Securities().choose(
+        ["stock"], exclude_exit=False, exclude_st=False, exclude_688=False
+    )
+    first, last = await listing_bounds(codes, FrameType.DAY)
+    codes = np.array(codes)
+
+    # 只为尚未开始的日期生成分组。已经开始的日期，其已完成的组已从待同步的分组中删除，不能重建
+    pl = cache.sys.pipeline()
+    for day in missing:
+        pl.exists(_pending_key(day))
+    started = await pl.execute()
+
+    pl = cache.sys.pipeline()
+    for day, exists in zip(missing, started):
+        if exists:
+            continue
+
+        listed = codes[(first <= day) & (day <= last)]
+        groups = {
+            str(i): ",".join(listed[i * chunk : (i + 1) * chunk])
+            for i in range((len(listed) + chunk - 1) // chunk)
+        }
+        if groups:
+            pl.hmset_dict(_pending_key(day), groups)
+    for day in missing:
+        pl.hkeys(_pending_key(day))
+    recs = (await pl.execute())[-len(missing) :]
+
+    # 仍在队列中（包括正在同步）的任务不再重复入队
+    queue = ShardedWorkQueue(_SCOPE_KEY)
+    queued = set(await queue.items())
+    pending = [f"{i},{day}" for day, groups in zip(missing, recs) for i in groups]
+    jobs = [job for job in pending if job not in queued]
+
+    # 以组号为分片的键，同一天的各组分布到不同的进程上
+    if jobs:
+        await queue.put(jobs, await live_fetchers())
+    if pending:
+        await emit.emit(Events.OMEGA_DO_VALUATION_SYNC, params)
+
+    logger.info("sync valuation of %s days: %s jobs", len(missing), len(jobs))
+    return len(jobs)
+
+
+async def sync_valuation_chunk(job: str) -> int:
+    """同步`job`指定的一组证券在某一天的市值数据，并在该日的各组都完成后，将其记为已同步
+
+    Returns:
+        保存的记录数
+    """
+    group, day = job.split(",")
+    key = _pending_key(int(day))
+    codes = await cache.sys.hget(key, group)
+    if codes is None:
+        # 已经由其它进程完成
+        return 0
+
+    valuation = await aq.get_valuation(codes.split(","), tf.int2date(day))
+    count = 0 if valuation is None else len(valuation)
+
+    tr = cache.sys.multi_exec()
+    tr.hdel(key, group)
+    tr.hlen(key)
+    _, remaining = await tr.execute()
+    if remaining == 0:
+        await cache.sys.zadd(_DAYS_KEY, int(day), day)
+        logger.info("valuation of %s is synced", day)
+
+    return count
+
+
+async def sync_valuation(params: dict = None):
+    """sync valuation on signal OMEGA_DO_VALUATION_SYNC received"""
+    queue = ShardedWorkQueue(_SCOPE_KEY)
+    count = 0
+    while True:
+        claimed = await queue.claim(1)
+        if not claimed:
+            break
+
+        job = claimed[0]
+        try:
+            count += await sync_valuation_chunk(job)
+        except FetcherQuotaError as e:
+            logger.warning("Quota exceeded when syncing valuation %s. Paused.", job)
+            logger.exception(e)
+            await queue.release(job)
+            return
+        except Exception as e:
+            # 该日不会被记为已同步，下次触发时重新入队
+            logger.warning("Failed to sync valuation %s", job)
+            logger.exception(e)
+
+        await queue.ack(job)
+
+    logger.info("%s finished valuation sync, %s records saved", os.getpid(), count)
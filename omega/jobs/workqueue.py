@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Author: Aaron-Yang [code@jieyu.ai]
+Contributors:
+
+带租约的工作队列。
+
+待处理的任务存放在redis list中，被取走的任务并不立即删除，而是连同其租约到期时间一起存入一个
+sorted set。worker完成任务后确认(ack)，任务才真正被删除；如果worker在租约到期前没有确认（比如
+进程崩溃），任务会在下一次有worker来领取任务时，被重新放回队列。
+"""
+import logging
+import time
+from typing import List, Optional, Tuple
+
+from omicron import cache
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1]: 待处理队列, KEYS[2]: 租约
+# ARGV[1]: 当前时间, ARGV[2]: 租约到期时间, ARGV[3]: 领取的任务数, ARGV[4]: 是否从队尾领取
+_claim_script = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, item in ipairs(expired) do
+    redis.call('RPUSH', KEYS[1], item)
+end
+if #expired > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+end
+
+local n = tonumber(ARGV[3])
+local items
+if ARGV[4] == '1' then
+    items = redis.call('LRANGE', KEYS[1], -n, -1)
+    if #items > 0 then
+        redis.call('LTRIM', KEYS[1], 0, -#items - 1)
+    end
+else
+    items = redis.call('LRANGE', KEYS[1], 0, n - 1)
+    if #items > 0 then
+        redis.call('LTRIM', KEYS[1], #items, -1)
+    end
+end
+
+if #items > 0 then
+    for _, item in ipairs(items) do
+        redis.call('ZADD', KEYS[2], ARGV[2], item)
+    end
+end
+return items
+"""
+
+# KEYS[1]: 待处理队列, KEYS[2]: 租约
+# ARGV: 需要放回队列的任务
+_release_script = """
+for i = #ARGV, 1, -1 do
+    if redis.call('ZREM', KEYS[2], ARGV[i]) == 1 then
+        redis.call('LPUSH', KEYS[1], ARGV[i])
+    end
+end
+return #ARGV
+"""
+
+# KEYS[1]: 待处理队列, KEYS[2]: 租约
+# ARGV[1]: 当前时间, ARGV[2]: 是否强制合并, ARGV[3:]: 新的任务
+# 仅当强制合并，或者有未过期的租约（即仍有worker在工作）时才合并，返回被替代的待处理任务数；
+# 否则不做任何修改，返回-1
+_merge_script = """
+if ARGV[2] ~= '1' and redis.call('ZCOUNT', KEYS[2], '(' .. ARGV[1], '+inf') == 0 then
+    return -1
+end
+
+local keys = {}
+for i = 3, #ARGV do
+    keys[string.match(ARGV[i], '^[^,]*')] = true
+end
+
+local replaced = 0
+local pending = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1])
+for _, item in ipairs(pending) do
+    if keys[string.match(item, '^[^,]*')] then
+        replaced = replaced + 1
+    else
+        redis.call('RPUSH', KEYS[1], item)
+    end
+end
+for i = 3, #ARGV do
+    redis.call('RPUSH', KEYS[1], ARGV[i])
+end
+return replaced
+"""
+
+
+class WorkQueue:
+    def __init__(self, name: str, lease: int = 60):
+        """
+        Args:
+            name: 队列名，即待处理任务所在的redis list的键
+            lease: 租约时长（秒）。领取的任务在此时间内未被确认，将被重新放回队列
+        """
+        self.name = name
+        self.lease = lease
+
+        self.key_leases = f"{name}.leases"
+
+    async def reset(self, items: List[str]):
+        """清空队列（包括已领取、未确认的任务），并放入`items`"""
+        pl = cache.sys.pipeline()
+        pl.delete(self.name, self.key_leases)
+        if len(items):
+            pl.rpush(self.name, *items)
+        await pl.execute()
+
+    async def merge(self, items: List[str], force: bool = False) -> Optional[int]:
+        """如果队列仍在被处理，将`items`合并进来，而不是重置队列。
+
+        任务的键是其第一个逗号之前的部分。待处理任务中，与`items`中某一任务同键的，将被该任务
+        替代；已领取的任务不受影响。整个过程是原子的，因此正在工作的worker领取完已有的任务后，会
+        接着领取合并进来的任务。
+
+        Args:
+            items: 新的任务
+            force: 即使没有worker在工作，也进行合并
+
+        Returns:
+            被替代的待处理任务数。如果没有worker在工作（没有未过期的租约），不做任何修改并
+            返回None
+        """
+        replaced = await cache.sys.eval(
+            _merge_script,
+            keys=[self.name, self.key_leases],
+            args=[time.time(), int(force), *items],
+        )
+        return None if replaced < 0 else replaced
+
+    async def leased(self) -> List[str]:
+        """返回已领取、尚未确认且租约未过期的任务"""
+        return await cache.sys.zrangebyscore(
+            self.key_leases,
+            time.time(),
+            float("inf"),
+            exclude=cache.sys.ZSET_EXCLUDE_MIN,
+        )
+
+    async def put(self, *items: str):
+        if len(items):
+            await cache.sys.rpush(self.name, *items)
+
+    async def claim(self, n: int = 1, from_tail: bool = False) -> List[str]:
+        """领取至多`n`个任务，只需要一次redis调用。
+
+        领取前，租约已过期的任务会先被放回队列。
+
+        Args:
+            n: 领取的任务数
+            from_tail: 从队尾领取。从其它worker的队列中窃取任务时使用，以免与该worker争抢
+        """
+        now = time.time()
+        return await cache.sys.eval(
+            _claim_script,
+            keys=[self.name, self.key_leases],
+            args=[now, now + self.lease, n, int(from_tail)],
+        )
+
+    async def ack(self, *items: str) -> int:
+        """确认任务已完成。
+
+        Returns:
+            实际被确认的任务数。租约已过期、已被放回队列的任务不计在内，它们会被再次领取，并在
+            那时被确认，因此每个任务只会被计数一次
+        """
+        if len(items) == 0:
+            return 0
+
+        return await cache.sys.zrem(self.key_leases, *items)
+
+    async def release(self, *items: str):
+        """放弃已领取的任务，将其放回队首，以便其它worker尽快领取"""
+        if len(items):
+            await cache.sys.eval(
+                _release_script, keys=[self.name, self.key_leases], args=list(items)
+            )
+
+    async def size(self) -> Tuple[int, int]:
+        """返回待处理和已领取（未确认）的任务数"""
+        tr = cache.sys.multi_exec()
+        tr.llen(self.name)
+        tr.zcard(self.key_leases)
+        pending, leased = await tr.execute()
+        return pending, leased
@@ -0,0 +1,140 @@
+import datetime
+import logging
+import time
+import unittest
+
+import numpy as np
+import omicron
+from omicron.core.timeframe import tf
+from omicron.core.types import FrameType, bars_dtype
+
+from omega.core.accelerate import int2frames, merge
+from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
+from tests import init_test_env
+
+logger = logging.getLogger(__name__)
+
+
+def merge_loop(left, right, by):
+    """the original pure-python implementation, as a reference"""
+    i, j = 0, 0
+
+    while j < len(right) and i < len(left):
+        if right[j][by] < left[by][i]:
+            j += 1
+        elif right[j][by] == left[by][i]:
+            left[i] = right[j]
+            i += 1
+            j += 1
+        else:
+            i += 1
+
+    return left
+
+
+def best_of(func, *args, repeat=5):
+    elapsed = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(*args)
+        elapsed.append(time.perf_counter() - t0)
+
+    return min(elapsed)
+
+
+class TestAccelerate(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        init_test_env()
+        await omicron.init()
+
+    async def asyncTearDown(self) -> None:
+        await omicron.shutdown()
+
+    def make_case(self, n: int):
+        start = tf.int2time(202005060931)
+        frames = np.array(
+            [start + datetime.timedelta(minutes=i) for i in range(n)], dtype=object
+        )
+
+        left = np.empty(n, dtype=bars_dtype)
+        left[:] = np.nan
+        left["frame"] = frames
+
+        # right starts before and ends after left, with holes in between
+        rng = np.random.default_rng(n)
+        picked = np.sort(rng.choice(np.arange(-5, n + 5), n // 2, replace=False))
+        right = np.empty(len(picked), dtype=bars_dtype)
+        right["frame"] = [start + datetime.timedelta(minutes=int(i)) for i in picked]
+        right["open"] = picked
+        right["close"] = picked + 0.5
+
+        return left, right
+
+    def assert_bars_equal(self, expected, actual):
+        self.assertListEqual(expected["frame"].tolist(), actual["frame"].tolist())
+        for field in ("open", "close"):
+            np.testing.assert_array_equal(expected[field], actual[field])
+
+    def test_merge(self):
+        for n in (0, 1, 10, 100, 1000):
+            left, right = self.make_case(n)
+            expected = merge_loop(left.copy(), right, "frame")
+            self.assert_bars_equal(expected, merge(left.copy(), right, "frame"))
+
+        # plain dtypes
+        dtype = [("frame", "i8"), ("value", "f8")]
+        left = np.array([(i, np.nan) for i in (1, 2, 3, 4, 5)], dtype=dtype)
+        right = np.array([(0, 0), (2, 2), (5, 5), (7, 7)], dtype=dtype)
+        actual = merge(left, right, "frame")
+        np.testing.assert_array_equal([1, 2, 3, 4, 5], actual["frame"])
+        np.testing.assert_array_equal([np.nan, 2, np.nan, np.nan, 5], actual["value"])
+
+    def test_int2frames(self):
+        days = [20200430, 20200506, 20201231, 20240229]
+        self.assertListEqual([tf.int2date(d) for d in days], int2frames(days).tolist())
+
+        minutes = [202004300931, 202004301500, 202005061130, 202005061301]
+        actual = int2frames(minutes, tf._tz).tolist()
+        self.assertListEqual([tf.int2time(m) for m in minutes], actual)
+        offsets = {x.utcoffset() for x in actual}
+        self.assertSetEqual({datetime.timedelta(hours=8)}, offsets)
+
+        self.assertEqual(0, len(int2frames([])))
+
+    def test_fill_na(self):
+        end = tf.int2time(202005081500)
+        frames = tf.get_frames_by_count(end, 20, FrameType.MIN30)
+        bars = np.empty(2, dtype=bars_dtype)
+        bars["frame"] = [tf.int2time(frames[3]), tf.int2time(frames[-1])]
+        bars["close"] = [1, 2]
+
+        filled = aq._fill_na(bars, 20, end, FrameType.MIN30)
+        self.assertListEqual([tf.int2time(f) for f in frames], filled["frame"].tolist())
+        self.assertEqual(1, filled[3]["close"])
+        self.assertEqual(2, filled[-1]["close"])
+        self.assertEqual(18, np.count_nonzero(np.isnan(filled["close"])))
+
+    def test_benchmark(self):
+        """the vectorized versions are faster than the loops they replace.
+
+        Only a conservative speedup is asserted, well below what's measured, so that
+        noisy timing doesn't fail the test.
+        """
+        for n in (10, 100, 1000, 10000):
+            left, right = self.make_case(n)
+            loop = best_of(merge_loop, left.copy(), right, "frame")
+            vectorized = best_of(merge, left.copy(), right, "frame")
+
+            ints = [tf.time2int(x) for x in left["frame"]]
+            listcomp = best_of(lambda: [tf.int2time(x) for x in ints])
+            converted = best_of(int2frames, ints, tf._tz)
+
+            logger.info(
+                "%s bars, merge: %.1fx, int2frames: %.1fx",
+                n,
+                loop / vectorized,
+                listcomp / converted,
+            )
+
+        self.assertGreater(loop / vectorized, 1.5)
+        self.assertGreater(listcomp / converted, 1.5)
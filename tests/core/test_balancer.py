@@ -0,0 +1,89 @@
+import itertools
+import unittest
+from unittest import mock
+
+from omega.core.balancer import Balancer
+
+
+class TestBalancer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.a, self.b = object(), object()
+        self.balancer = Balancer(alpha=0.5, failures=2, cooldown=30)
+        self.balancer.add(self.a, "a")
+        self.balancer.add(self.b, "b")
+
+    def call(self, instance, elapsed: float, now: float = 1000, fail=False):
+        clock = itertools.chain([now], itertools.repeat(now + elapsed))
+        with mock.patch("time.time", side_effect=clock):
+            try:
+                with self.balancer.track(instance):
+                    if fail:
+                        raise ConnectionError("upstream is down")
+            except ConnectionError:
+                pass
+
+    def test_pick(self):
+        with self.assertRaises(IndexError):
+            Balancer().pick()
+
+        # untried instances first, then the faster one
+        self.assertIs(self.a, self.balancer.pick())
+        self.call(self.a, 2)
+        self.assertIs(self.b, self.balancer.pick())
+        self.call(self.b, 1)
+        self.assertIs(self.b, self.balancer.pick())
+
+        # latency is smoothed
+        self.call(self.b, 5)
+        self.assertAlmostEqual(3, self.balancer.status()[1]["latency"])
+        self.assertIs(self.a, self.balancer.pick())
+
+        # the busy instance is avoided even if it's faster
+        self.call(self.b, 0)
+        self.assertIs(self.b, self.balancer.pick())
+        with self.balancer.track(self.b):
+            self.assertIs(self.a, self.balancer.pick())
+            self.assertEqual(1, self.balancer.status()[1]["inflight"])
+
+        self.assertEqual(0, self.balancer.status()[1]["inflight"])
+
+        # the excluded one is never picked
+        self.assertEqual(2, len(self.balancer))
+        self.assertIs(self.a, self.balancer.pick(exclude=self.b))
+
+    def test_circuit_breaker(self):
+        self.call(self.a, 1)
+        self.call(self.b, 2)
+
+        self.call(self.a, 1, fail=True)
+        with mock.patch("time.time", return_value=1001):
+            self.assertIs(self.a, self.balancer.pick())
+
+        # ejected after 2 failures in a row
+        self.call(self.a, 1, fail=True)
+        with mock.patch("time.time", return_value=1010):
+            self.assertIs(self.b, self.balancer.pick())
+            self.assertFalse(self.balancer.status()[0]["healthy"])
+
+        # all ejected, the one recovers first is picked
+        self.call(self.b, 1, now=1005, fail=True)
+        self.call(self.b, 1, now=1005, fail=True)
+        with mock.patch("time.time", return_value=1010):
+            self.assertIs(self.a, self.balancer.pick())
+
+        # cooled down, only one probe is allowed at a time
+        with mock.patch("time.time", return_value=1037):
+            self.assertIs(self.a, self.balancer.pick())
+            with self.assertRaises(ConnectionError):
+                with self.balancer.track(self.a):
+                    self.assertIs(self.b, self.balancer.pick())
+                    raise ConnectionError("still down")
+
+        # the probe failed, ejected again
+        with mock.patch("time.time", return_value=1050):
+            self.assertIs(self.b, self.balancer.pick())
+
+        # the probe succeeded, recovered
+        self.call(self.b, 1, now=1050)
+        self.assertTrue(self.balancer.status()[1]["healthy"])
+        self.assertEqual(0, self.balancer._stats[id(self.b)].failures)
@@ -0,0 +1,72 @@
+import datetime
+import unittest
+from unittest import mock
+
+import arrow
+import cfg4py
+import omicron
+from omicron.core.timeframe import tf
+from omicron.core.types import FrameType
+
+from omega.core import frames
+from tests import init_test_env
+
+cfg = cfg4py.get_instance()
+
+
+class TestFrames(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        init_test_env()
+        await omicron.init()
+
+    async def asyncTearDown(self) -> None:
+        await omicron.shutdown()
+
+    def test_frame_index(self):
+        for frame_type, start, stop in [
+            (FrameType.DAY, 20200430, 20200515),
+            (FrameType.WEEK, 20200430, 20200522),
+            (FrameType.MIN30, 202004301500, 202005081000),
+            (FrameType.MIN1, 202005061001, 202005071500),
+        ]:
+            s, e = frames.frame_index([start, stop], frame_type)
+            convert = frames.int_to_frame
+            expected = tf.count_frames(
+                convert(start, frame_type), convert(stop, frame_type), frame_type
+            )
+            self.assertEqual(expected, e - s + 1)
+            self.assertListEqual(
+                [start, stop], frames.index_to_frame([s, e], frame_type).tolist()
+            )
+
+    def test_last_closed_frame(self):
+        day = datetime.date(2020, 5, 12)
+        with mock.patch("arrow.now", return_value=arrow.get("2020-05-12 10:00")):
+            self.assertEqual(
+                datetime.date(2020, 5, 11),
+                frames.last_closed_frame(day, FrameType.DAY),
+            )
+
+            # minute frames are closed once they're in the past
+            now = datetime.datetime(2020, 5, 12, 10)
+            self.assertEqual(now, frames.last_closed_frame(now, FrameType.MIN30))
+
+        with mock.patch("arrow.now", return_value=arrow.get("2020-05-12 15:05")):
+            self.assertEqual(day, frames.last_closed_frame(day, FrameType.DAY))
+
+    def test_derived_frames(self):
+        bars = cfg.omega.sync.bars
+        try:
+            cfg.omega.sync.bars = [
+                {"frame": "1m", "resample": ["5m", "30m"]},
+                {"frame": "1d", "resample": ["1w"]},
+                {"frame": "30m", "resample": ["1m"]},
+            ]
+
+            # the invalid one is skipped
+            self.assertListEqual(
+                [FrameType.MIN5, FrameType.MIN30, FrameType.WEEK],
+                frames.derived_frames(),
+            )
+        finally:
+            cfg.omega.sync.bars = bars
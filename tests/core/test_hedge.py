@@ -0,0 +1,116 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from omega.core import metrics
+from omega.core.balancer import Balancer
+from omega.core.hedge import LatencyWindow, RetryBudget
+from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
+
+
+class Fetcher:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+
+    async def get_bars(self, sec: str):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return f"{sec}@{self.delay}"
+
+
+class TestHedge(unittest.TestCase):
+    def test_latency_window(self):
+        window = LatencyWindow(size=100, min_samples=10)
+        for i in range(9):
+            window.add(i)
+        self.assertIsNone(window.quantile(0.95))
+
+        for i in range(9, 200):
+            window.add(i)
+        self.assertAlmostEqual(194.05, window.quantile(0.95))
+
+    def test_retry_budget(self):
+        budget = RetryBudget(ratio=0.1, min_per_sec=0.1, ttl=10)
+        with mock.patch("time.time", return_value=1000):
+            for _ in range(20):
+                budget.deposit()
+
+            # 1 for min_per_sec, 2 for the ratio
+            self.assertListEqual(
+                [True, True, True, False], [budget.withdraw() for _ in range(4)]
+            )
+
+        # all expired
+        with mock.patch("time.time", return_value=1010):
+            self.assertTrue(budget.withdraw())
+            self.assertFalse(budget.withdraw())
+
+
+class TestInvoke(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        metrics._buffer.clear()
+
+        self.params = {
+            "timeout": 0.5,
+            "hedge": True,
+            "hedge_quantile": 0.95,
+            "retry_budget": 0.1,
+        }
+        self.slow, self.fast = Fetcher(5), Fetcher(0.01)
+        self.balancer = Balancer()
+        self.balancer.add(self.slow, "slow")
+        self.balancer.add(self.fast, "fast")
+
+        window = LatencyWindow(min_samples=1)
+        window.add(0.05)
+
+        self.patches = [
+            mock.patch.object(aq, "_balancer", self.balancer),
+            mock.patch.object(aq, "_limiters", {}),
+            mock.patch.object(aq, "_latencies", {"get_bars": window}),
+            mock.patch.object(aq, "_retry_budget", RetryBudget()),
+            mock.patch.object(aq, "_load_upstream_params", return_value=self.params),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self) -> None:
+        for patch in self.patches:
+            patch.stop()
+
+    async def test_hedged(self):
+        # the slow one is picked first since it's never tried, then hedged
+        result = await aq._invoke("get_bars", 1, "000001.XSHE")
+        self.assertEqual("000001.XSHE@0.01", result)
+        self.assertEqual((1, 1), (self.slow.calls, self.fast.calls))
+        self.assertEqual(
+            1, metrics._buffer['omega_upstream_hedged_total{method="get_bars"}']
+        )
+
+        # the loser is cancelled, and not counted as a failure
+        await asyncio.sleep(0.01)
+        self.assertEqual(0, self.balancer.status()[0]["inflight"])
+        self.assertTrue(self.balancer.status()[0]["healthy"])
+
+    async def test_timeout(self):
+        self.params["hedge"] = False
+
+        result = await aq._invoke("get_bars", 1, "000001.XSHE")
+        self.assertEqual("000001.XSHE@0.01", result)
+        self.assertEqual(
+            1, metrics._buffer['omega_upstream_retries_total{method="get_bars"}']
+        )
+
+        # no budget left, no retry
+        with mock.patch.object(aq._retry_budget, "withdraw", return_value=False):
+            self.balancer._stats[id(self.fast)].latency = 100
+            with self.assertRaises(asyncio.TimeoutError):
+                await aq._invoke("get_bars", 1, "000001.XSHE")
+
+        # a single instance is never hedged or retried
+        balancer = Balancer()
+        balancer.add(self.slow, "slow")
+        with mock.patch.object(aq, "_balancer", balancer):
+            with self.assertRaises(asyncio.TimeoutError):
+                await aq._invoke("get_bars", 1, "000001.XSHE")
@@ -0,0 +1,58 @@
+import datetime
+import unittest
+from unittest import mock
+
+import arrow
+import omicron
+from omicron import cache
+from omicron.core.types import FrameType
+
+from omega.core import metrics
+from tests import init_test_env
+
+
+class TestMetrics(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        init_test_env()
+        await omicron.init()
+        await cache.sys.delete(metrics._key_samples, metrics._key_types)
+
+    async def asyncTearDown(self) -> None:
+        await cache.sys.delete(metrics._key_samples, metrics._key_types)
+        await omicron.shutdown()
+
+    async def test_render(self):
+        metrics.inc("unittest_bars_total", 240, frame="1m")
+        metrics.observe("unittest_latency_seconds", 0.3, method="get_bars")
+        await metrics.flush()
+
+        # another process
+        metrics.inc("unittest_bars_total", 10, frame="1m")
+        metrics.observe("unittest_latency_seconds", 2, method="get_bars")
+
+        text = await metrics.render([("unittest_pending", {"frame": "1m"}, 3)])
+        lines = text.split("\n")
+
+        self.assertIn("# TYPE unittest_bars_total counter", lines)
+        self.assertIn('unittest_bars_total{frame="1m"} 250', lines)
+        self.assertIn("# TYPE unittest_latency_seconds histogram", lines)
+        bucket = 'unittest_latency_seconds_bucket{le="%s",method="get_bars"} %s'
+        self.assertIn(bucket % ("0.25", 0), lines)
+        self.assertIn(bucket % ("0.5", 1), lines)
+        self.assertIn(bucket % ("+Inf", 2), lines)
+        self.assertIn('unittest_latency_seconds_sum{method="get_bars"} 2.3', lines)
+        self.assertIn('unittest_pending{frame="1m"} 3', lines)
+
+    async def test_observe_lag(self):
+        now = arrow.get("2020-05-06 10:00:10", tzinfo="Asia/Shanghai")
+        with mock.patch("arrow.now", return_value=now):
+            with mock.patch.object(metrics, "observe") as observe:
+                metrics.observe_lag(FrameType.MIN1, datetime.datetime(2020, 5, 6, 10))
+                self.assertAlmostEqual(10, observe.call_args[0][1])
+
+                # back-filling history bars
+                observe.reset_mock()
+                metrics.observe_lag(
+                    FrameType.MIN1, datetime.datetime(2020, 5, 6, 9, 40)
+                )
+                observe.assert_not_called()
@@ -0,0 +1,96 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+import omicron
+from omicron import cache
+
+from omega.core.ratelimit import TokenBucket
+from tests import init_test_env
+
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        init_test_env()
+        await omicron.init()
+
+        self.bucket = TokenBucket("unittest", rate=10, capacity=100, max_wait=20)
+        await cache.sys.delete(self.bucket.key)
+
+    async def asyncTearDown(self) -> None:
+        await cache.sys.delete(self.bucket.key)
+        await omicron.shutdown()
+
+    async def test_reserve(self):
+        with mock.patch("time.time", return_value=1000):
+            self.assertEqual(0, await self.bucket.reserve(60))
+
+            # waiters are served in the order of reservation
+            self.assertAlmostEqual(2, await self.bucket.reserve(60))
+            self.assertAlmostEqual(8, await self.bucket.reserve(60))
+
+            # too long to wait, and nothing is reserved
+            self.assertAlmostEqual(-28, await self.bucket.reserve(200))
+
+            state = await self.bucket.remaining()
+            self.assertAlmostEqual(-80, state["remaining"])
+            self.assertAlmostEqual(180, state["consumed"])
+            self.assertAlmostEqual(10, state["waited"])
+
+        with mock.patch("time.time", return_value=1100):
+            state = await self.bucket.remaining()
+            self.assertAlmostEqual(100, state["remaining"])
+
+    async def test_acquire(self):
+        with mock.patch("asyncio.sleep") as sleep:
+            self.assertTrue(await self.bucket.acquire(100))
+            sleep.assert_not_called()
+
+            self.assertTrue(await self.bucket.acquire(10))
+            sleep.assert_called_once()
+
+            self.assertFalse(await self.bucket.acquire(1000))
+
+    async def test_take(self):
+        with mock.patch("time.time", return_value=1000):
+            self.assertEqual(0, await self.bucket.take(50, reserve=40))
+
+            # the reserve is kept for others, nothing is taken
+            self.assertAlmostEqual(1, await self.bucket.take(20, reserve=40))
+            state = await self.bucket.remaining()
+            self.assertAlmostEqual(50, state["remaining"])
+
+            # others are not limited by the reserve
+            self.assertEqual(0, await self.bucket.reserve(50))
+
+            # a cost larger than what's above the reserve is taken once it's full
+            self.assertAlmostEqual(10, await self.bucket.take(80, reserve=40))
+
+        with mock.patch("time.time", return_value=1010):
+            self.assertEqual(0, await self.bucket.take(80, reserve=40))
+            state = await self.bucket.remaining()
+            self.assertAlmostEqual(20, state["remaining"])
+            self.assertAlmostEqual(180, state["consumed"])
+
+    async def test_shared_with_reserve(self):
+        """callers with and without reserve never consume more than the rate"""
+        bucket = TokenBucket("unittest", rate=200, capacity=100, max_wait=5)
+        consumed = {"live": 0, "backfill": 0}
+
+        async def consume(name: str, reserve: float):
+            while time.time() < stop:
+                if await bucket.acquire(10, reserve):
+                    consumed[name] += 10
+
+        start = time.time()
+        stop = start + 1
+        await asyncio.gather(consume("live", 0), consume("backfill", 80))
+        elapsed = time.time() - start
+
+        total = consumed["live"] + consumed["backfill"]
+        self.assertLessEqual(total, 100 + 200 * elapsed + 10)
+        self.assertGreater(consumed["live"], consumed["backfill"])
+
+        state = await bucket.remaining()
+        self.assertAlmostEqual(total, state["consumed"])
@@ -0,0 +1,102 @@
+import datetime
+import unittest
+
+import numpy as np
+import omicron
+from omicron.core.timeframe import tf
+from omicron.core.types import FrameType, bars_dtype
+
+from omega.core import resample
+from tests import init_test_env
+
+
+def make_bars(frames, frame_type):
+    bars = np.empty(len(frames), dtype=bars_dtype)
+    convert = tf.int2time if frame_type in tf.minute_level_frames else tf.int2date
+    bars["frame"] = [convert(frame) for frame in frames]
+
+    rng = np.arange(len(frames), dtype=np.float64)
+    bars["open"] = rng
+    bars["close"] = rng + 0.5
+    bars["high"] = rng + 1
+    bars["low"] = rng - 1
+    bars["volume"] = 100
+    bars["amount"] = 1000
+    bars["factor"] = 1
+
+    return bars
+
+
+class TestResample(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        init_test_env()
+        await omicron.init()
+
+    async def asyncTearDown(self) -> None:
+        await omicron.shutdown()
+
+    def test_check_resample(self):
+        resample.check_resample(FrameType.MIN1, FrameType.MIN30)
+        resample.check_resample(FrameType.MIN5, FrameType.MIN15)
+        resample.check_resample(FrameType.DAY, FrameType.MONTH)
+
+        for from_frame, to_frame in [
+            (FrameType.MIN30, FrameType.MIN1),
+            (FrameType.MIN1, FrameType.DAY),
+            (FrameType.WEEK, FrameType.MONTH),
+        ]:
+            with self.assertRaises(ValueError):
+                resample.check_resample(from_frame, to_frame)
+
+    def test_resample_minutes(self):
+        # 2020-05-06 09:31 ~ 10:40, the 10:30 ~ 10:40 bars are incomplete
+        frames = tf.get_frames(
+            datetime.datetime(2020, 5, 6, 9, 31),
+            datetime.datetime(2020, 5, 6, 10, 40),
+            FrameType.MIN1,
+        )
+        bars = make_bars(frames, FrameType.MIN1)
+
+        # ex-right at 09:34, and the security is halted at 09:38
+        bars["factor"][3:] = 2
+        for name in ["open", "high", "low", "close", "volume", "amount"]:
+            bars[name][7] = np.nan
+
+        actual = resample.resample(bars, FrameType.MIN1, FrameType.MIN5)
+        self.assertEqual(14, len(actual))
+        self.assertEqual(datetime.datetime(2020, 5, 6, 9, 35), actual["frame"][0])
+        self.assertListEqual(
+            [0, 5, -0.5, 4.5, 500, 5000, 2], list(actual[0].tolist())[1:]
+        )
+        self.assertEqual(400, actual["volume"][1])
+
+        # the first bar of 10:00 (09:31) is missing
+        actual = resample.resample(bars[1:], FrameType.MIN1, FrameType.MIN30)
+        self.assertEqual(1, len(actual))
+        self.assertEqual(datetime.datetime(2020, 5, 6, 10, 30), actual["frame"][0])
+        self.assertAlmostEqual(59.5, actual["close"][0])
+
+    def test_resample_days(self):
+        # the week ends at 20200508 has 3 trade days only
+        frames = tf.get_frames(
+            datetime.date(2020, 5, 6), datetime.date(2020, 5, 19), FrameType.DAY
+        )
+        bars = make_bars(frames, FrameType.DAY)
+
+        actual = resample.resample(bars, FrameType.DAY, FrameType.WEEK)
+        self.assertListEqual(
+            [datetime.date(2020, 5, 8), datetime.date(2020, 5, 15)],
+            actual["frame"].tolist(),
+        )
+        self.assertListEqual([0, 3], actual["open"].tolist())
+        self.assertListEqual([2.5, 7.5], actual["close"].tolist())
+        self.assertListEqual([300, 500], actual["volume"].tolist())
+
+        self.assertEqual(
+            0, len(resample.resample(bars, FrameType.DAY, FrameType.MONTH))
+        )
+
+    def test_max_group_size(self):
+        self.assertEqual(60, resample.max_group_size(FrameType.MIN1, FrameType.MIN60))
+        self.assertEqual(3, resample.max_group_size(FrameType.MIN5, FrameType.MIN15))
+        self.assertEqual(5, resample.max_group_size(FrameType.DAY, FrameType.WEEK))
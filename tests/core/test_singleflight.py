@@ -0,0 +1,94 @@
+import asyncio
+import unittest
+
+from omega.core import metrics
+from omega.core.singleflight import single_flight
+
+
+class Fetcher:
+    calls = 0
+
+    @classmethod
+    @single_flight("unittest")
+    async def get_bars(cls, secs, n: int, fail: bool = False):
+        cls.calls += 1
+        await asyncio.sleep(0.05)
+        if fail:
+            raise ValueError("upstream error")
+
+        return [f"{sec}:{n}" for sec in secs]
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        Fetcher.calls = 0
+        metrics._buffer.clear()
+
+    async def test_single_flight(self):
+        results = await asyncio.gather(
+            Fetcher.get_bars(["000001.XSHE"], 10),
+            Fetcher.get_bars(["000001.XSHE"], n=10),
+            Fetcher.get_bars(["000001.XSHE"], 10, False),
+            Fetcher.get_bars(["000001.XSHE"], 20),
+        )
+
+        self.assertEqual(2, Fetcher.calls)
+        self.assertListEqual(["000001.XSHE:10"], results[0])
+        self.assertIs(results[0], results[1])
+        self.assertIs(results[0], results[2])
+        self.assertListEqual(["000001.XSHE:20"], results[3])
+
+        labels = '{method="unittest"}'
+        requests = metrics._buffer[f"omega_singleflight_requests_total{labels}"]
+        shared = metrics._buffer[f"omega_singleflight_shared_total{labels}"]
+        self.assertEqual((4, 2), (requests, shared))
+
+        # nothing is kept once done
+        await Fetcher.get_bars(["000001.XSHE"], 10)
+        self.assertEqual(3, Fetcher.calls)
+        self.assertEqual(0, len(Fetcher.get_bars.flight._calls))
+
+    async def test_errors(self):
+        results = await asyncio.gather(
+            Fetcher.get_bars(["000001.XSHE"], 10, True),
+            Fetcher.get_bars(["000001.XSHE"], 10, True),
+            return_exceptions=True,
+        )
+        self.assertEqual(1, Fetcher.calls)
+        self.assertTrue(all(isinstance(e, ValueError) for e in results))
+
+        # a cancelled waiter doesn't cancel the call it's waiting for
+        leader = asyncio.create_task(Fetcher.get_bars(["000001.XSHE"], 10))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(Fetcher.get_bars(["000001.XSHE"], 10))
+        await asyncio.sleep(0)
+        waiter.cancel()
+
+        self.assertListEqual(["000001.XSHE:10"], await leader)
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+
+    async def test_cancel_leader(self):
+        # the follower still gets the result when the leader is cancelled
+        leader = asyncio.create_task(Fetcher.get_bars(["000001.XSHE"], 10))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(Fetcher.get_bars(["000001.XSHE"], 10))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        self.assertListEqual(["000001.XSHE:10"], await follower)
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+        self.assertEqual(1, Fetcher.calls)
+
+        # the call is cancelled once nobody is waiting for it
+        leader = asyncio.create_task(Fetcher.get_bars(["000001.XSHE"], 20))
+        await asyncio.sleep(0)
+        call = Fetcher.get_bars.flight._calls[(Fetcher, ("000001.XSHE",), 20, False)]
+        leader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+
+        await asyncio.sleep(0)
+        self.assertTrue(call.task.cancelled())
+        self.assertEqual(0, len(Fetcher.get_bars.flight._calls))
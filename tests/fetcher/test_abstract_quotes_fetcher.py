@@ -2,6 +2,7 @@ import datetime
 import logging
 import os
 import unittest
+from unittest import mock
 
 import arrow
 import cfg4py
@@ -11,6 +12,7 @@ from omicron import cache
 from omicron.core.timeframe import tf
 from omicron.core.types import FrameType
 
+from omega.core.events import Events
 from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
 from tests import init_test_env
 
@@ -43,8 +45,64 @@ class TestAbstractQuotesFetcher(unittest.IsolatedAsyncioTestCase):
         await cache.security.delete(f"{sec}:{frame_type.value}")
 
     async def test_get_security_list(self):
-        secs = await aq.get_security_list()
-        self.assertEqual("000001.XSHE", secs[0][0])
+        await cache.security.delete("securities")
+        emit = "omega.fetcher.abstract_quotes_fetcher.emit.emit"
+        with mock.patch(emit) as emitted:
+            secs = await aq.get_security_list()
+            self.assertEqual("000001.XSHE", secs[0][0])
+
+            # the list is saved through update_security_list, other processes are
+            # notified of the change
+            self.assertEqual(len(secs), await cache.security.llen("securities"))
+            emitted.assert_awaited_once()
+            self.assertEqual(Events.SECURITY_LIST_UPDATED, emitted.call_args[0][0])
+
+    @mock.patch("omega.fetcher.abstract_quotes_fetcher.emit.emit")
+    async def test_update_security_list(self, emitted):
+        await cache.security.delete(
+            "securities", "securities.snapshot", "securities.version"
+        )
+        changes = await aq.update_security_list()
+        self.assertTrue(changes["changed"])
+        self.assertEqual(1, changes["version"])
+        self.assertEqual(changes["count"], len(changes["added"]))
+        self.assertEqual(changes["count"], await cache.security.llen("securities"))
+
+        snapshot = await aq.load_security_snapshot()
+        self.assertEqual(changes["count"], len(snapshot))
+        self.assertEqual("000001.XSHE", snapshot[0]["code"])
+        self.assertEqual(19910403, snapshot[0]["ipo"])
+
+        # nothing changed, nothing is written
+        changes = await aq.update_security_list()
+        self.assertFalse(changes["changed"])
+        self.assertEqual(1, emitted.call_count)
+        self.assertEqual(1, changes["version"])
+        self.assertListEqual([], changes["added"])
+
+    def test_diff_security_list(self):
+        from omega.fetcher.abstract_quotes_fetcher import _diff_security_list
+
+        old = [
+            "000001.XSHE,平安银行,PAYH,1991-04-03,2200-01-01,stock",
+            "000002.XSHE,万科A,WKA,1991-01-29,2200-01-01,stock",
+            "000003.XSHE,PT金田A,PTJTA,1991-07-03,2200-01-01,stock",
+        ]
+        new = [
+            "000001.XSHE,平安银行,PAYH,1991-04-03,2200-01-01,stock",
+            "000002.XSHE,万科B,WKB,1991-01-29,2200-01-01,stock",
+            "000003.XSHE,PT金田A,PTJTA,1991-07-03,2002-06-14,stock",
+            "000004.XSHE,国华网安,GHWA,1990-12-01,2200-01-01,stock",
+        ]
+        changes = _diff_security_list(old, new)
+        self.assertEqual(4, changes["count"])
+        self.assertListEqual(["000004.XSHE"], changes["added"])
+        self.assertListEqual([], changes["removed"])
+        self.assertListEqual(["000003.XSHE"], changes["delisted"])
+        self.assertListEqual(["000002.XSHE"], changes["renamed"])
+
+        changes = _diff_security_list(new, old)
+        self.assertListEqual(["000004.XSHE"], changes["removed"])
 
     async def test_get_bars_010(self):
         """日线级别, 无停牌"""
@@ -222,6 +280,36 @@ class TestAbstractQuotesFetcher(unittest.IsolatedAsyncioTestCase):
         bars = await aq.get_bars(sec, end, 1, frame_type, include_unclosed=False)
         self.assertIsNone(bars)
 
+    async def test_get_bars_read_through(self):
+        sec = "000001.XSHE"
+        frame_type = FrameType.DAY
+        end = datetime.date(2020, 4, 3)
+
+        await self.clear_cache(sec, frame_type)
+        expected = await aq.get_bars(sec, end, 20, frame_type)
+
+        # only [2020-03-16, 2020-03-27] is cached
+        await self.clear_cache(sec, frame_type)
+        await aq.get_bars(sec, datetime.date(2020, 3, 27), 10, frame_type)
+
+        invoke = aq._invoke
+        with mock.patch.object(aq, "_invoke", side_effect=invoke) as upstream:
+            bars = await aq.get_bars(sec, end, 20, frame_type, read_through=True)
+
+        # 6 bars after the tail, 5 bars before the head, the others are from cache
+        self.assertListEqual([6, 5], [c.args[1] for c in upstream.call_args_list])
+        self.assertListEqual(expected["frame"].tolist(), bars["frame"].tolist())
+        np.testing.assert_array_almost_equal(expected["close"], bars["close"], 2)
+
+        head, tail = await cache.get_bars_range(sec, frame_type)
+        self.assertEqual(expected["frame"][0], head)
+        self.assertEqual(end, tail)
+
+        # nothing cached
+        await self.clear_cache(sec, frame_type)
+        bars = await aq.get_bars(sec, end, 20, frame_type, read_through=True)
+        self.assertListEqual(expected["frame"].tolist(), bars["frame"].tolist())
+
     async def test_get_valuation(self):
         secs = ["000001.XSHE", "600000.XSHG"]
         date = arrow.get("2020-10-26").date()
@@ -241,11 +329,65 @@ class TestAbstractQuotesFetcher(unittest.IsolatedAsyncioTestCase):
         end_dt = arrow.get("2020-11-01").date()
         frame_type = FrameType.DAY
 
-        bars = await aq.get_bars_batch(secs, end_dt, 5, frame_type)
+        for sec in secs:
+            await self.clear_cache(sec, frame_type)
+
+        # one pipeline for each security
+        with mock.patch("omega.fetcher.abstract_quotes_fetcher._SAVE_CHUNK", 5):
+            bars = await aq.get_bars_batch(secs, end_dt, 5, frame_type)
         self.assertSetEqual(set(secs), set(bars.keys()))
         self.assertEqual(5, len(bars["000001.XSHE"]))
         self.assertAlmostEqual(18.2, bars["000001.XSHE"]["open"][0], places=2)
 
+        # the closed bars are cached
+        for sec in secs:
+            head, tail = await cache.get_bars_range(sec, frame_type)
+            self.assertEqual(bars[sec]["frame"][0], head)
+            self.assertEqual(datetime.date(2020, 10, 30), tail)
+
+        # not cached if persist is False
+        await self.clear_cache(secs[0], frame_type)
+        await aq.get_bars_batch(secs[:1], end_dt, 5, frame_type, persist=False)
+        self.assertEqual((None, None), await cache.get_bars_range(secs[0], frame_type))
+
+    async def test_get_price(self):
+        secs = ["000001.XSHE", "000001.XSHG"]
+        end_dt = arrow.get("2020-11-01").date()
+        frame_type = FrameType.DAY
+
+        for sec in secs:
+            await self.clear_cache(sec, frame_type)
+
+        with self.assertRaises(ValueError):
+            async for _ in aq.get_price(secs, end_dt, frame_type=frame_type):
+                pass
+
+        # 2 secs, 4 bars each per request: windows of 4, 4 and 2 bars
+        windows = []
+        async for code, bars in aq.get_price(
+            secs, end_dt, 10, frame_type, include_unclosed=False, chunk=8
+        ):
+            windows.append((code, len(bars), bars["frame"][-1]))
+
+        self.assertListEqual([4, 4, 4, 4, 2, 2], [n for _, n, _ in windows])
+        self.assertEqual(datetime.date(2020, 10, 30), windows[0][2])
+
+        # the latest window comes first, and all of them are cached
+        expected = await aq.get_bars(secs[0], end_dt, 10, frame_type, False)
+        for sec in secs:
+            head, tail = await cache.get_bars_range(sec, frame_type)
+            self.assertEqual(expected["frame"][0], head)
+            self.assertEqual(datetime.date(2020, 10, 30), tail)
+
+        # same as the range
+        start = expected["frame"][0]
+        frames = []
+        async for code, bars in aq.get_price(
+            secs[0], end_dt, None, frame_type, start, False, persist=False
+        ):
+            frames = list(bars["frame"]) + frames
+        self.assertListEqual(list(expected["frame"]), frames)
+
     async def test_get_all_trade_days(self):
         days = await aq.get_all_trade_days()
         self.assertIn(datetime.date(2020, 12, 31), days)
@@ -1,3 +1,4 @@
+import json
 import logging
 
 from omega import __version__
@@ -10,3 +11,15 @@ class TestSys(TestWebInterfaces):
     async def test_sever_version(self):
         ver = await self.server_get("sys", "version", is_pickled=False)
         self.assertEqual(__version__, ver)
+
+    async def test_metrics(self):
+        text = await self.server_get("sys", "metrics", is_pickled=False)
+        self.assertIn("# TYPE omega_sync_queue_pending gauge", text)
+        self.assertIn('omega_sync_queue_leased{frame="1m"}', text)
+        self.assertIn("# TYPE omega_upstream_healthy gauge", text)
+
+    async def test_upstreams(self):
+        text = await self.server_get("sys", "upstreams", is_pickled=False)
+        upstreams = json.loads(text)
+        self.assertEqual(1, len(upstreams))
+        self.assertTrue(all(x["healthy"] for x in upstreams))
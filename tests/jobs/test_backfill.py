@@ -0,0 +1,119 @@
+import datetime
+import unittest
+from unittest import mock
+
+import cfg4py
+import omicron
+from omicron import cache
+from omicron.core.types import FrameType
+
+from omega.core.ratelimit import TokenBucket
+from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
+from omega.jobs import backfill
+from omega.jobs.planner import encode_job
+from omega.jobs.sharding import ShardedWorkQueue
+from tests import init_test_env
+
+cfg = cfg4py.get_instance()
+
+
+class TestBackfill(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        init_test_env()
+
+        fetcher_info = cfg.quotes_fetchers[0]
+        await aq.create_instance(fetcher_info["impl"], **fetcher_info["workers"][0])
+        await omicron.init(aq)
+
+        self.code = "000001.XSHE"
+        self.key = f"{self.code}:1d"
+        await cache.security.delete(self.key)
+        await cache.sys.delete("jobs.backfill.progress.1d", "jobs.backfill.failures.1d")
+
+    async def asyncTearDown(self) -> None:
+        await omicron.shutdown()
+
+    def test_pause_seconds(self):
+        bars = cfg.omega.sync.bars
+        try:
+            cfg.omega.sync.bars = [{"frame": "30m", "delay": 5}, {"frame": "1d"}]
+
+            # 10:00 frame is synced at 10:00:05
+            now = datetime.datetime(2020, 1, 6, 10, 0, 3)
+            self.assertEqual(62, backfill.pause_seconds(now, (10, 60)))
+
+            now = datetime.datetime(2020, 1, 6, 10, 5)
+            self.assertEqual(0, backfill.pause_seconds(now, (10, 60)))
+
+            # not a trade day
+            now = datetime.datetime(2020, 1, 4, 10, 0, 3)
+            self.assertEqual(0, backfill.pause_seconds(now, (10, 60)))
+        finally:
+            cfg.omega.sync.bars = bars
+
+    async def test_backfill_chunk(self):
+        """
+        trade days:
+        20200430, 20200506, 20200507, 20200508, 20200511, 20200512,
+        20200513, 20200514, 20200515, 20200518, 20200519, 20200520,
+        """
+        job = encode_job(self.code, 20200506, 20200515, 8)
+
+        # the latest chunk first, then backward, so every chunk can be saved
+        for remaining, head in [(5, 20200513), (2, 20200508), (0, 20200506)]:
+            actual = await backfill.backfill_chunk(job, FrameType.DAY, 3)
+            self.assertEqual(remaining, actual)
+            self.assertEqual(str(head), await cache.security.hget(self.key, "head"))
+
+        self.assertEqual("20200515", await cache.security.hget(self.key, "tail"))
+        self.assertDictEqual({self.code: 0}, await backfill.get_progress(FrameType.DAY))
+
+    async def test_backfill_bars(self):
+        queue = ShardedWorkQueue("jobs.backfill.scope.1d")
+        await queue.reset([encode_job(self.code, 20200506, 20200515, 8)], [])
+
+        with mock.patch("omega.jobs.backfill._wait_for_live_sync") as wait:
+            await backfill.backfill_bars({"frame_type": FrameType.DAY, "chunk": 3})
+
+        # checked before every claim, including the last one that gets nothing
+        self.assertEqual(4, wait.call_count)
+        self.assertEqual((0, 0), await queue.size())
+        self.assertDictEqual({self.code: 0}, await backfill.get_progress(FrameType.DAY))
+
+    async def test_backfill_quota(self):
+        queue = ShardedWorkQueue("jobs.backfill.scope.1d")
+        await queue.reset([encode_job(self.code, 20200506, 20200515, 8)], [])
+
+        bucket = TokenBucket("unittest.backfill", rate=1000, capacity=1000)
+        await cache.sys.delete(bucket.key)
+        limiters = {id(x): bucket for x in aq._balancer._instances}
+
+        acquire = mock.patch.object(bucket, "acquire", wraps=bucket.acquire)
+        with mock.patch.object(aq, "_limiters", limiters), acquire as acquired:
+            with mock.patch("omega.jobs.backfill._wait_for_live_sync"):
+                params = {"frame_type": FrameType.DAY, "chunk": 3, "quota_share": 0.2}
+                await backfill.backfill_bars(params)
+
+        # every chunk is charged once, on the account's bucket, keeping 80% of it for
+        # the live sync
+        self.assertEqual(3, acquired.await_count)
+        for call in acquired.await_args_list:
+            self.assertAlmostEqual(800, call.args[1])
+        self.assertListEqual([], await cache.sys.keys("ratelimit.*.backfill"))
+
+    async def test_backfill_bars_failed(self):
+        queue = ShardedWorkQueue("jobs.backfill.scope.1d")
+        await queue.reset([encode_job(self.code, 20200506, 20200515, 8)], [])
+        await cache.sys.hset("jobs.backfill.progress.1d", self.code, 8)
+
+        chunk = mock.patch(
+            "omega.jobs.backfill.backfill_chunk", side_effect=ValueError("oops")
+        )
+        with mock.patch("omega.jobs.backfill._wait_for_live_sync"), chunk as failed:
+            await backfill.backfill_bars({"frame_type": FrameType.DAY, "chunk": 3})
+
+        # retried before giving up, the progress is kept as is
+        self.assertEqual(3, failed.call_count)
+        self.assertEqual((0, 0), await queue.size())
+        self.assertDictEqual({self.code: 8}, await backfill.get_progress(FrameType.DAY))
+        self.assertListEqual([self.code], await backfill.get_failed(FrameType.DAY))
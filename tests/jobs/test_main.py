@@ -88,7 +88,7 @@ class TestJobsMain(unittest.IsolatedAsyncioTestCase):
             # disable init, just use cfg here
             with mock.patch("cfg4py.init"):
                 await init(None, None)
-                # won't trigger sync this time
+                # resume jobs are scheduled, they decide whether to sync when run
                 await init(None, None)
         finally:
             # cfg.omega.sync.bars = origin
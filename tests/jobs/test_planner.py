@@ -0,0 +1,172 @@
+import datetime
+import io
+import unittest
+from unittest import mock
+
+import arrow
+import cfg4py
+import numpy as np
+import omicron
+from omicron import cache
+from omicron.core.timeframe import tf
+from omicron.core.types import FrameType, bars_dtype
+
+from omega.core.suspension import save_suspensions
+from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
+from omega.fetcher.abstract_quotes_fetcher import _encode_security_list
+from omega.jobs import planner
+from tests import init_test_env
+
+cfg = cfg4py.get_instance()
+
+
+class TestPlanner(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        init_test_env()
+        await omicron.init()
+
+    async def asyncTearDown(self) -> None:
+        await omicron.shutdown()
+
+    def test_compute_windows(self):
+        """
+        trade days:
+        20200430, 20200506, 20200507, 20200508, 20200511, 20200512,
+        20200513, 20200514, 20200515, 20200518
+        """
+        heads = [0, 20200507, 20200506, 20200511]
+        tails = [0, 20200512, 20200518, 20200514]
+
+        pos, starts, stops, counts = planner.compute_windows(
+            heads, tails, 20200506, 20200515, FrameType.DAY
+        )
+
+        self.assertListEqual([0, 1, 1, 3, 3], pos.tolist())
+        self.assertListEqual(
+            [20200506, 20200506, 20200513, 20200506, 20200515], starts.tolist()
+        )
+        self.assertListEqual(
+            [20200515, 20200506, 20200515, 20200508, 20200515], stops.tolist()
+        )
+        self.assertListEqual([8, 1, 3, 3, 1], counts.tolist())
+
+    def test_clip_jobs(self):
+        jobs = [
+            "000001.XSHE,20200506,20200515,8",
+            "000001.XSHG,20200511,20200512,2",
+            "600000.XSHG,20200506,20200508,3",
+        ]
+        inflight = [
+            "000001.XSHE,20200506,20200508,3",
+            "000001.XSHG,20200511,20200514,4",
+        ]
+
+        self.assertListEqual(
+            ["000001.XSHE,20200511,20200515,5", "600000.XSHG,20200506,20200508,3"],
+            planner.clip_jobs(jobs, inflight, FrameType.DAY),
+        )
+
+    async def test_plan_bars_sync(self):
+        frame_type = FrameType.DAY
+        codes = ["000001.XSHE", "000001.XSHG"]
+        await cache.security.delete("000001.XSHE:1d")
+        await cache.set_bars_range(
+            "000001.XSHG",
+            frame_type,
+            datetime.date(2020, 5, 6),
+            datetime.date(2020, 5, 15),
+        )
+
+        start = arrow.get("2020-05-06").date()
+        stop = arrow.get("2020-05-15").date()
+        jobs = await planner.plan_bars_sync(codes, frame_type, start, stop)
+        self.assertListEqual(["000001.XSHE,20200506,20200515,8"], jobs)
+
+        code, w_start, w_stop, n = planner.decode_job(jobs[0], frame_type)
+        self.assertEqual(start, w_start)
+        self.assertEqual(stop, w_stop)
+
+    async def test_listing_bounds(self):
+        """
+        trade days:
+        20200430, 20200506, 20200507, 20200508, 20200511, 20200512,
+        20200513, 20200514, 20200515, 20200518
+        """
+        secs = [
+            "000001.XSHE,平安银行,PAYH,2020-05-09,2200-01-01,stock",
+            "000002.XSHE,万科A,WKA,1991-01-01,2020-05-12,stock",
+        ]
+        codes = ["000001.XSHE", "000002.XSHE", "000001.XSHG"]
+        get_securities = mock.AsyncMock(return_value=secs)
+        planner.reset_listing()
+        self.addCleanup(planner.reset_listing)
+        with mock.patch.object(
+            cache, "get_securities", get_securities
+        ), mock.patch.object(aq, "load_security_snapshot", return_value=None):
+            lo, hi = await planner.listing_bounds(codes, FrameType.DAY)
+            # listed before the calendar starts
+            self.assertListEqual([20200511, tf.day_frames[0], 0], lo.tolist())
+            self.assertEqual(20200512, hi[1])
+            self.assertEqual(np.iinfo(np.int64).max, hi[2])
+
+            lo, hi = await planner.listing_bounds(codes, FrameType.MIN30)
+            self.assertEqual(202005111000, lo[0])
+            self.assertEqual(202005121500, hi[1])
+
+            # not listed yet, delisted, and no restriction
+            lo, hi = await planner.listing_bounds(codes, FrameType.DAY)
+            pos, starts, stops, _ = planner.compute_windows(
+                [0, 0, 0],
+                [0, 0, 0],
+                np.maximum(20200506, lo),
+                np.minimum(20200515, hi),
+                FrameType.DAY,
+            )
+            self.assertListEqual([0, 1, 2], pos.tolist())
+            self.assertListEqual([20200511, 20200506, 20200506], starts.tolist())
+            self.assertListEqual([20200515, 20200512, 20200515], stops.tolist())
+
+        # the security list is read only once, until it's updated
+        get_securities.assert_awaited_once()
+
+        # the snapshot is preferred over the list
+        snapshot = np.load(io.BytesIO(_encode_security_list(secs)))
+        planner.reset_listing()
+        with mock.patch.object(
+            cache, "get_securities", get_securities
+        ), mock.patch.object(aq, "load_security_snapshot", return_value=snapshot):
+            lo, hi = await planner.listing_bounds(codes, FrameType.DAY)
+            self.assertListEqual([20200511, tf.day_frames[0], 0], lo.tolist())
+            self.assertEqual(20200512, hi[1])
+
+        get_securities.assert_awaited_once()
+
+    async def test_split_suspended(self):
+        code = "000001.XSHE"
+        await cache.security.delete(f"{code}:suspended")
+
+        bars = np.empty(3, dtype=bars_dtype)
+        bars["frame"] = [datetime.date(2020, 5, d) for d in (11, 12, 13)]
+        bars["close"] = [np.nan, np.nan, 10.0]
+        await save_suspensions({code: bars})
+
+        jobs = [
+            f"{code},202005111000,202005121500,16",
+            f"{code},202005121000,202005131500,16",
+        ]
+        self.assertTupleEqual(
+            (jobs[1:], jobs[:1]), await planner.split_suspended(jobs, FrameType.MIN30)
+        )
+
+        # resumed after data is corrected
+        bars["close"] = 10.0
+        await save_suspensions({code: bars})
+        self.assertTupleEqual(
+            (jobs, []), await planner.split_suspended(jobs, FrameType.MIN30)
+        )
+
+        # day level jobs always go to upstream
+        day_jobs = [f"{code},20200511,20200512,2"]
+        self.assertTupleEqual(
+            (day_jobs, []), await planner.split_suspended(day_jobs, FrameType.DAY)
+        )
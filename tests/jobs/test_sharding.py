@@ -0,0 +1,108 @@
+import time
+import unittest
+
+import omicron
+from omicron import cache
+
+from omega.jobs.sharding import FETCHERS, HashRing, ShardedWorkQueue, live_fetchers
+from tests import init_test_env
+
+
+class TestHashRing(unittest.TestCase):
+    def test_assign(self):
+        codes = [f"{i:06d}.XSHE" for i in range(1000)]
+
+        ring = HashRing(["1", "2", "3"])
+        groups = ring.assign([f"{code},20200102,20200103,2" for code in codes])
+        self.assertEqual(1000, sum(len(jobs) for jobs in groups.values()))
+        for jobs in groups.values():
+            self.assertGreater(len(jobs), 200)
+
+        # the assignment is sticky
+        self.assertListEqual(
+            [ring.get(code) for code in codes],
+            [HashRing(["3", "2", "1"]).get(code) for code in codes],
+        )
+
+        # only the codes of the leaving node are moved
+        shrunk = HashRing(["1", "2"])
+        for code in codes:
+            if ring.get(code) != "3":
+                self.assertEqual(ring.get(code), shrunk.get(code))
+
+        with self.assertRaises(ValueError):
+            HashRing([])
+
+
+class TestShardedWorkQueue(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        init_test_env()
+        await omicron.init()
+
+        self.codes = [f"{i:06d}.XSHE" for i in range(20)]
+        self.ring = HashRing(["1", "2"])
+        self.q1 = ShardedWorkQueue("unittest.sharded", lease=10, shard="1")
+        self.q2 = ShardedWorkQueue("unittest.sharded", lease=10, shard="2")
+        await self.q1.reset(self.codes, ["1", "2"])
+
+    async def asyncTearDown(self) -> None:
+        await self.q1.reset([], ["1", "2"])
+        await cache.sys.delete(self.q1.key_shards)
+        await omicron.shutdown()
+
+    async def test_claim(self):
+        mine = [code for code in self.codes if self.ring.get(code) == "1"]
+        theirs = [code for code in self.codes if self.ring.get(code) == "2"]
+
+        claimed = await self.q1.claim(len(mine))
+        self.assertListEqual(mine, claimed)
+        self.assertEqual((len(theirs), len(mine)), await self.q1.size())
+
+        # own shard is drained, steal from the tail of the other one
+        stolen = await self.q1.claim(2)
+        self.assertListEqual(theirs[-2:], stolen)
+
+        # the owner still claims from the head
+        self.assertListEqual(theirs[:1], await self.q2.claim(1))
+
+        await self.q1.ack(*claimed)
+        await self.q1.release(*stolen)
+        self.assertEqual((len(theirs) - 1, 1), await self.q1.size())
+        self.assertEqual(1, len(await self.q1.leased()))
+
+    async def test_merge(self):
+        # nobody is working
+        self.assertIsNone(await self.q1.merge(["000100.XSHE"], ["1", "2", "3"]))
+
+        await self.q1.claim(1)
+        self.assertEqual(0, await self.q1.merge(["000100.XSHE"], ["1", "2", "3"]))
+        self.assertIn("3", await self.q1.shards())
+        self.assertEqual((len(self.codes), 1), await self.q1.size())
+
+    async def test_items(self):
+        claimed = await self.q1.claim(2)
+        self.assertSetEqual(set(self.codes), set(await self.q2.items()))
+
+        await self.q1.ack(*claimed)
+        self.assertSetEqual(set(self.codes) - set(claimed), set(await self.q2.items()))
+
+
+class TestLiveFetchers(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        init_test_env()
+        await omicron.init()
+
+    async def asyncTearDown(self) -> None:
+        await cache.sys.delete(FETCHERS)
+        await omicron.shutdown()
+
+    async def test_live_fetchers(self):
+        now = time.time()
+        await cache.sys.delete(FETCHERS)
+        await cache.sys.zadd(FETCHERS, now, "1", now - 60, "2", now - 7200, "3")
+
+        self.assertListEqual(["1"], await live_fetchers())
+        self.assertListEqual(["1", "2"], await live_fetchers(timeout=120))
+
+        # long gone fetchers are removed from the registry
+        self.assertListEqual(["1", "2"], await cache.sys.zrange(FETCHERS))
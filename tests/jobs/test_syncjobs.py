@@ -25,6 +25,7 @@ import omega.jobs.syncjobs as syncjobs
 from omega.core.events import Events, ValidationError
 from omega.fetcher import archive
 from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
+from omega.jobs.sharding import UNASSIGNED
 from tests import init_test_env, start_archive_server, start_omega
 
 logger = logging.getLogger(__name__)
@@ -51,12 +52,6 @@ class TestSyncJobs(unittest.IsolatedAsyncioTestCase):
         params = fetcher_info["workers"][0]
         await aq.create_instance(impl, **params)
 
-    async def test_job_timer(self):
-        await syncjobs._start_job_timer("unittest")
-        await asyncio.sleep(5)
-        elapsed = await syncjobs._stop_job_timer("unittest")
-        self.assertTrue(5 <= elapsed <= 7)
-
     async def test_load_sync_params(self):
         expected = [
             {
@@ -93,33 +88,379 @@ class TestSyncJobs(unittest.IsolatedAsyncioTestCase):
             sync_request.append(params)
 
         emit.register(Events.OMEGA_DO_SYNC, on_sync_bars)
+
+        # no sync signal if all secs are up to date
+        plan = mock.AsyncMock(return_value=[])
+        with mock.patch("omega.jobs.syncjobs.plan_bars_sync", plan):
+            with mock.patch("arrow.now", return_value=arrow.get("2020-1-6 10:00")):
+                await syncjobs.trigger_bars_sync(sync_params, force=True)
+
+        await asyncio.sleep(0.2)
+        self.assertEqual(0, len(sync_request))
+
         with mock.patch("arrow.now", return_value=arrow.get("2020-1-6 10:00")):
+            await cache.security.delete("000004.XSHE:1d")
             await syncjobs.trigger_bars_sync(sync_params, force=True)
 
         await asyncio.sleep(0.2)
+        self.assertIsNotNone(sync_request[0].pop("run"))
         self.assertDictEqual(
             {
                 "start": arrow.get("2019-12-31").date(),
                 "stop": arrow.get("2020-1-3").date(),
                 "frame_type": FrameType.DAY,
+                "batch": 0,
+                "concurrency": 1,
+                "resample": [],
             },
             sync_request[0],
         )
 
         sync_request = []
         with mock.patch("arrow.now", return_value=arrow.get("2020-1-6 15:00")):
+            await cache.security.delete("000004.XSHE:1d")
             await syncjobs.trigger_bars_sync(sync_params, force=True)
 
             await asyncio.sleep(0.2)
+            self.assertIsNotNone(sync_request[0].pop("run"))
             self.assertDictEqual(
                 {
                     "start": arrow.get("2019-12-31").date(),
                     "stop": arrow.get("2020-1-6").date(),
                     "frame_type": FrameType.DAY,
+                    "batch": 0,
+                    "concurrency": 1,
+                    "resample": [],
                 },
                 sync_request[0],
             )
 
+    async def test_trigger_bars_sync_coalescing(self):
+        sync_params = {
+            "frame": "1d",
+            "start": "2020-01-01",
+            "cat": [],
+            "include": "000001.XSHE 000004.XSHE",
+        }
+
+        sync_request = []
+
+        async def on_sync_bars(params: dict):
+            sync_request.append(params)
+
+        emit.register(Events.OMEGA_DO_SYNC, on_sync_bars)
+
+        # no fetcher is alive, so all jobs go to the unassigned shard
+        queue = syncjobs.ShardedWorkQueue("jobs.bars_sync.scope.1d", shard=UNASSIGNED)
+        key_run = "jobs.bars_sync.run.1d"
+        for code in ["000001.XSHE", "000004.XSHE"]:
+            await cache.security.delete(f"{code}:1d")
+
+        fetchers = mock.patch(
+            "omega.jobs.syncjobs.live_fetchers", mock.AsyncMock(return_value=[])
+        )
+        fetchers.start()
+        self.addCleanup(fetchers.stop)
+
+        with mock.patch("arrow.now", return_value=arrow.get("2020-1-6 10:00")):
+            await syncjobs.trigger_bars_sync(sync_params, force=True)
+        await asyncio.sleep(0.2)
+        self.assertEqual(1, len(sync_request))
+        run = sync_request[0]["run"]
+
+        # a worker is syncing 000001.XSHE when the next trigger comes
+        claimed = await queue.claim(1)
+        self.assertTrue(claimed[0].startswith("000001.XSHE"))
+
+        with mock.patch("arrow.now", return_value=arrow.get("2020-1-7 15:00")):
+            await syncjobs.trigger_bars_sync(sync_params, force=True)
+        await asyncio.sleep(0.2)
+
+        # merged into the running sync, no new signal
+        self.assertEqual(1, len(sync_request))
+        self.assertEqual(run, await cache.sys.hget(key_run, "id"))
+        self.assertEqual("2", await cache.sys.hget(key_run, "triggers"))
+        self.assertEqual("2020-01-07", await cache.sys.hget(key_run, "stop"))
+
+        # the in-flight window is clipped, the pending one is replaced
+        jobs = await cache.sys.lrange(f"{queue.name}.{UNASSIGNED}", 0, -1)
+        self.assertListEqual(
+            ["000001.XSHE,20200106,20200107,2", "000004.XSHE,20191231,20200107,5"],
+            jobs,
+        )
+
+        # 2 jobs at start, 2 merged and 1 of them replaced a pending one
+        self.assertEqual("3", await cache.sys.hget(key_run, "enqueued"))
+
+        sync_done = []
+
+        async def on_sync_done(params: dict):
+            sync_done.append(params)
+
+        emit.register(Events.OMEGA_SYNC_DONE, on_sync_done)
+
+        # the run finishes when the last job is acked, and only once
+        acked = await queue.ack(*claimed)
+        self.assertIsNone(await syncjobs._advance_run(FrameType.DAY, done=acked))
+        self.assertEqual(0, await queue.ack(*claimed))
+
+        self.assertIsNotNone(await cache.sys.get("jobs.bars_sync.start"))
+        self.assertIsNone(await cache.sys.get("jobs.bars_sync.elapsed"))
+
+        acked = await queue.ack(*(await queue.claim(2)))
+        elapsed = await syncjobs._advance_run(FrameType.DAY, done=acked)
+        self.assertIsNotNone(elapsed)
+        self.assertIsNone(await syncjobs._advance_run(FrameType.DAY, done=1))
+        self.assertIsNotNone(await cache.sys.get("jobs.bars_sync.stop"))
+        self.assertEqual(
+            int(elapsed), int(await cache.sys.get("jobs.bars_sync.elapsed"))
+        )
+
+        await asyncio.sleep(0.2)
+        self.assertEqual(1, len(sync_done))
+        self.assertEqual(run, sync_done[0]["run"])
+        self.assertEqual(arrow.get("2020-01-07").date(), sync_done[0]["stop"])
+
+        # a new trigger can't be merged into the finished run
+        self.assertIsNone(
+            await syncjobs._merge_run(FrameType.DAY, arrow.get("2020-01-08").date(), 1)
+        )
+
+    async def test_on_bars_sync_done(self):
+        sync_params = {
+            "frame": "1d",
+            "include": "000001.XSHE",
+            "resample": ["1w"],
+            "then": ["resample", "unknown", "validate"],
+        }
+        params = {
+            "frame_type": FrameType.DAY,
+            "run": "unittest",
+            "start": arrow.get("2020-01-02").date(),
+            "stop": arrow.get("2020-01-10").date(),
+        }
+
+        # per job resampling is deferred to the stage
+        self.assertListEqual([], syncjobs._job_resample_targets(sync_params))
+
+        resampler = mock.AsyncMock(return_value=0)
+        validator = mock.AsyncMock(side_effect=ValueError())
+        with mock.patch.dict(
+            syncjobs._stages, {"resample": resampler, "validate": validator}
+        ):
+            with mock.patch(
+                "omega.jobs.syncjobs.load_sync_params", return_value=sync_params
+            ):
+                await syncjobs.on_bars_sync_done(params)
+
+        resampler.assert_awaited_once_with(
+            FrameType.DAY, params["start"], params["stop"], sync_params
+        )
+        validator.assert_awaited_once()
+
+    async def test_resample_stage(self):
+        sync_params = {"frame": "1d", "include": "000001.XSHE", "resample": ["1w"]}
+        jobs = ["000001.XSHE,20200108,20200110,3", "000004.XSHE,20200110,20200110,1"]
+        await syncjobs._save_windows(FrameType.DAY, jobs)
+
+        # a merged job only moves the start backward
+        merged = ["000001.XSHE,20200109,20200110,2", "000004.XSHE,20200107,20200110,4"]
+        await syncjobs._save_windows(FrameType.DAY, merged, merge=True)
+        self.assertDictEqual(
+            {"000001.XSHE": 20200108, "000004.XSHE": 20200107},
+            await syncjobs.get_run_windows(FrameType.DAY),
+        )
+
+        start = arrow.get("2020-01-02").date()
+        stop = arrow.get("2020-01-10").date()
+        resampler = mock.AsyncMock(return_value=1)
+        with mock.patch("omega.jobs.syncjobs.resample_bars_for_window", resampler):
+            saved = await syncjobs.resample_stage(
+                FrameType.DAY, start, stop, sync_params
+            )
+
+            # only the synced frames are resampled, not the whole [start, stop]
+            self.assertEqual(2, saved)
+            resampler.assert_any_await(
+                "000001.XSHE",
+                FrameType.DAY,
+                [FrameType.WEEK],
+                arrow.get("2020-01-08").date(),
+                stop,
+                3,
+            )
+
+            # nothing recorded, resample the last frame only
+            await cache.sys.delete("jobs.bars_sync.windows.1d")
+            resampler.reset_mock()
+            await syncjobs.resample_stage(FrameType.DAY, start, stop, sync_params)
+            resampler.assert_awaited_once_with(
+                "000001.XSHE", FrameType.DAY, [FrameType.WEEK], stop, stop, 1
+            )
+
+    async def test_validate_stage(self):
+        sync_params = {"frame": "1d", "include": "000001.XSHE 000004.XSHE"}
+        await cache.security.hset("000001.XSHE:1d", "tail", 20200110)
+        await cache.security.hset("000004.XSHE:1d", "tail", 20200109)
+
+        stop = arrow.get("2020-01-10").date()
+        with mock.patch("arrow.now", return_value=arrow.get("2020-01-10 15:05")):
+            behind = await syncjobs.validate_stage(
+                FrameType.DAY, stop, stop, sync_params
+            )
+
+        self.assertListEqual(["000004.XSHE"], behind)
+
+    async def test_save_suspended_bars(self):
+        code = "000001.XSHE"
+        await cache.security.delete(f"{code}:30m")
+        await cache.sys.delete("jobs.bars_sync.checkpoint.30m")
+        await cache.security.zadd(f"{code}:suspended", 20200511, 20200511)
+
+        jobs = [f"{code},202005111000,202005111500,8"]
+        plan = mock.AsyncMock(return_value=jobs)
+        get_bars = mock.AsyncMock()
+        with mock.patch("omega.jobs.syncjobs.plan_bars_sync", plan):
+            with mock.patch.object(aq, "get_bars", get_bars):
+                start = arrow.get("2020-05-11 10:00", tzinfo=cfg.tz).datetime
+                stop = arrow.get("2020-05-11 15:00", tzinfo=cfg.tz).datetime
+                actual = await syncjobs._plan_jobs([code], FrameType.MIN30, start, stop)
+
+        self.assertListEqual([], actual)
+        get_bars.assert_not_called()
+
+        # filled locally, nothing is left to sync for the code
+        self.assertDictEqual(
+            {code: 202005111500},
+            await syncjobs.get_checkpoints([code], FrameType.MIN30),
+        )
+
+        bars = await cache.get_bars(code, stop, 8, FrameType.MIN30)
+        self.assertEqual(8, len(bars))
+        self.assertTrue(np.all(np.isnan(bars["close"])))
+
+        await cache.security.delete(f"{code}:suspended", f"{code}:30m")
+
+    async def test_checkpoints(self):
+        key = "jobs.bars_sync.checkpoint.1d"
+        await cache.sys.delete(key)
+
+        jobs = ["000001.XSHE,20200102,20200106,3", "000004.XSHE,20191230,20200102,3"]
+        with mock.patch("arrow.now", return_value=arrow.get("2020-01-06 15:05")):
+            await syncjobs.save_checkpoints(FrameType.DAY, jobs)
+
+            # checkpoints never go backward
+            await syncjobs.save_checkpoints(
+                FrameType.DAY, ["000001.XSHE,20191225,20191231,4"]
+            )
+
+        self.assertDictEqual(
+            {"000001.XSHE": 20200106, "000004.XSHE": 20200102, "000002.XSHE": None},
+            await syncjobs.get_checkpoints(
+                ["000001.XSHE", "000004.XSHE", "000002.XSHE"], FrameType.DAY
+            ),
+        )
+
+    async def test_resume_bars_sync(self):
+        sync_params = {
+            "frame": "1d",
+            "start": "2020-01-01",
+            "cat": [],
+            "include": "000001.XSHE 000004.XSHE",
+        }
+        await cache.sys.delete("jobs.bars_sync.checkpoint.1d")
+
+        sync_request = []
+
+        async def on_sync_bars(params: dict):
+            sync_request.append(params)
+
+        emit.register(Events.OMEGA_DO_SYNC, on_sync_bars)
+
+        queue = syncjobs.ShardedWorkQueue("jobs.bars_sync.scope.1d")
+        trigger = mock.AsyncMock()
+        with mock.patch("arrow.now", return_value=arrow.get("2020-01-06 15:05")):
+            with mock.patch("omega.jobs.syncjobs.trigger_bars_sync", trigger):
+                # an unfinished run is resumed, without re-planning
+                await queue.reset(["000001.XSHE,20200102,20200106,3"], [])
+                start = arrow.get("2020-01-02").date()
+                stop = arrow.get("2020-01-06").date()
+                await syncjobs._start_run(FrameType.DAY, start, stop, 1)
+
+                actual = await syncjobs.resume_bars_sync(sync_params)
+                self.assertEqual("resume", actual)
+                await asyncio.sleep(0.2)
+                self.assertEqual(1, len(sync_request))
+                trigger.assert_not_called()
+
+                # nothing in the queue, but some codes are behind
+                await queue.reset([], [])
+                await syncjobs.save_checkpoints(
+                    FrameType.DAY, ["000001.XSHE,20200102,20200106,3"]
+                )
+                actual = await syncjobs.resume_bars_sync(sync_params)
+                self.assertEqual("catch-up", actual)
+                trigger.assert_called_once()
+
+                # all synced
+                await syncjobs.save_checkpoints(
+                    FrameType.DAY, ["000004.XSHE,20200102,20200106,3"]
+                )
+                self.assertIsNone(await syncjobs.resume_bars_sync(sync_params))
+
+    async def test_resume_up_to_date(self):
+        """codes with nothing to sync still have their checkpoints recorded"""
+        sync_params = {
+            "frame": "1d",
+            "start": "2020-01-01",
+            "cat": [],
+            "include": "000001.XSHE 000004.XSHE",
+        }
+        await cache.sys.delete("jobs.bars_sync.checkpoint.1d")
+        await syncjobs.ShardedWorkQueue("jobs.bars_sync.scope.1d").reset([], [])
+
+        plan = mock.AsyncMock(return_value=[])
+        with mock.patch("arrow.now", return_value=arrow.get("2020-01-06 15:05")):
+            with mock.patch("omega.jobs.syncjobs.plan_bars_sync", plan):
+                # nothing was recorded yet, the planner finds nothing to do
+                self.assertEqual(
+                    "catch-up", await syncjobs.resume_bars_sync(sync_params)
+                )
+                plan.assert_awaited_once()
+
+                for _ in range(2):
+                    self.assertIsNone(await syncjobs.resume_bars_sync(sync_params))
+                plan.assert_awaited_once()
+
+        self.assertDictEqual(
+            {"000001.XSHE": 20200106, "000004.XSHE": 20200106},
+            await syncjobs.get_checkpoints(
+                ["000001.XSHE", "000004.XSHE"], FrameType.DAY
+            ),
+        )
+
+    async def test_choose_codes(self):
+        secs = Securities()
+        choose = mock.Mock(return_value=["000001.XSHE", "000001.XSHG"])
+        with mock.patch.object(secs, "choose", choose):
+            syncjobs._chosen.clear()
+            for _ in range(2):
+                codes = syncjobs.choose_codes(["stock"], "000004.XSHE", "000001.XSHG")
+                self.assertListEqual(["000001.XSHE", "000004.XSHE"], codes)
+            choose.assert_called_once()
+
+            # a different config
+            syncjobs.choose_codes(["stock"], "", "")
+            self.assertEqual(2, choose.call_count)
+
+            # the security list is updated
+            with mock.patch.object(secs, "load", mock.AsyncMock()):
+                await syncjobs.on_security_list_updated()
+            syncjobs.choose_codes(["stock"], "000004.XSHE", "000001.XSHG")
+            self.assertEqual(3, choose.call_count)
+
+        syncjobs._chosen.clear()
+
     async def test_parse_sync_params(self):
         """
         2020年元旦前后交易日如下：
@@ -394,6 +735,169 @@ class TestSyncJobs(unittest.IsolatedAsyncioTestCase):
         _, _, start, stop, *_ = syncjobs.parse_sync_params(**sync_params)
         await self._sync_and_check(code, frame_type, start, stop)
 
+    async def test_sync_bars_batch(self):
+        """sync bars for FrameType.DAY in batch mode
+
+        trade days:
+        20200430, 20200506, 20200507, 20200508, 20200511, 20200512,
+        20200513, 20200514, 20200515, 20200518, 20200519, 20200520,
+        """
+        codes = ["000001.XSHE", "000001.XSHG"]
+        frame_type = FrameType.DAY
+        start = arrow.get("2020-05-08").date()
+        stop = arrow.get("2020-05-20").date()
+
+        for code in codes:
+            await cache.security.delete(f"{code}:{frame_type.value}")
+
+        # one code is empty, the other one needs both head and tail
+        await aq.get_bars("000001.XSHG", arrow.get("2020-05-14").date(), 3, frame_type)
+
+        await syncjobs.sync_bars(
+            {
+                "frame_type": frame_type,
+                "start": start,
+                "stop": stop,
+                "secs": codes.copy(),
+                "batch": 10,
+            }
+        )
+
+        for code in codes:
+            head, tail = await cache.get_bars_range(code, frame_type)
+            self.assertEqual(start, head)
+            self.assertEqual(stop, tail)
+
+            bars = await self._cache_get_bars_all(code, frame_type)
+            self.assertEqual(tf.count_frames(start, stop, frame_type), len(bars))
+
+    async def test_sync_bars_concurrency(self):
+        codes = ["000001.XSHE", "000001.XSHG", "600000.XSHG"]
+        frame_type = FrameType.DAY
+        start = arrow.get("2020-05-08").date()
+        stop = arrow.get("2020-05-20").date()
+
+        for code in codes:
+            await cache.security.delete(f"{code}:{frame_type.value}")
+
+        await syncjobs.sync_bars(
+            {
+                "frame_type": frame_type,
+                "start": start,
+                "stop": stop,
+                "secs": codes.copy(),
+                "concurrency": 2,
+            }
+        )
+
+        for code in codes:
+            head, tail = await cache.get_bars_range(code, frame_type)
+            self.assertEqual(start, head)
+            self.assertEqual(stop, tail)
+
+        # quota error aborts all tasks, other errors are isolated per task
+        synced = []
+
+        for code in ["000001.XSHE", "000001.XSHG", "600000.XSHG", "000004.XSHE"]:
+            await cache.security.delete(f"{code}:{frame_type.value}")
+
+        async def fake_sync(code, *args):
+            synced.append(code)
+            if code == "000001.XSHE":
+                raise ValueError("bad data")
+            if code == "000001.XSHG":
+                raise omega.jobs.syncjobs.FetcherQuotaError("quota")
+
+        params = {
+            "frame_type": frame_type,
+            "start": start,
+            "stop": stop,
+            "concurrency": 2,
+        }
+        with mock.patch(
+            "omega.jobs.syncjobs.sync_bars_for_window", side_effect=fake_sync
+        ):
+            await syncjobs.sync_bars({**params, "secs": ["600000.XSHG", "000001.XSHE"]})
+            self.assertListEqual(["000001.XSHE", "600000.XSHG"], synced)
+
+            synced.clear()
+            secs = ["000001.XSHG", "000004.XSHE"]
+            await syncjobs.sync_bars({**params, "secs": secs})
+            self.assertListEqual(["000001.XSHG"], synced)
+
+    async def test_sync_bars_resample(self):
+        """sync day bars, and resample them to week bars
+
+        trade days:
+        20200430, 20200506, 20200507, 20200508, 20200511, 20200512,
+        20200513, 20200514, 20200515, 20200518, 20200519, 20200520,
+        """
+        code = "000001.XSHE"
+        start = arrow.get("2020-05-06").date()
+        stop = arrow.get("2020-05-19").date()
+
+        for frame_type in [FrameType.DAY, FrameType.WEEK]:
+            await cache.security.delete(f"{code}:{frame_type.value}")
+
+        await syncjobs.sync_bars(
+            {
+                "frame_type": FrameType.DAY,
+                "start": start,
+                "stop": stop,
+                "secs": [code],
+                "resample": [FrameType.WEEK],
+            }
+        )
+
+        # the week ends at 20200522 is not finished yet
+        head, tail = await cache.get_bars_range(code, FrameType.WEEK)
+        self.assertEqual(datetime.date(2020, 5, 8), head)
+        self.assertEqual(datetime.date(2020, 5, 15), tail)
+
+        days = await cache.get_bars(code, tail, 5, FrameType.DAY)
+        weeks = await cache.get_bars(code, tail, 1, FrameType.WEEK)
+        self.assertAlmostEqual(days["close"][-1], weeks["close"][0], places=2)
+        self.assertAlmostEqual(np.max(days["high"]), weeks["high"][0], places=2)
+
+    async def test_sync_bars_resample_failed(self):
+        """only the jobs synced successfully are resampled"""
+        jobs = ["000001.XSHE,20200506,20200519,10", "000004.XSHE,20200506,20200519,10"]
+        plan = mock.AsyncMock(return_value=list(jobs))
+        sync = mock.AsyncMock(side_effect=[ValueError("oops"), 10])
+        resampler = mock.AsyncMock()
+        with mock.patch("omega.jobs.syncjobs._plan_jobs", plan), mock.patch(
+            "omega.jobs.syncjobs.sync_bars_for_window", sync
+        ), mock.patch("omega.jobs.syncjobs._resample_job", resampler):
+            await syncjobs.sync_bars(
+                {
+                    "frame_type": FrameType.DAY,
+                    "start": arrow.get("2020-05-06").date(),
+                    "stop": arrow.get("2020-05-19").date(),
+                    "secs": ["000001.XSHE", "000004.XSHE"],
+                    "resample": [FrameType.WEEK],
+                }
+            )
+
+        self.assertEqual(2, sync.await_count)
+        resampler.assert_awaited_once_with(jobs[1], FrameType.DAY, [FrameType.WEEK])
+
+    async def test_load_bars_sync_jobs_resample(self):
+        origin = cfg.omega.sync.bars
+        try:
+            cfg.omega.sync.bars = [
+                {"frame": "1m", "include": "000001.XSHE", "resample": ["60m"]},
+                {"frame": "60m", "include": "000001.XSHE"},
+            ]
+
+            scheduler = AsyncIOScheduler(timezone=cfg.tz)
+            syncjobs.load_bars_sync_jobs(scheduler)
+
+            actual = set([job.name for job in scheduler.get_jobs()])
+            self.assertNotIn("60m:10:30", actual)
+            self.assertIn("1m:10:*", actual)
+        finally:
+            cfg.omega.sync.bars = origin
+
     async def test_sync_bars_006(self):
         """sync bars after archive data imported
 
@@ -610,14 +1114,16 @@ class TestSyncJobs(unittest.IsolatedAsyncioTestCase):
                 logger.exception(e)
                 pass
 
-        async def bypass_hset(*args):
+        async def bypass_eval(*args, **kwargs):
             return 1
 
         emit.register(Events.OMEGA_DO_SYNC, on_sync_bars)
 
+        plan = mock.AsyncMock(return_value=["000001.XSHE,202001030945,202001061500,32"])
         with mock.patch("arrow.now", return_value=arrow.get("2020-01-06 15:05")):
-            with mock.patch("omicron.cache.security.hset", side_effect=bypass_hset):
-                await syncjobs.closing_quotation_sync_bars(all_params)
+            with mock.patch("omicron.cache.security.eval", side_effect=bypass_eval):
+                with mock.patch("omega.jobs.syncjobs.plan_bars_sync", plan):
+                    await syncjobs.closing_quotation_sync_bars(all_params)
 
         await asyncio.sleep(2)
         self.assertDictEqual(
@@ -629,6 +1135,50 @@ class TestSyncJobs(unittest.IsolatedAsyncioTestCase):
             sync_request,
         )
 
+    async def test_reconcile_bars_batch(self):
+        codes = ["000001.XSHE", "000001.XSHG"]
+        frame_type = FrameType.MIN30
+        day = arrow.get("2020-05-12").date()
+        end = datetime.datetime(2020, 5, 12, 15)
+
+        for code in codes:
+            await cache.security.delete(f"{code}:{frame_type.value}")
+            await aq.get_bars(code, end, 8, frame_type)
+
+        key = f"000001.XSHE:{frame_type.value}"
+        expected = await cache.security.hget(key, "202005121500")
+        corrupted = "0.00 0.00 0.00 0.00 0 0.00 1.00"
+        await cache.security.hset(key, "202005121500", corrupted)
+
+        rewritten = await syncjobs.reconcile_bars_batch(codes, frame_type, day)
+        self.assertListEqual(["000001.XSHE"], rewritten)
+        self.assertEqual(expected, await cache.security.hget(key, "202005121500"))
+
+        head, tail = await cache.get_bars_range("000001.XSHE", frame_type)
+        self.assertEqual(end, tail)
+
+        # nothing to rewrite once reconciled
+        self.assertListEqual(
+            [], await syncjobs.reconcile_bars_batch(codes, frame_type, day)
+        )
+
+    async def test_reset_tail(self):
+        codes = ["000001.XSHE", "000001.XSHG", "000004.XSHE"]
+        await cache.security.hset("000001.XSHE:1d", "tail", 20200106)
+        await cache.security.hset("000001.XSHG:1d", "tail", 20200102)
+        await cache.security.delete("000004.XSHE:1d")
+
+        with mock.patch("arrow.now", return_value=arrow.get("2020-01-06 15:05")):
+            with mock.patch("omega.jobs.syncjobs._RESET_TAIL_CHUNK", 2):
+                date, moved = await syncjobs.reset_tail(codes, FrameType.DAY)
+
+        self.assertEqual("2020-01-03", date)
+        self.assertEqual(1, moved)
+        tails = [
+            await cache.security.hget(f"{code}:1d", "tail") for code in codes
+        ]
+        self.assertListEqual(["20200103", "20200102", None], tails)
+
     async def _test_200_validation(self):
         # fixme: recover later. All validation/checksum related cases need to be redesigned.
         await self.prepare_checksum_data()
@@ -732,6 +1282,13 @@ class TestSyncJobs(unittest.IsolatedAsyncioTestCase):
 
     async def test_sync_security_list(self):
         await cache.security.delete("securities")
-        await syncjobs.sync_security_list()
-        secs = await cache.get_securities()
-        self.assertTrue(len(secs) > 0)
+        emit = "omega.fetcher.abstract_quotes_fetcher.emit.emit"
+        with mock.patch(emit) as emitted:
+            await syncjobs.sync_security_list()
+            secs = await cache.get_securities()
+            self.assertTrue(len(secs) > 0)
+            self.assertEqual(1, emitted.call_count)
+
+            # unchanged, no reload is triggered
+            await syncjobs.sync_security_list()
+            self.assertEqual(1, emitted.call_count)
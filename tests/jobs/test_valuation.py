@@ -0,0 +1,129 @@
+import datetime
+import unittest
+from unittest import mock
+
+import cfg4py
+import numpy as np
+import omicron
+from omicron import cache
+
+from omega.fetcher.abstract_quotes_fetcher import AbstractQuotesFetcher as aq
+from omega.jobs import valuation
+from omega.jobs.sharding import ShardedWorkQueue
+from tests import init_test_env
+
+cfg = cfg4py.get_instance()
+
+
+class TestValuation(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        init_test_env()
+
+        fetcher_info = cfg.quotes_fetchers[0]
+        await aq.create_instance(fetcher_info["impl"], **fetcher_info["workers"][0])
+        await omicron.init(aq)
+
+        keys = await cache.sys.keys("jobs.valuation.*")
+        if keys:
+            await cache.sys.delete(*keys)
+
+        self.codes = ["000001.XSHE", "000002.XSHE", "600000.XSHG"]
+
+    async def asyncTearDown(self) -> None:
+        await omicron.shutdown()
+
+    async def fake_valuation(self, codes, day):
+        return np.array(
+            [(code, 10.0, day) for code in codes],
+            dtype=[("code", "O"), ("pe", "f4"), ("frame", "O")],
+        )
+
+    async def test_sync_valuation(self):
+        """
+        trade days:
+        20200430, 20200506, 20200507, 20200508, 20200511, 20200512,
+        """
+        now = datetime.datetime(2020, 5, 12, 16)
+        choose = mock.patch(
+            "omega.jobs.valuation.Securities.choose", return_value=self.codes
+        )
+        with mock.patch("arrow.now", return_value=now), choose, mock.patch(
+            "omega.jobs.valuation.emit.emit"
+        ) as emitted:
+            await cache.sys.zadd("jobs.valuation.days", 20200508, "20200508")
+
+            n = await valuation.trigger_valuation_sync({"chunk": 2, "days": 3})
+
+            # 20200508 is synced already, 2 chunks for each of the rest
+            self.assertEqual(4, n)
+            self.assertEqual(1, emitted.call_count)
+            self.assertDictEqual(
+                {"0": "000001.XSHE,000002.XSHE", "1": "600000.XSHG"},
+                await cache.sys.hgetall("jobs.valuation.pending.20200511"),
+            )
+
+        with mock.patch.object(
+            aq, "get_valuation", side_effect=self.fake_valuation
+        ) as fetched:
+            await valuation.sync_valuation()
+
+        self.assertEqual(4, fetched.call_count)
+        self.assertEqual((0, 0), await ShardedWorkQueue("jobs.valuation.scope").size())
+        self.assertListEqual(
+            [20200508, 20200511, 20200512],
+            await valuation.get_synced_days(20200501, 20200512),
+        )
+        self.assertListEqual([], await cache.sys.keys("jobs.valuation.pending.*"))
+
+        # nothing to backfill
+        with mock.patch("arrow.now", return_value=now):
+            self.assertEqual(0, await valuation.trigger_valuation_sync({"days": 3}))
+
+    async def test_retrigger(self):
+        now = datetime.datetime(2020, 5, 12, 16)
+        choose = mock.patch(
+            "omega.jobs.valuation.Securities.choose", return_value=self.codes
+        )
+        queue = ShardedWorkQueue("jobs.valuation.scope")
+        with mock.patch("arrow.now", return_value=now), choose, mock.patch(
+            "omega.jobs.valuation.emit.emit"
+        ):
+            params = {"chunk": 1, "days": 1}
+            self.assertEqual(3, await valuation.trigger_valuation_sync(params))
+
+            # the day is half finished
+            job = (await queue.claim(1))[0]
+            with mock.patch.object(
+                aq, "get_valuation", side_effect=self.fake_valuation
+            ):
+                await valuation.sync_valuation_chunk(job)
+            await queue.ack(job)
+
+            # the rest are still in the queue, nothing is queued again
+            self.assertEqual(0, await valuation.trigger_valuation_sync(params))
+            self.assertEqual((2, 0), await queue.size())
+
+            # the queue is lost, only the unfinished groups are queued again
+            await queue.reset([], [])
+            self.assertEqual(2, await valuation.trigger_valuation_sync(params))
+            items = await queue.items()
+            self.assertEqual(2, len(items))
+            self.assertNotIn(job, items)
+            self.assertEqual(2, await cache.sys.hlen("jobs.valuation.pending.20200512"))
+
+    async def test_sync_valuation_chunk(self):
+        key = "jobs.valuation.pending.20200511"
+        await cache.sys.hmset_dict(key, {"0": "000001.XSHE", "1": "000002.XSHE"})
+
+        with mock.patch.object(aq, "get_valuation", side_effect=self.fake_valuation):
+            self.assertEqual(1, await valuation.sync_valuation_chunk("0,20200511"))
+            self.assertListEqual([], await valuation.get_synced_days(0, 20200511))
+
+            # done by others already
+            self.assertEqual(0, await valuation.sync_valuation_chunk("0,20200511"))
+
+            # the last chunk of the day
+            self.assertEqual(1, await valuation.sync_valuation_chunk("1,20200511"))
+            self.assertListEqual(
+                [20200511], await valuation.get_synced_days(0, 20200511)
+            )
@@ -0,0 +1,66 @@
+import unittest
+from unittest import mock
+
+import omicron
+from omicron import cache
+
+from omega.jobs.workqueue import WorkQueue
+from tests import init_test_env
+
+
+class TestWorkQueue(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        init_test_env()
+        await omicron.init()
+
+        self.queue = WorkQueue("unittest.workqueue", lease=10)
+        await self.queue.reset(["000001.XSHE", "000001.XSHG", "600000.XSHG"])
+
+    async def asyncTearDown(self) -> None:
+        await cache.sys.delete(self.queue.name, self.queue.key_leases)
+        await omicron.shutdown()
+
+    async def test_claim_ack(self):
+        codes = await self.queue.claim(2)
+        self.assertListEqual(["000001.XSHE", "000001.XSHG"], codes)
+        self.assertEqual((1, 2), await self.queue.size())
+
+        self.assertEqual(2, await self.queue.ack(*codes))
+        self.assertEqual((1, 0), await self.queue.size())
+
+        # acked already
+        self.assertEqual(0, await self.queue.ack(*codes))
+
+        self.assertListEqual(["600000.XSHG"], await self.queue.claim(2))
+        self.assertListEqual([], await self.queue.claim(2))
+
+    async def test_release(self):
+        codes = await self.queue.claim(2)
+        await self.queue.release(*codes)
+
+        self.assertEqual((3, 0), await self.queue.size())
+        self.assertListEqual(codes, await self.queue.claim(2))
+
+    async def test_reclaim_expired(self):
+        codes = await self.queue.claim(3)
+        self.assertEqual((0, 3), await self.queue.size())
+
+        # the worker died, and its leases expire
+        with mock.patch("time.time", return_value=2 ** 31):
+            self.assertListEqual(codes, await self.queue.claim(3))
+
+    async def test_merge(self):
+        # nobody is working on the queue
+        self.assertIsNone(await self.queue.merge(["000001.XSHE,1"]))
+
+        await self.queue.reset(["000001.XSHE,0", "000001.XSHG,0", "600000.XSHG,0"])
+        claimed = await self.queue.claim(1)
+        self.assertListEqual(claimed, await self.queue.leased())
+
+        # 000001.XSHG,0 is replaced
+        self.assertEqual(1, await self.queue.merge(["000001.XSHG,1", "000004.XSHE,1"]))
+        self.assertListEqual(
+            ["600000.XSHG,0", "000001.XSHG,1", "000004.XSHE,1"],
+            await cache.sys.lrange(self.queue.name, 0, -1),
+        )
+        self.assertEqual((3, 1), await self.queue.size())